@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import contextlib
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+
+# Batch layout: one dataset directory per account under the batch root, named user=<id>
+BATCH_PATH = "spotify_batch"
+USER_PREFIX = "user="
+
+# Cross-user summary written next to the per-user reports
+ALL_USERS_NAME = "all_users.json"
+
+# Cross-user distinct counts are merged HyperLogLog sketches of these columns
+CROSS_USER_DISTINCT_COLUMNS = ['track_name', 'artist_name']
+
+# ProcessPoolExecutor can only replace a worker after each task from Python 3.11;
+# older versions reuse workers, so memory a user leaves behind stays for the next one
+RECYCLE_WORKERS = sys.version_info >= (3, 11)
+
+
+def find_user_exports(exports_dir):
+    """
+    Per-user export directories: every subdirectory holding Spotify JSON files
+
+    Parameters:
+    exports_dir (str): Directory with one subdirectory of export files per user
+
+    Returns:
+    dict: User id (the subdirectory name) to its export directory
+    """
+    users = {}
+    for name in sorted(os.listdir(exports_dir)):
+        path = os.path.join(exports_dir, name)
+        if os.path.isdir(path) and glob.glob(os.path.join(path, "*.json")):
+            users[name] = path
+    return users
+
+def user_dataset_path(batch_dir, user):
+    return os.path.join(batch_dir, f"{USER_PREFIX}{user}")
+
+def stored_users(batch_dir):
+    """
+    Users that already have a dataset under the batch root
+    """
+    if not os.path.isdir(batch_dir):
+        return []
+    return sorted(name[len(USER_PREFIX):] for name in os.listdir(batch_dir) if name.startswith(USER_PREFIX))
+
+def _limit_memory(max_memory_mb):
+    # Cap the address space of a worker so one oversized history cannot take the machine down
+    if max_memory_mb:
+        import resource
+        limit = max_memory_mb << 20
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _ingest_user(user, export_dir, dataset_dir):
+    from load_clean_save_input import ingest_directory
+    with contextlib.redirect_stdout(sys.stderr):
+        return ingest_directory(export_dir, dataset_dir)
+
+def _report_user(user, dataset_dir, output_dir, commands, render, sketch):
+    import data_analysis
+    from rollup import backfill_rollups
+    from sketches import sketch_dataset
+
+    user_output = os.path.join(output_dir, user)
+    os.makedirs(user_output, exist_ok=True)
+
+    with contextlib.redirect_stdout(sys.stderr):
+        results, chart_jobs = data_analysis.run_analyses(dataset_dir, commands, sketch=sketch)
+        if render:
+            data_analysis.render_charts(chart_jobs, output_dir=user_output, workers=1)
+
+        with open(os.path.join(user_output, "report.json"), 'w', encoding='utf-8') as file:
+            json.dump(data_analysis._jsonable(results), file, indent=2, ensure_ascii=False)
+
+        # Small, mergeable summaries for the cross-user report: cube totals and distinct-count sketches
+        backfill_rollups(dataset_dir)
+        cube = data_analysis.load_rollup_data(dataset_dir)
+        totals = data_analysis.get_aggregate(cube, 'totals')
+        summary = {
+            'user': user,
+            'hours': totals['minutes'] / 60,
+            'first_ts': totals['first_ts'].isoformat(),
+            'last_ts': totals['last_ts'].isoformat(),
+            'artist_minutes': data_analysis.get_aggregate(cube, 'artist_minutes'),
+            'sketch': sketch_dataset(dataset_dir, CROSS_USER_DISTINCT_COLUMNS),
+        }
+    return summary
+
+def _executor(workers, max_memory_mb):
+    # Workers are recycled after every user where Python supports it (max_tasks_per_child is new in 3.11)
+    recycle = {'max_tasks_per_child': 1} if RECYCLE_WORKERS else {}
+    return ProcessPoolExecutor(max_workers=workers, initializer=_limit_memory, initargs=(max_memory_mb,), **recycle)
+
+def _collect(futures, results, failed):
+    # Record each finished user; returns the users lost to a broken pool
+    broken = []
+    for future in as_completed(futures):
+        user = futures[future]
+        try:
+            results[user] = future.result()
+        except BrokenProcessPool:
+            broken.append(user)
+        except Exception as error:
+            failed[user] = f"{type(error).__name__}: {error}"
+    return broken
+
+def _run_pool(function, tasks, workers, max_memory_mb):
+    """
+    Run function(*task) for each user in recycled worker processes
+
+    Each worker handles a single user and then exits (on Python 3.11+), so
+    memory never builds up across users. A worker that dies (e.g. hitting the
+    memory cap) breaks the pool and takes every unfinished user with it; those
+    users are run again, each in a pool of its own, so only the user whose
+    worker dies there is marked failed.
+
+    Returns:
+    tuple: (user to result dict, user to error message dict)
+    """
+    results, failed = {}, {}
+    if not tasks:
+        return results, failed
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks)))
+    with _executor(workers, max_memory_mb) as executor:
+        broken = _collect({executor.submit(function, *task): task[0] for task in tasks}, results, failed)
+
+    retry = [task for task in tasks if task[0] in broken]
+    for start in range(0, len(retry), workers):
+        batch = retry[start:start + workers]
+        executors = [_executor(1, max_memory_mb) for _ in batch]
+        try:
+            futures = {executor.submit(function, *task): task[0] for executor, task in zip(executors, batch)}
+            for user in _collect(futures, results, failed):
+                failed[user] = "worker process died (memory limit?)"
+        finally:
+            for executor in executors:
+                executor.shutdown()
+
+    return results, failed
+
+def ingest_users(exports_dir, batch_dir=BATCH_PATH, workers=None, max_memory_mb=None):
+    """
+    Incrementally ingest every user's exports into its own dataset under the batch root
+
+    Parameters:
+    exports_dir (str): Directory with one subdirectory of export files per user
+    batch_dir (str): Batch root holding the user=<id> datasets
+    workers (int): Users ingested in parallel (default: one per CPU)
+    max_memory_mb (int): Address-space cap per worker process
+
+    Returns:
+    tuple: (user to new row count, user to error message)
+    """
+    users = find_user_exports(exports_dir)
+    print(f"Ingesting exports for {len(users)} users...")
+    tasks = [(user, export_dir, user_dataset_path(batch_dir, user)) for user, export_dir in users.items()]
+    return _run_pool(_ingest_user, tasks, workers, max_memory_mb)
+
+def merge_user_summaries(summaries, top_n=20):
+    """
+    Cross-user aggregates from the per-user summaries
+
+    Parameters:
+    summaries (list): Summaries returned by the report workers
+    top_n (int): Number of artists in the cross-user top list
+
+    Returns:
+    dict: Per-user totals, overall hours, merged distinct counts and top artists
+    """
+    artist_minutes = pd.concat([summary['artist_minutes'] for summary in summaries]) if summaries else pd.Series(dtype='float64')
+    by_artist = artist_minutes.groupby(level=0).agg(['sum', 'count']).sort_values('sum', ascending=False).head(top_n)
+
+    sketch = None
+    for summary in summaries:
+        sketch = summary['sketch'] if sketch is None else sketch.merge(summary['sketch'])
+
+    return {
+        'users': len(summaries),
+        'total_hours': sum(summary['hours'] for summary in summaries),
+        'per_user': {
+            summary['user']: {key: summary[key] for key in ('hours', 'first_ts', 'last_ts')} for summary in summaries
+        },
+        'distinct_tracks': sketch.distinct('track_name') if sketch and 'track_name' in sketch.distinct_sketches else None,
+        'distinct_artists': sketch.distinct('artist_name') if sketch and 'artist_name' in sketch.distinct_sketches else None,
+        'top_artists': [
+            {'artist': str(artist), 'minutes': float(row['sum']), 'listeners': int(row['count'])}
+            for artist, row in by_artist.iterrows()
+        ],
+    }
+
+def report_users(batch_dir=BATCH_PATH, output_dir='batch_reports', commands=None, render=False, sketch=None,
+                 workers=None, max_memory_mb=None):
+    """
+    Run the analyses for every stored user in parallel and write per-user and cross-user reports
+
+    Each user's report.json (and charts) go to <output_dir>/<user>/; the
+    cross-user summary goes to <output_dir>/all_users.json. Users are never
+    loaded into one frame: workers return only small summaries.
+
+    Parameters:
+    batch_dir (str): Batch root holding the user=<id> datasets
+    output_dir (str): Directory for the reports
+    commands (list): data_analysis CLI commands to run per user (default: all)
+    render (bool): Also render each user's charts as PNG
+    sketch (dict): Sketch-mode settings for data_analysis.enable_sketches, or None for exact results
+    workers (int): Users processed in parallel (default: one per CPU)
+    max_memory_mb (int): Address-space cap per worker process
+
+    Returns:
+    dict: Cross-user summary
+    """
+    from data_analysis import COMMANDS
+    commands = commands or list(COMMANDS)
+
+    users = stored_users(batch_dir)
+    print(f"Running {len(commands)} analyses for {len(users)} users...")
+    tasks = [(user, user_dataset_path(batch_dir, user), output_dir, commands, render, sketch) for user in users]
+    results, failed = _run_pool(_report_user, tasks, workers, max_memory_mb)
+
+    summary = merge_user_summaries([results[user] for user in users if user in results])
+    summary['failed'] = failed
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, ALL_USERS_NAME), 'w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2, ensure_ascii=False)
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest and analyze many users' Spotify exports")
+    parser.add_argument('exports', nargs='?', help="directory with one subdirectory of export files per user (skip to only report)")
+    parser.add_argument('--batch-dir', default=BATCH_PATH, help="root of the per-user datasets")
+    parser.add_argument('--output-dir', default='batch_reports', help="directory for per-user and cross-user reports")
+    parser.add_argument('--commands', nargs='+', default=None, help="data_analysis commands to run per user (default: all)")
+    parser.add_argument('--png', action='store_true', help="also render each user's charts")
+    parser.add_argument('--sketch', action='store_true', help="use sketches for distinct counts and top lists")
+    parser.add_argument('--workers', type=int, default=None, help="users processed in parallel")
+    parser.add_argument('--max-memory-mb', type=int, default=None, help="address-space cap per worker process")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    start_time = time.time()
+
+    if args.exports:
+        ingested, failed = ingest_users(args.exports, args.batch_dir, args.workers, args.max_memory_mb)
+        print(f"Ingested {sum(ingested.values())} new rows for {len(ingested)} users")
+        for user, error in failed.items():
+            print(f"  ! {user}: {error}")
+
+    summary = report_users(args.batch_dir, args.output_dir, args.commands, render=args.png,
+                           sketch={} if args.sketch else None, workers=args.workers, max_memory_mb=args.max_memory_mb)
+
+    print(f"\nReports for {summary['users']} users written to {args.output_dir}")
+    print(f"Total listening time across users: {summary['total_hours']:.2f} hours")
+    for user, error in summary['failed'].items():
+        print(f"  ! {user}: {error}")
+    print(f"Batch completed in {time.time() - start_time:.2f} seconds")
+
+if __name__ == "__main__":
+    main()
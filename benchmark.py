@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import threading
+import subprocess
+import contextlib
+import numpy as np
+import pandas as pd
+
+from instrumentation import current_rss, max_rss
+
+
+# Results of every run are appended here, one JSON object per line
+RESULTS_PATH = "benchmark_results.jsonl"
+
+# Spotify splits an export into files of roughly this many plays
+ROWS_PER_FILE = 15_000
+
+# Larger histories skip the in-memory load/preprocess stages and only run the streaming ingest
+IN_MEMORY_LIMIT = 5_000_000
+
+# Share of plays that are podcast episodes and audiobook chapters
+EPISODE_SHARE = 0.05
+AUDIOBOOK_SHARE = 0.01
+
+PLATFORMS = ['ios', 'android', 'windows', 'osx', 'web_player', 'Partner sonos_speaker']
+COUNTRIES = ['US', 'GB', 'DE', 'SE', 'BR']
+
+_SCALE_SUFFIXES = {'k': 1_000, 'm': 1_000_000}
+
+
+def parse_scale(text):
+    """
+    Row count from strings such as '10k', '1M' or '2500'
+    """
+    text = str(text).strip().lower().replace('_', '')
+    if text and text[-1] in _SCALE_SUFFIXES:
+        return int(float(text[:-1]) * _SCALE_SUFFIXES[text[-1]])
+    return int(text)
+
+def _zipf_sampler(rng, size, exponent):
+    # Bounded Zipf: rank r is drawn with probability proportional to 1 / r**exponent
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    cdf = np.cumsum(weights / weights.sum())
+    return lambda n: np.minimum(np.searchsorted(cdf, rng.random(n)), size - 1)
+
+def _nullable(values, mask):
+    values = values.astype(object)
+    values[~mask] = None
+    return values
+
+def generate_history(output_dir, rows, seed=0, artists=None, zipf_exponent=1.1, rows_per_file=ROWS_PER_FILE):
+    """
+    Write a synthetic Extended Streaming History export
+
+    Artists, tracks within an artist, shows and audiobooks follow Zipfian
+    popularity; plays are generated in file-sized blocks and written as they
+    are produced, so even 100M rows never have to fit in memory.
+
+    Parameters:
+    output_dir (str): Directory the JSON files are written to
+    rows (int): Number of plays
+    seed (int): Random seed, the same seed always produces the same files
+    artists (int): Number of artists (default grows with the square root of rows)
+    zipf_exponent (float): Skew of the popularity distributions
+    rows_per_file (int): Plays per JSON file
+
+    Returns:
+    list: Paths of the written files
+    """
+    rng = np.random.default_rng(seed)
+    artists = artists or int(np.clip(2 * np.sqrt(rows), 100, 200_000))
+    tracks_per_artist = 40
+    shows, episodes_per_show = max(10, artists // 20), 200
+    audiobooks, chapters_per_book = max(5, artists // 100), 30
+
+    pick_artist = _zipf_sampler(rng, artists, zipf_exponent)
+    pick_track = _zipf_sampler(rng, tracks_per_artist, zipf_exponent)
+    pick_show = _zipf_sampler(rng, shows, zipf_exponent)
+    pick_episode = _zipf_sampler(rng, episodes_per_show, zipf_exponent)
+    pick_book = _zipf_sampler(rng, audiobooks, zipf_exponent)
+    ips = np.array([f"192.168.{i // 256}.{i % 256}" for i in range(max(20, artists // 50))], dtype=object)
+
+    os.makedirs(output_dir, exist_ok=True)
+    clock = np.datetime64('2015-01-01T00:00:00', 's')
+    paths = []
+
+    for file_index, start in enumerate(range(0, rows, rows_per_file)):
+        n = min(rows_per_file, rows - start)
+
+        kind = rng.random(n)
+        is_episode = kind < EPISODE_SHARE
+        is_audiobook = (kind >= EPISODE_SHARE) & (kind < EPISODE_SHARE + AUDIOBOOK_SHARE)
+        is_track = ~is_episode & ~is_audiobook
+
+        artist = pick_artist(n)
+        track = pick_track(n)
+        show = pick_show(n)
+        episode = pick_episode(n)
+        book = pick_book(n)
+        chapter = rng.integers(0, chapters_per_book, n)
+
+        # Skipped plays stop early; other plays run close to a typical track length
+        length_ms = np.where(is_track, rng.normal(210_000, 40_000, n), rng.normal(1_800_000, 600_000, n)).clip(30_000)
+        skipped = rng.random(n) < 0.25
+        ms_played = np.where(skipped, length_ms * rng.random(n) * 0.3, length_ms).astype(np.int64)
+
+        # ts marks the end of a play; mostly back to back, with occasional breaks of a few hours
+        breaks = np.where(rng.random(n) < 0.08, rng.exponential(3 * 3600, n), rng.integers(0, 30, n))
+        seconds = np.cumsum(ms_played // 1000 + breaks.astype(np.int64))
+        ts = clock + seconds.astype('timedelta64[s]')
+        clock = ts[-1]
+
+        columns = {
+            'ts': np.char.add(np.datetime_as_string(ts, unit='s'), 'Z').astype(object),
+            'platform': np.array(PLATFORMS, dtype=object)[rng.integers(0, len(PLATFORMS), n)],
+            'ms_played': ms_played,
+            'conn_country': np.array(COUNTRIES, dtype=object)[pick_show(n) % len(COUNTRIES)],
+            'ip_addr': ips[rng.integers(0, len(ips), n)],
+            'master_metadata_track_name': _nullable(np.char.add(np.char.add('Track ', artist.astype(str)), np.char.add('-', track.astype(str))), is_track),
+            'master_metadata_album_artist_name': _nullable(np.char.add('Artist ', artist.astype(str)), is_track),
+            'master_metadata_album_album_name': _nullable(np.char.add(np.char.add('Album ', artist.astype(str)), np.char.add('-', (track // 10).astype(str))), is_track),
+            'spotify_track_uri': _nullable(np.char.add('spotify:track:', (artist * tracks_per_artist + track).astype(str)), is_track),
+            'episode_name': _nullable(np.char.add(np.char.add('Episode ', show.astype(str)), np.char.add('-', episode.astype(str))), is_episode),
+            'episode_show_name': _nullable(np.char.add('Show ', show.astype(str)), is_episode),
+            'spotify_episode_uri': _nullable(np.char.add('spotify:episode:', (show * episodes_per_show + episode).astype(str)), is_episode),
+            'audiobook_title': _nullable(np.char.add('Audiobook ', book.astype(str)), is_audiobook),
+            'audiobook_uri': _nullable(np.char.add('spotify:show:', book.astype(str)), is_audiobook),
+            'audiobook_chapter_uri': _nullable(np.char.add('spotify:episode:ab', (book * chapters_per_book + chapter).astype(str)), is_audiobook),
+            'audiobook_chapter_title': _nullable(np.char.add('Chapter ', chapter.astype(str)), is_audiobook),
+            'reason_start': np.where(rng.random(n) < 0.8, 'trackdone', 'clickrow').astype(object),
+            'reason_end': np.where(skipped, 'fwdbtn', 'trackdone').astype(object),
+            'shuffle': rng.random(n) < 0.4,
+            'skipped': skipped,
+            'offline': rng.random(n) < 0.02,
+            'offline_timestamp': np.full(n, None, dtype=object),
+            'incognito_mode': np.zeros(n, dtype=bool),
+        }
+        names = list(columns)
+        values = [column.tolist() for column in columns.values()]
+        records = [dict(zip(names, row)) for row in zip(*values)]
+
+        path = os.path.join(output_dir, f"Streaming_History_Audio_{file_index:05d}.json")
+        with open(path, 'w', encoding='utf-8') as file:
+            # dumps uses the C encoder; dump would stream through the pure Python one
+            file.write(json.dumps(records))
+        paths.append(path)
+
+    return paths
+
+class StageTimer:
+    """
+    Wall time and peak RSS of each benchmark stage
+
+    Peak RSS during a stage is sampled from /proc by a background thread;
+    ru_maxrss (a lifetime high-water mark) and the peak of pool worker
+    processes are recorded alongside.
+    """
+
+    def __init__(self, sample_interval=0.01):
+        self.sample_interval = sample_interval
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **details):
+        start_rss = current_rss()
+        peak = [start_rss or 0]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(self.sample_interval):
+                rss = current_rss()
+                if rss is not None:
+                    peak[0] = max(peak[0], rss)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        print(f"  - {name}")
+        start_time = time.perf_counter()
+        try:
+            yield details
+        finally:
+            elapsed = time.perf_counter() - start_time
+            done.set()
+            sampler.join()
+            end_rss = current_rss()
+            self.stages.append({
+                'stage': name,
+                'wall_seconds': elapsed,
+                'rss_start_bytes': start_rss,
+                'rss_end_bytes': end_rss,
+                'peak_rss_bytes': max(peak[0], end_rss or 0) if start_rss is not None else max_rss(),
+                'max_rss_bytes': max_rss(),
+                'children_max_rss_bytes': max_rss(children=True),
+                **details,
+            })
+            print(f"    {elapsed:.2f} s, peak RSS {self.stages[-1]['peak_rss_bytes'] / 2**20:.0f} MiB")
+
+@contextlib.contextmanager
+def _quiet():
+    # Stage progress prints would swamp the timings
+    with open(os.devnull, 'w') as sink, contextlib.redirect_stdout(sink):
+        yield
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(rows, work_dir, seed=0, in_memory=None, render=True, workers=None):
+    """
+    Generate a history of the given size and time every pipeline stage on it
+
+    Stages: in-memory load and preprocess (small histories only), streaming
+    ingest, loading the analysis columns, each data_analysis command on its
+    own (no shared aggregates) and rendering all charts.
+
+    Parameters:
+    rows (int): Number of plays to generate
+    work_dir (str): Scratch directory for the exports, dataset and charts
+    seed (int): Generator seed
+    in_memory (bool): Run the in-memory load/preprocess stages (default: rows <= IN_MEMORY_LIMIT)
+    render (bool): Time chart rendering
+    workers (int): Worker processes for loading and rendering
+
+    Returns:
+    dict: Run metadata and per-stage results
+    """
+    from load_clean_save_input import load_spotify_data, preprocess_data, ingest_directory
+    import data_analysis
+
+    exports_dir = os.path.join(work_dir, f"exports_{rows}_{seed}")
+    dataset_dir = os.path.join(work_dir, f"dataset_{rows}_{seed}")
+    charts_dir = os.path.join(work_dir, "charts")
+    timer = StageTimer()
+
+    print(f"\nBenchmarking {rows} rows")
+    if not os.path.isdir(exports_dir):
+        print("  - Generating synthetic history")
+        generate_history(exports_dir, rows, seed=seed)
+    bytes_on_disk = sum(entry.stat().st_size for entry in os.scandir(exports_dir))
+
+    if in_memory if in_memory is not None else rows <= IN_MEMORY_LIMIT:
+        with timer.stage('load', bytes=bytes_on_disk):
+            with _quiet():
+                df = load_spotify_data(exports_dir, workers=workers)
+        with timer.stage('preprocess', rows=len(df)):
+            with _quiet():
+                preprocess_data(df, lean=True)
+        del df
+
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    with timer.stage('ingest', bytes=bytes_on_disk):
+        with _quiet():
+            ingest_directory(exports_dir, dataset_dir)
+
+    commands = list(data_analysis.COMMANDS)
+    with timer.stage('load_dataset'):
+        df = data_analysis.load_analysis_data(dataset_dir, data_analysis.required_columns([data_analysis.COMMANDS[command] for command in commands]))
+
+    chart_jobs = []
+    for command in commands:
+        # A shallow copy has no cached aggregates, so each analysis is timed on its own
+        frame = df.copy(deep=False)
+        with timer.stage(f'analysis:{command}'):
+            with _quiet(), data_analysis.defer_rendering() as jobs:
+                data_analysis.COMMANDS[command](frame)
+        chart_jobs.extend(jobs)
+    del df, frame
+
+    if render:
+        with timer.stage('render', charts=len(chart_jobs)):
+            with _quiet():
+                data_analysis.render_charts(chart_jobs, output_dir=charts_dir, workers=workers, skip_unchanged=False)
+
+    return {
+        'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'rows': rows,
+        'seed': seed,
+        'input_bytes': bytes_on_disk,
+        'stages': timer.stages,
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic streaming histories")
+    parser.add_argument('--rows', nargs='+', default=['10k', '100k'], help="history sizes to run, e.g. 10k 1M 100M")
+    parser.add_argument('--seed', type=int, default=0, help="generator seed")
+    parser.add_argument('--work-dir', default='benchmark_data', help="scratch directory for generated data")
+    parser.add_argument('--output', default=RESULTS_PATH, help="JSON-lines file results are appended to")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes for loading and rendering")
+    parser.add_argument('--no-render', action='store_true', help="skip the chart rendering stage")
+    parser.add_argument('--keep-data', action='store_true', help="keep the generated exports and datasets")
+    parser.add_argument('--generate-only', metavar='DIR', help="only write a synthetic export of the first size to DIR")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [parse_scale(size) for size in args.rows]
+
+    if args.generate_only:
+        paths = generate_history(args.generate_only, sizes[0], seed=args.seed)
+        print(f"Wrote {sizes[0]} plays to {len(paths)} files in {args.generate_only}")
+        return
+
+    try:
+        for rows in sizes:
+            result = run_benchmark(rows, args.work_dir, seed=args.seed, render=not args.no_render, workers=args.workers)
+            with open(args.output, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(result) + "\n")
+            total = sum(stage['wall_seconds'] for stage in result['stages'])
+            print(f"{rows} rows: {total:.2f} s over {len(result['stages'])} stages, results appended to {args.output}")
+    finally:
+        if not args.keep_data:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import stage
+
+
+# Bump when the rendering code changes so cached charts are redrawn
+CHART_STYLE_VERSION = 1
+
+# Fingerprints of the inputs each chart was last rendered from
+CHART_CACHE_NAME = ".chart_cache.json"
+
+# Jobs queued while rendering is deferred (see defer_rendering)
+_pending_jobs = None
+
+
+def _plain(values):
+    # Convert pandas/numpy containers into JSON-friendly lists of Python scalars
+    if hasattr(values, 'tolist'):
+        values = values.tolist()
+    if isinstance(values, (list, tuple)):
+        return [_plain(value) for value in values]
+    if hasattr(values, 'item'):
+        return values.item()
+    return values
+
+def chart_job(filename, kind, title, xlabel='', ylabel='', labels=None, values=None, **options):
+    """
+    Describe one chart as plain data so it can be fingerprinted and rendered in a worker
+
+    Parameters:
+    filename (str): Output PNG name
+    kind (str): 'barh', 'bar', 'stacked_bar', 'line' or 'hist'
+    title, xlabel, ylabel (str): Axis text
+    labels (list): Category labels (bar/line x values, barh y values, stacked_bar index)
+    values (list): Values to plot (a list of rows for stacked_bar)
+    options: Extra settings such as figsize, xticks, xticklabels, series, bins, mean_line, log_y
+
+    Returns:
+    dict: Chart job
+    """
+    job = {
+        'filename': filename,
+        'kind': kind,
+        'title': title,
+        'xlabel': xlabel,
+        'ylabel': ylabel,
+        'labels': _plain(labels) if labels is not None else None,
+        'values': _plain(values) if values is not None else None,
+        'figsize': (12, 6),
+    }
+    job.update({key: _plain(value) for key, value in options.items()})
+    return job
+
+def job_fingerprint(job):
+    """
+    Stable hash of everything that affects a chart's pixels
+    """
+    payload = json.dumps([CHART_STYLE_VERSION, job], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _init_worker():
+    # Non-interactive backend and the dark style, set once per process
+    import matplotlib
+    matplotlib.use('Agg')
+    from qbstyles import mpl_style
+    mpl_style(dark=True)
+
+def _render(job, output_dir):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    import pandas as pd
+
+    # plt.figure rather than plt.subplots: qbstyles patches subplots to add a second, empty axes
+    fig = plt.figure(figsize=job['figsize'])
+    ax = fig.gca()
+    try:
+        kind = job['kind']
+        if kind == 'barh':
+            sns.barplot(x=job['values'], y=[str(label) for label in job['labels']], ax=ax)
+        elif kind == 'bar':
+            sns.barplot(x=job['labels'], y=job['values'], ax=ax)
+        elif kind == 'stacked_bar':
+            frame = pd.DataFrame(job['values'], index=job['labels'], columns=job.get('series'))
+            frame.plot(kind='bar', stacked=True, ax=ax)
+        elif kind == 'line':
+            sns.lineplot(x=job['labels'], y=job['values'], marker='o', ax=ax)
+        elif kind == 'hist':
+            sns.histplot(job['values'], bins=job.get('bins', 'auto'), ax=ax)
+            if job.get('mean_line') is not None:
+                mean = job['mean_line']
+                ax.axvline(mean, color='r', linestyle='--', label=f'Average ({mean:.1f} min)')
+                ax.legend()
+        else:
+            raise ValueError(f"Unknown chart kind '{kind}'")
+
+        if job.get('log_y'):
+            ax.set_yscale('log')
+        if job.get('xticks') is not None:
+            ax.set_xticks(job['xticks'])
+            if job.get('xticklabels') is not None:
+                ax.set_xticklabels(job['xticklabels'])
+        ax.set_title(job['title'])
+        ax.set_xlabel(job['xlabel'])
+        ax.set_ylabel(job['ylabel'])
+        fig.tight_layout()
+        fig.savefig(os.path.join(output_dir, job['filename']))
+    finally:
+        # Release the figure so a long run does not accumulate them
+        plt.close(fig)
+
+    return job['filename']
+
+def _load_cache(output_dir):
+    path = os.path.join(output_dir, CHART_CACHE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def _save_cache(cache, output_dir):
+    path = os.path.join(output_dir, CHART_CACHE_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(cache, file, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def render_charts(jobs, output_dir='.', workers=None, skip_unchanged=True):
+    """
+    Render chart jobs to PNG files, in parallel and headless
+
+    Charts whose inputs match the fingerprint recorded at their last render
+    (and whose file still exists) are skipped.
+
+    Parameters:
+    jobs (list): Chart jobs built with chart_job
+    output_dir (str): Directory the PNGs are written to
+    workers (int): Worker processes (default: one per CPU, 1 renders in this process)
+    skip_unchanged (bool): Skip charts whose inputs have not changed
+
+    Returns:
+    list: Filenames that were rendered
+    """
+    with stage('render', charts=len(jobs)) as event:
+        rendered = _render_changed(jobs, output_dir, workers, skip_unchanged)
+        event['rendered'] = len(rendered)
+    return rendered
+
+def _render_changed(jobs, output_dir, workers, skip_unchanged):
+    os.makedirs(output_dir, exist_ok=True)
+    cache = _load_cache(output_dir) if skip_unchanged else {}
+
+    todo = []
+    for job in jobs:
+        fingerprint = job_fingerprint(job)
+        if cache.get(job['filename']) == fingerprint and os.path.exists(os.path.join(output_dir, job['filename'])):
+            print(f"    - {job['filename']} unchanged, skipping")
+            continue
+        todo.append((job, fingerprint))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(todo)))
+
+    rendered = []
+    if todo and workers == 1:
+        _init_worker()
+        results = (_render(job, output_dir) for job, _ in todo)
+    elif todo:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+        results = executor.map(_render, [job for job, _ in todo], [output_dir] * len(todo))
+    else:
+        results = []
+
+    try:
+        for (job, fingerprint), filename in zip(todo, results):
+            print(f"    ✓ Saved {filename}")
+            cache[filename] = fingerprint
+            rendered.append(filename)
+    finally:
+        if todo and workers > 1:
+            executor.shutdown()
+        if skip_unchanged or rendered:
+            _save_cache(cache, output_dir)
+
+    return rendered
+
+def render_chart(job, output_dir='.'):
+    """
+    Render a chart now, or queue it when rendering is deferred
+    """
+    if _pending_jobs is not None:
+        _pending_jobs.append(job)
+        return
+    render_charts([job], output_dir=output_dir, workers=1)
+
+@contextlib.contextmanager
+def defer_rendering():
+    """
+    Collect charts requested inside the block instead of rendering them
+
+    Usage:
+        with defer_rendering() as jobs:
+            top_10_artists_all_time(df)
+        render_charts(jobs, workers=4)
+    """
+    global _pending_jobs
+    previous, _pending_jobs = _pending_jobs, []
+    try:
+        yield _pending_jobs
+    finally:
+        _pending_jobs = previous
@@ -0,0 +1,399 @@
+import io
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import CategoricalDtype
+
+from data_store import DATASET_PATH, STRING_TYPE, part_paths, iter_year_chunks, load_range, load_ts_index
+from sessions import epoch_ms
+
+
+# Memory-mapped copy of the fact table: one fixed-width .npy array per column,
+# stored under <dataset>/_columns/ in global ts order. Arrays are opened read-only
+# with mmap, so opening is near-instant and report processes on one host share
+# the page cache instead of each holding a private copy of the data.
+COLUMNS_DIR = "_columns"
+COLUMNS_META_NAME = "_meta.json"
+COLUMNS_VERSION = 1
+
+# Fixed-width columns and the numpy dtype they are stored as (ts as int64 epoch-ms)
+FIXED_WIDTH_COLUMNS = {
+    'ts': 'int64',
+    'ms_played': 'int64',
+    'minutes_played': 'float64',
+    'year': 'int16',
+    'month': 'int8',
+    'day': 'int8',
+    'hour': 'int8',
+    'day_of_week': 'int8',
+    'track_id': 'int32',
+    'artist_id': 'int32',
+    'album_id': 'int32',
+}
+
+# Nullable booleans are stored as a bool value array plus a bool mask of missing values
+BOOL_COLUMNS = ['shuffle', 'skipped', 'offline', 'incognito_mode']
+
+
+def _column_path(directory, column, suffix=''):
+    return os.path.join(directory, f"{column}{suffix}.npy")
+
+def _codes_dtype(categories):
+    # The code width pandas uses for this many categories, so codes map straight into a Categorical
+    size = len(categories)
+    return 'int8' if size < 2**7 else 'int16' if size < 2**15 else 'int32'
+
+def _source_signature(dataset_dir):
+    # Parts the arrays were built from; any added, removed or rewritten part makes them stale
+    return {os.path.basename(path): [os.path.getsize(path), os.stat(path).st_mtime_ns] for path in part_paths(dataset_dir)}
+
+def _string_columns(dataset_dir):
+    # Dictionary-encoded string columns present in any part
+    columns = []
+    for path in part_paths(dataset_dir):
+        for field in pq.read_schema(path):
+            if field.type == STRING_TYPE and field.name not in columns:
+                columns.append(field.name)
+    return columns
+
+def _mapped_schema(dataset_dir):
+    available = set()
+    for path in part_paths(dataset_dir):
+        available.update(pq.read_schema(path).names)
+    fixed = [column for column in FIXED_WIDTH_COLUMNS if column in available]
+    bools = [column for column in BOOL_COLUMNS if column in available]
+    return fixed, bools, _string_columns(dataset_dir)
+
+def load_column_meta(dataset_dir=DATASET_PATH):
+    """
+    Description of the mapped columns of a dataset, or None when there are none
+    """
+    path = os.path.join(dataset_dir, COLUMNS_DIR, COLUMNS_META_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    return meta if meta.get('version') == COLUMNS_VERSION else None
+
+def has_mapped_columns(dataset_dir=DATASET_PATH, columns=None):
+    """
+    True when the mapped arrays are up to date with the fact parts and hold the given columns
+    """
+    if not os.path.isdir(dataset_dir):
+        return False
+    meta = load_column_meta(dataset_dir)
+    if meta is None or meta['source'] != _source_signature(dataset_dir):
+        return False
+    return columns is None or all(column in meta['columns'] for column in columns)
+
+def _chunk_arrays(chunk, fixed, bools, strings, dtypes):
+    # Values of a ts-sorted chunk as they are stored in each mapped array
+    arrays = {}
+    for column in fixed:
+        arrays[column] = epoch_ms(chunk['ts']) if column == 'ts' else chunk[column].to_numpy()
+    for column in bools:
+        values = chunk[column].astype('boolean')
+        arrays[column] = values.fillna(False).to_numpy(dtype='bool')
+        arrays[column + '.mask'] = values.isna().to_numpy()
+    for column in strings:
+        # Parts can lack a column (older exports); those rows get code -1 (missing)
+        if column in chunk.columns:
+            # Recode through the chunk's own (small) category list instead of the strings
+            values = chunk[column].astype('category')
+            recode = np.append(dtypes[column].categories.get_indexer(values.cat.categories), -1)
+            arrays[column] = recode[values.cat.codes.to_numpy()]
+        else:
+            arrays[column] = np.full(len(chunk), -1)
+    return arrays
+
+def build_mapped_columns(dataset_dir=DATASET_PATH):
+    """
+    Write the fixed-width column arrays of a dataset, replacing any previous ones
+
+    Strings become integer codes into a per-column dictionary collected from
+    all parts first. Rows are then written one year at a time straight into
+    the memory-mapped output, in ts order, so the whole history is never held
+    in memory. The new arrays are swapped in with a directory rename; readers
+    that still map the old files keep a consistent view.
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+
+    Returns:
+    int: Number of rows written
+    """
+    fixed, bools, strings = _mapped_schema(dataset_dir)
+    source = _source_signature(dataset_dir)
+    starts = _part_starts(dataset_dir)
+
+    found = {column: [] for column in strings}
+    for path in part_paths(dataset_dir):
+        available = pq.read_schema(path).names
+        present = [column for column in strings if column in available]
+        # Only the Parquet dictionaries are needed, not the decoded rows
+        table = pq.read_table(path, columns=present)
+        for column in present:
+            found[column].extend(chunk.dictionary for chunk in table.column(column).chunks)
+    dtypes = {
+        column: CategoricalDtype(pd.Index(pa.concat_arrays(dictionaries or [pa.array([], pa.string())]).unique().to_pandas()).sort_values())
+        for column, dictionaries in found.items()
+    }
+
+    rows = sum(pq.read_metadata(path).num_rows for path in part_paths(dataset_dir))
+    columns = fixed + bools + strings
+
+    target = os.path.join(dataset_dir, COLUMNS_DIR)
+    tmp_dir = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    outputs = {}
+    for column in fixed:
+        outputs[column] = np.lib.format.open_memmap(_column_path(tmp_dir, column), 'w+', FIXED_WIDTH_COLUMNS[column], (rows,))
+    for column in bools:
+        outputs[column] = np.lib.format.open_memmap(_column_path(tmp_dir, column), 'w+', 'bool', (rows,))
+        outputs[column + '.mask'] = np.lib.format.open_memmap(_column_path(tmp_dir, column, '.mask'), 'w+', 'bool', (rows,))
+    for column in strings:
+        outputs[column] = np.lib.format.open_memmap(_column_path(tmp_dir, column), 'w+', _codes_dtype(dtypes[column].categories), (rows,))
+
+    offset = 0
+    read_columns = list(dict.fromkeys(['ts'] + columns))
+    for chunk in iter_year_chunks(dataset_dir, read_columns):
+        end = offset + len(chunk)
+        for name, values in _chunk_arrays(chunk, fixed, bools, strings, dtypes).items():
+            outputs[name][offset:end] = values
+        offset = end
+
+    for array in outputs.values():
+        array.flush()
+    del outputs
+
+    for column in strings:
+        pq.write_table(pa.table({column: pa.array(dtypes[column].categories.astype(object), pa.string())}),
+                       os.path.join(tmp_dir, f"{column}.dictionary.parquet"))
+    meta = {
+        'version': COLUMNS_VERSION,
+        'rows': rows,
+        'columns': {
+            **{column: 'fixed' for column in fixed},
+            **{column: 'bool' for column in bools},
+            **{column: 'string' for column in strings},
+        },
+        'source': source,
+        'starts': starts,
+    }
+    with open(os.path.join(tmp_dir, COLUMNS_META_NAME), 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=2)
+
+    old_dir = f"{target}.old-{os.getpid()}"
+    if os.path.exists(target):
+        os.replace(target, old_dir)
+    os.replace(tmp_dir, target)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return rows
+
+def _grown_header(path, rows):
+    # The header of a .npy file with its length set to rows, and the offset its data starts at.
+    # None when the new header would not fit in place of the old one.
+    with open(path, 'rb') as file:
+        if np.lib.format.read_magic(file) != (1, 0):
+            return None
+        _, _, dtype = np.lib.format.read_array_header_1_0(file)
+        offset = file.tell()
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (rows,)})
+    return (header.getvalue(), offset, dtype) if len(header.getvalue()) == offset else None
+
+def _part_starts(dataset_dir):
+    # Earliest play (epoch ms) of each part with rows, from the timestamp index
+    index = load_ts_index(dataset_dir)
+    starts = index[index['rows'] > 0].groupby('part')['ts_min'].min()
+    return {part: int(ms) for part, ms in zip(starts.index, epoch_ms(starts))}
+
+def _rewrite_mapped_tail(dataset_dir, meta):
+    # Rewrite the arrays in place from the earliest play of any added, removed or
+    # rewritten part on; rows before it stay as they are. None when that cannot
+    # give the arrays a full rebuild writes, so one is needed instead.
+    if 'starts' not in meta:
+        return None
+    fixed, bools, strings = _mapped_schema(dataset_dir)
+    columns = fixed + bools + strings
+    if set(columns) != set(meta['columns']):
+        return None
+    source = _source_signature(dataset_dir)
+    starts = _part_starts(dataset_dir)
+    changed = {name for name in set(source) | set(meta['source']) if source.get(name) != meta['source'].get(name)}
+    firsts = [starts[name] for name in changed if name in starts] + [meta['starts'][name] for name in changed if name in meta['starts']]
+
+    directory = os.path.join(dataset_dir, COLUMNS_DIR)
+    rows, offset, tail = meta['rows'], meta['rows'], pd.DataFrame(columns=columns)
+    if firsts:
+        first = min(firsts)
+        offset = int(np.searchsorted(np.load(_column_path(directory, 'ts'), mmap_mode='r')[:rows], first, side='left'))
+        tail = load_range(dataset_dir, pd.Timestamp(first, unit='ms', tz='UTC')).reindex(columns=columns)
+    total = offset + len(tail)
+    # Shrinking would cut rows from under readers that map the arrays
+    if total < rows or total != sum(pq.read_metadata(path).num_rows for path in part_paths(dataset_dir)):
+        return None
+
+    dtypes, grown = {}, []
+    for column in strings:
+        # Object indexes hash the strings in C; Arrow-backed isin goes string by string
+        categories = pd.Index(load_dictionary(column, dataset_dir), dtype=object)
+        found = pd.Index(tail[column].dropna().unique(), dtype=object)
+        new = found[~found.isin(categories)]
+        if len(new):
+            # New strings go at the end so the codes already written stay valid
+            categories = categories.append(new)
+            grown.append(column)
+        dtypes[column] = CategoricalDtype(categories)
+
+    arrays = _chunk_arrays(tail, fixed, bools, strings, dtypes) if len(tail) else {}
+    headers = {}
+    for name in arrays:
+        header = _grown_header(os.path.join(directory, f"{name}.npy"), total)
+        if header is None or (name in strings and header[2] != np.dtype(_codes_dtype(dtypes[name].categories))):
+            return None
+        headers[name] = header
+
+    # Data first and header after, so a reader never sees a length before its rows are there.
+    # Until the meta is replaced it still describes the old arrays, and a retry writes the same rows again.
+    for name, (header, data_offset, dtype) in headers.items():
+        with open(os.path.join(directory, f"{name}.npy"), 'r+b') as file:
+            file.seek(data_offset + offset * dtype.itemsize)
+            file.write(np.ascontiguousarray(arrays[name], dtype=dtype).tobytes())
+            file.truncate()
+            file.seek(0)
+            file.write(header)
+    for column in grown:
+        path = os.path.join(directory, f"{column}.dictionary.parquet")
+        pq.write_table(pa.table({column: pa.array(dtypes[column].categories.astype(object), pa.string())}), path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    meta = {**meta, 'rows': total, 'source': source, 'starts': starts}
+    meta_path = os.path.join(directory, COLUMNS_META_NAME)
+    with open(meta_path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(meta, file, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+    return len(tail)
+
+def update_mapped_columns(dataset_dir=DATASET_PATH):
+    """
+    Bring the mapped arrays up to date with the fact parts
+
+    Only the rows from the earliest play of an added, removed or rewritten
+    part on are written, in place: new exports and polled recent plays touch
+    the end of the history, so that is usually a short tail plus the new rows.
+    New strings go to the end of the dictionaries that changed. Readers that
+    mapped the arrays before keep the rows ahead of that tail unchanged.
+    Anything that would shrink the arrays, add a column or outgrow the width
+    of the string codes rebuilds them with build_mapped_columns instead.
+
+    Returns:
+    int: Number of rows written (0 when already up to date)
+    """
+    if not part_paths(dataset_dir) or has_mapped_columns(dataset_dir):
+        return 0
+    meta = load_column_meta(dataset_dir)
+    if meta is not None:
+        written = _rewrite_mapped_tail(dataset_dir, meta)
+        if written is not None:
+            return written
+    return build_mapped_columns(dataset_dir)
+
+def open_columns(dataset_dir=DATASET_PATH, columns=None):
+    """
+    The raw read-only memory-mapped arrays, without building any pandas objects
+
+    ts is int64 epoch-ms, booleans come with a '<column>.mask' array of
+    missing values and strings are integer codes into their dictionary
+    (-1 for missing).
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+    columns (list): Columns to open; all mapped columns when omitted
+
+    Returns:
+    dict: Column name to numpy.memmap
+    """
+    meta = load_column_meta(dataset_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No mapped columns in {dataset_dir}, run load_clean_save_input.py first")
+    directory = os.path.join(dataset_dir, COLUMNS_DIR)
+
+    arrays = {}
+    for column in columns or list(meta['columns']):
+        kind = meta['columns'].get(column)
+        if kind is None:
+            raise KeyError(f"Column {column} is not mapped, load it from the Parquet store instead")
+        arrays[column] = np.load(_column_path(directory, column), mmap_mode='r')
+        if kind == 'bool':
+            arrays[column + '.mask'] = np.load(_column_path(directory, column, '.mask'), mmap_mode='r')
+    return arrays
+
+def load_dictionary(column, dataset_dir=DATASET_PATH):
+    """
+    Strings behind the integer codes of a mapped string column
+    """
+    path = os.path.join(dataset_dir, COLUMNS_DIR, f"{column}.dictionary.parquet")
+    return pq.read_table(path).column(column).to_pandas()
+
+def _utc_timestamps(ts_ms):
+    # View epoch-ms as a UTC datetime array; the tz-aware constructor would copy
+    values = ts_ms.view('datetime64[ms]')
+    try:
+        return pd.arrays.DatetimeArray._simple_new(values, dtype=pd.DatetimeTZDtype('ms', 'UTC'))
+    except AttributeError:
+        return pd.Series(values).dt.tz_localize('UTC').array
+
+def load_mapped(dataset_dir=DATASET_PATH, columns=None, start=None, end=None):
+    """
+    DataFrame over the memory-mapped arrays, without copying the column data
+
+    Fixed-width and boolean columns, and the codes of categorical columns,
+    point straight at the mapped pages; only the string dictionaries are read.
+    The arrays are in ts order, so a time range is a binary search and a slice.
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+    columns (list): Columns to return; all mapped columns when omitted
+    start (pandas.Timestamp): Inclusive lower bound (None for the beginning)
+    end (pandas.Timestamp): Exclusive upper bound (None for the end)
+
+    Returns:
+    pandas.DataFrame: Typed Spotify data as data_store.load_dataset gives it, with ts at ms resolution
+    """
+    meta = load_column_meta(dataset_dir)
+    if meta is None:
+        raise FileNotFoundError(f"No mapped columns in {dataset_dir}, run load_clean_save_input.py first")
+    columns = list(columns or meta['columns'])
+
+    lower, upper = 0, meta['rows']
+    if start is not None or end is not None:
+        ts_ms = open_columns(dataset_dir, ['ts'])['ts']
+        if start is not None:
+            lower = int(np.searchsorted(ts_ms, epoch_ms(pd.Series([start]))[0], side='left'))
+        if end is not None:
+            upper = int(np.searchsorted(ts_ms, epoch_ms(pd.Series([end]))[0], side='left'))
+        upper = max(lower, upper)
+
+    arrays = open_columns(dataset_dir, columns)
+    data = {}
+    for column in columns:
+        values = arrays[column][lower:upper]
+        kind = meta['columns'][column]
+        if column == 'ts':
+            data[column] = pd.Series(_utc_timestamps(values), copy=False)
+        elif kind == 'bool':
+            data[column] = pd.Series(pd.arrays.BooleanArray(values, arrays[column + '.mask'][lower:upper]), copy=False)
+        elif kind == 'string':
+            dtype = CategoricalDtype(load_dictionary(column, dataset_dir))
+            data[column] = pd.Series(pd.Categorical.from_codes(values, dtype=dtype, validate=False), copy=False)
+        else:
+            data[column] = pd.Series(values, copy=False)
+
+    return pd.DataFrame(data, copy=False)
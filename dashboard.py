@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+
+import data_analysis
+from data_store import DATASET_PATH
+from engagement import DEFAULT_MIN_PLAYS
+from sessions import SESSION_GAP_MINUTES
+from instrumentation import stage
+from charts import defer_rendering, render_charts
+
+
+# Data feed read by index.html/scripts.js in one request
+FEED_PATH = "dashboard.json"
+
+# Bump when the feed layout changes; bump a SECTION_VERSIONS entry when one section's content changes
+FEED_VERSION = 1
+SECTION_VERSIONS = {}
+
+# Analyses published on the dashboard; 'ips' stays private
+DEFAULT_SECTIONS = ['stats', 'top-artists', 'top-albums', 'top-tracks', 'top-tracks-plays', 'by-hour', 'by-day',
+                    'trends', 'sessions', 'binges', 'skips']
+
+# Floats are rounded to this many decimals to keep the feed small
+FEED_DECIMALS = 3
+
+
+def _compact(value):
+    if isinstance(value, float):
+        return None if np.isnan(value) else round(value, FEED_DECIMALS)
+    if isinstance(value, dict):
+        return {key: _compact(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    return value
+
+def _chart_series(job):
+    # The data of a chart, without styling; histograms are binned here instead of shipping every value
+    series = {key: job.get(key) for key in ('filename', 'kind', 'title', 'xlabel', 'ylabel', 'labels', 'values', 'series')
+              if job.get(key) is not None}
+    if job['kind'] == 'hist':
+        values = np.asarray(job['values'], dtype='float64')
+        counts, edges = np.histogram(values, bins=job.get('bins', 'auto')) if len(values) else ([], [])
+        series['values'] = list(map(int, counts))
+        series['labels'] = [float(edge) for edge in edges]
+    return series
+
+def section_inputs(data, command, period='year', top_n=5, min_plays=DEFAULT_MIN_PLAYS, session_gap=SESSION_GAP_MINUTES):
+    """
+    Everything a dashboard section is computed from
+
+    The same inputs data_analysis keys its cached results on (the files the
+    command reads and the parameters it uses), plus the feed and section versions.
+
+    Returns:
+    dict: JSON-serializable description of the inputs
+    """
+    params = {'period': period, 'top_n': top_n, 'min_plays': min_plays, 'session_gap': session_gap}
+    return {
+        'feed_version': FEED_VERSION,
+        'section_version': SECTION_VERSIONS.get(command, 1),
+        **data_analysis.command_inputs(data, command, params, data_analysis.uses_rollups(data, [command])),
+    }
+
+def section_fingerprint(data, command, period='year', top_n=5, min_plays=DEFAULT_MIN_PLAYS, session_gap=SESSION_GAP_MINUTES):
+    payload = json.dumps(section_inputs(data, command, period, top_n, min_plays, session_gap), sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def load_feed(path=FEED_PATH):
+    """
+    The previously written feed, or an empty one if it is missing or from another version
+    """
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            feed = json.load(file)
+        if feed.get('version') == FEED_VERSION:
+            return feed
+    return {'version': FEED_VERSION, 'generated_at': None, 'sections': {}}
+
+def save_feed(feed, path=FEED_PATH):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(feed, file, separators=(',', ':'), ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def build_dashboard(data=DATASET_PATH, output=FEED_PATH, sections=None, period='year', top_n=5, charts_dir=None, force=False,
+                    min_plays=DEFAULT_MIN_PLAYS, session_gap=SESSION_GAP_MINUTES):
+    """
+    Write the dashboard feed, recomputing only the sections whose inputs changed
+
+    Each section holds an analysis result and the series of its charts. Stale
+    sections the rollup cube can answer are computed from it; the rest share
+    one load of the columns they need.
+
+    Parameters:
+    data (str): Dataset written by load_clean_save_input.py
+    output (str): Feed path
+    sections (list): Analysis commands to publish (default: DEFAULT_SECTIONS)
+    period (str): Granularity for trends
+    top_n (int): Top artists/tracks per period for trends
+    charts_dir (str): Also render the charts of the recomputed sections as PNG into this directory
+    force (bool): Recompute every section
+    min_plays (int): Plays a track needs to be ranked by skip rate
+    session_gap (float): Minutes of silence that end a listening session
+
+    Returns:
+    list: Sections that were recomputed
+    """
+    sections = sections or DEFAULT_SECTIONS
+    feed = load_feed(output)
+    fingerprints = {command: section_fingerprint(data, command, period, top_n, min_plays, session_gap) for command in sections}
+    stale = [command for command in sections
+             if force or feed['sections'].get(command, {}).get('fingerprint') != fingerprints[command]]
+
+    if not stale:
+        print("Dashboard feed is up to date")
+        return []
+    print(f"Regenerating {len(stale)} of {len(sections)} sections: {', '.join(stale)}")
+
+    rollup_sections = [command for command in stale if data_analysis.uses_rollups(data, [command])]
+    row_sections = [command for command in stale if command not in rollup_sections]
+    chart_jobs = []
+
+    with stage('dashboard', label="Dashboard feed", sections=stale):
+        for commands in (rollup_sections, row_sections):
+            if not commands:
+                continue
+            df_clean = data_analysis.analysis_frame(data, commands, session_gap=session_gap)
+            for command in commands:
+                with defer_rendering() as jobs:
+                    result = data_analysis.run_command(df_clean, command, period, top_n, min_plays)
+                feed['sections'][command] = {
+                    'fingerprint': fingerprints[command],
+                    'generated_at': pd.Timestamp.now(tz='UTC').isoformat(),
+                    'result': _compact(data_analysis._jsonable(result)),
+                    'charts': [_compact(_chart_series(job)) for job in jobs],
+                }
+                chart_jobs.extend(jobs)
+
+        feed['sections'] = {command: feed['sections'][command] for command in sections}
+        feed['generated_at'] = pd.Timestamp.now(tz='UTC').isoformat()
+        save_feed(feed, output)
+
+    if charts_dir:
+        render_charts(chart_jobs, output_dir=charts_dir)
+    return stale
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the dashboard data feed for index.html")
+    parser.add_argument('--data', default=DATASET_PATH, help="dataset written by load_clean_save_input.py")
+    parser.add_argument('--output', default=FEED_PATH, help="feed file the page loads")
+    parser.add_argument('--sections', nargs='+', choices=list(data_analysis.COMMANDS), default=None,
+                        help=f"analyses to publish (default: {' '.join(DEFAULT_SECTIONS)})")
+    parser.add_argument('--period', choices=list(data_analysis.PERIOD_NAMES), default='year', help="granularity for trends")
+    parser.add_argument('--top-n', type=int, default=5, help="top artists/tracks per period for trends")
+    parser.add_argument('--min-plays', type=int, default=DEFAULT_MIN_PLAYS, help="plays a track needs to be ranked by skip rate")
+    parser.add_argument('--session-gap', type=float, default=SESSION_GAP_MINUTES,
+                        help="minutes of silence that end a listening session")
+    parser.add_argument('--charts-dir', default=None, help="also render the changed charts as PNG here (e.g. Assets)")
+    parser.add_argument('--force', action='store_true', help="recompute every section")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    build_dashboard(args.data, args.output, args.sections, args.period, args.top_n, args.charts_dir, args.force,
+                    args.min_plays, args.session_gap)
+    print(f"Dashboard feed written to {args.output}")
+
+if __name__ == "__main__":
+    main()
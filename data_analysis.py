@@ -1,20 +1,420 @@
 import pandas as pd
 import os
 import json
-import glob
 from datetime import datetime
-import matplotlib.pyplot as plt
-import seaborn as sns
+import sys
 import time
+import weakref
+import functools
+import argparse
+import contextlib
 
-from qbstyles import mpl_style
-mpl_style(dark=True)
+from charts import chart_job, render_chart, render_charts, defer_rendering
+from data_store import DATASET_PATH, load_dataset, load_dimensions, dataset_bytes, dataset_columns, load_range, parse_time_range, iter_year_chunks, dimension_path
+from column_store import has_mapped_columns, load_mapped
+from engagement import DEFAULT_MIN_PLAYS, engagement_stats, track_durations
+from instrumentation import stage, instrumented, configure, get_tracer, log
+from sessions import SESSION_GAP_MINUTES, build_sessions, build_sessions_chunked, epoch_ms
+from result_cache import RESULT_CACHE_DIR, DEFAULT_CACHE_BYTES, ResultCache, dataset_signature, file_signature, result_key
+from rollup import ROLLUP_DIR, has_rollups, load_rollup, rollup
+from sketches import DEFAULT_DISTINCT_ERROR, DEFAULT_TOP_K, StreamSketch, sketch_dataset
 
 
+def load_spotify_data_csv(filename, columns=None):
+    return pd.read_csv(filename, usecols=columns, parse_dates=['ts'] if columns is None or 'ts' in columns else None)
 
-def load_spotify_data_csv(filename):
-    return pd.read_csv(filename)
+def available_columns(filename=DATASET_PATH):
+    """
+    Columns stored in the dataset: the header of a legacy CSV, otherwise the
+    columns every Parquet part has
+    """
+    if filename.endswith('.csv'):
+        return list(pd.read_csv(filename, nrows=0).columns)
+    return dataset_columns(filename)
+
+def load_analysis_data(filename=DATASET_PATH, columns=None, start=None, end=None):
+    """
+    Load the preprocessed dataset, reading only the given columns
+
+    When the dataset's memory-mapped columns cover the request they are used
+    instead of decoding Parquet: opening them copies nothing, and processes
+    share the pages. With a time range only the rows (or row groups)
+    overlapping it are read.
+
+    Parameters:
+    filename (str): Parquet store (or legacy CSV) written by load_clean_save_input.py
+    columns (list): Columns to load; all columns when omitted
+    start (str): First date or period to include, e.g. '2023-06' (None for the beginning)
+    end (str): Last date or period to include, e.g. '2023-09' (None for the end)
+
+    Returns:
+    pandas.DataFrame: Preprocessed Spotify data
+    """
+    if filename.endswith('.csv'):
+        df = load_spotify_data_csv(filename, columns)
+        if start is not None or end is not None:
+            lower, upper = parse_time_range(start, end)
+            ts = pd.to_datetime(df['ts'], utc=True)
+            mask = pd.Series(True, index=df.index)
+            if lower is not None:
+                mask &= ts >= lower
+            if upper is not None:
+                mask &= ts < upper
+            df = df[mask].reset_index(drop=True)
+        return df
+    
+    mapped = columns is not None and has_mapped_columns(filename, columns)
+    with stage('load_dataset', columns=columns, start=start, end=end, mapped=mapped) as event:
+        if mapped:
+            df = load_mapped(filename, columns, *parse_time_range(start, end))
+            event['bytes'] = int(df.memory_usage(index=False, deep=False).sum())
+        elif start is not None or end is not None:
+            df = load_range(filename, *parse_time_range(start, end), columns=columns)
+            event['bytes'] = dataset_bytes(filename, columns)
+        else:
+            df = load_dataset(filename, columns)
+            event['bytes'] = dataset_bytes(filename, columns)
+        event['rows'] = len(df)
+    # Remember where the data came from so names can be joined from its dimension tables
+    df.attrs['dataset_path'] = filename
+    return df
+
+def load_rollup_data(filename=DATASET_PATH):
+    """
+    Stand-in frame for analyses answered entirely from the rollup cube
+
+    No rows are read; the aggregates are built from the cube stored next to the dataset.
+
+    Parameters:
+    filename (str): Dataset directory written by load_clean_save_input.py
+
+    Returns:
+    pandas.DataFrame: Empty frame flagged to use the rollup cube
+    """
+    df = pd.DataFrame()
+    df.attrs['dataset_path'] = filename
+    df.attrs['use_rollups'] = True
+    return df
+
+def load_session_data(filename=DATASET_PATH, start=None, end=None):
+    """
+    Stand-in frame for analyses that only need the session tables
+
+    No rows are read here; the sessions are built with
+    sessions.build_sessions_chunked from one year of the dataset at a time.
+
+    Parameters:
+    filename (str): Dataset directory written by load_clean_save_input.py
+    start (str): First date or period to include (None for the beginning)
+    end (str): Last date or period to include (None for the end)
+
+    Returns:
+    pandas.DataFrame: Empty frame flagged to build its sessions in chunks
+    """
+    df = pd.DataFrame({'ts': pd.Series(dtype='datetime64[ms, UTC]'), 'artist_id': pd.Series(dtype='int32'),
+                       'minutes_played': pd.Series(dtype='float64')})
+    df.attrs['dataset_path'] = filename
+    df.attrs['session_range'] = (start, end)
+    return df
+
+def required_columns(functions, available=None):
+    """
+    Union of the columns touched by the given analysis functions
+
+    Integer id columns are replaced by their name columns when the dataset
+    does not have them (a legacy CSV, or parts written before the dimension
+    tables), as the analyses group on the names then (see key_column).
+
+    Parameters:
+    functions (list): Analysis functions
+    available (list): Columns stored in the dataset, from available_columns (None to assume ids)
+
+    Returns:
+    list: Columns to load
+    """
+    columns = []
+    for function in functions:
+        for column in ANALYSIS_COLUMNS[function.__name__]:
+            if available is not None and column in DIMENSION_NAMES and column not in available:
+                column = DIMENSION_NAMES[column][1]
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+# Dimension table and name column behind each integer key of the fact table
+DIMENSION_NAMES = {
+    'track_id': ('tracks', 'track_name'),
+    'artist_id': ('artists', 'artist_name'),
+    'album_id': ('albums', 'album_name'),
+}
+
+def load_dimension_names(id_column, dataset_dir=DATASET_PATH):
+    """
+    Series mapping the integer ids of id_column to display names
+
+    Cached per version (size and mtime) of the dimension table, so names
+    added by a later ingest are picked up.
+    """
+    table, _ = DIMENSION_NAMES[id_column]
+    return _dimension_names(id_column, dataset_dir, tuple(file_signature([dimension_path(dataset_dir, table)])))
+
+@functools.lru_cache(maxsize=16)
+def _dimension_names(id_column, dataset_dir, signature):
+    table, name_column = DIMENSION_NAMES[id_column]
+    dimension = load_dimensions(dataset_dir)[table]
+    return dimension.set_index(id_column)[name_column]
+
+def key_column(df, name_column):
+    """
+    Integer key column to group on for a name column, falling back to the
+    name itself for datasets written without dimension tables
+    """
+    id_column = name_column.replace('_name', '_id')
+    return id_column if id_column in df.columns else name_column
+
+def key_names(df, keys, column):
+    """
+    Display names for grouped keys, joined from the dimension tables only when rendering
+    """
+    if column not in DIMENSION_NAMES:
+        return pd.Index(keys).astype(str)
+    dataset_dir = df.attrs.get('dataset_path', DATASET_PATH)
+    return pd.Index(load_dimension_names(column, dataset_dir).reindex(keys)).astype(str)
+
+def _track_totals(df):
+    # Minutes and play count per track in one grouped pass
+    return df.groupby('track_name', observed=True)['minutes_played'].agg(['sum', 'count'])
+
+def _artist_minutes(df):
+    return df.groupby('artist_name', observed=True)['minutes_played'].sum()
+
+def _album_minutes(df):
+    return df.groupby('album_name', observed=True)['minutes_played'].sum()
+
+def _time_grid(df):
+    # Minutes per (year, day of week, hour); hourly and weekly charts are roll-ups of this grid
+    return df.groupby(['year', 'day_of_week', 'hour'])['minutes_played'].sum()
+
+def _totals(df):
+    return {
+        'minutes': df['minutes_played'].sum(),
+        'first_ts': df['ts'].min(),
+        'last_ts': df['ts'].max(),
+        'skip_rate': df['skipped'].mean() * 100,
+        'shuffle_rate': df['shuffle'].mean() * 100,
+    }
+
+def _session_tables(df):
+    # Sessions and same-artist runs from one boundary pass over the ts/artist arrays
+    gap_minutes = df.attrs.get('session_gap_minutes', SESSION_GAP_MINUTES)
+    if 'session_range' in df.attrs:
+        # Stand-in from load_session_data: read a year at a time from the dataset
+        chunks = iter_year_chunks(df.attrs['dataset_path'], SESSION_COLUMNS, *parse_time_range(*df.attrs['session_range']))
+        return build_sessions_chunked(chunks, 'artist_id', gap_minutes)
+
+    artist_key = key_column(df, 'artist_name')
+    if artist_key == 'artist_id':
+        keys = df['artist_id'].to_numpy()
+    else:
+        keys, names = pd.factorize(df['artist_name'])
+    
+    sessions, binges = build_sessions(epoch_ms(df['ts']), keys, df['minutes_played'].to_numpy(), gap_minutes)
+    
+    if artist_key != 'artist_id':
+        binges['artist'] = pd.Series(names.take(binges['artist'].to_numpy(), allow_fill=True))
+    return sessions, binges
+
+def _content_type_counts(df):
+    return df['content_type'].value_counts()
+
+def _platform_counts(df):
+    return df['platform'].value_counts()
+
+@functools.lru_cache(maxsize=16)
+def _load_cube(dimension, dataset_dir, signature):
+    return load_rollup(dimension, dataset_dir)
+
+def _cube(df, dimension):
+    # Cached per version of the dimension's cube slices, so an ingest in between is seen
+    dataset_dir = df.attrs.get('dataset_path', DATASET_PATH)
+    directory = os.path.join(dataset_dir, ROLLUP_DIR, dimension)
+    slices = [os.path.join(directory, name) for name in os.listdir(directory)] if os.path.isdir(directory) else []
+    return _load_cube(dimension, dataset_dir, tuple(file_signature(slices)))
+
+def _named_rollup(df, dimension, id_column):
+    # Cube totals per integer key, regrouped by display name like the row-based aggregates
+    totals = _cube(df, dimension).groupby('key')[['minutes', 'plays']].sum()
+    names = key_names(df, totals.index, id_column)
+    # Unknown keys (-1) have no name and are left out, as missing names are when grouping rows
+    known = totals.index.isin(load_dimension_names(id_column, df.attrs.get('dataset_path', DATASET_PATH)).index)
+    return totals[known].groupby(names[known]).sum()
+
+def _rollup_track_totals(df):
+    totals = _named_rollup(df, 'track', 'track_id')
+    return totals.rename(columns={'minutes': 'sum', 'plays': 'count'}).rename_axis('track_name')
+
+def _rollup_artist_minutes(df):
+    return _named_rollup(df, 'artist', 'artist_id')['minutes'].rename_axis('artist_name').rename('minutes_played')
+
+def _rollup_album_minutes(df):
+    return _named_rollup(df, 'album', 'album_id')['minutes'].rename_axis('album_name').rename('minutes_played')
+
+def _rollup_time_grid(df):
+    return rollup('total', by=('year', 'day_of_week', 'hour'), cube=_cube(df, 'total'))['minutes'].rename('minutes_played')
+
+def _rollup_totals(df):
+    cube = _cube(df, 'total')
+    return {
+        'minutes': cube['minutes'].sum(),
+        'first_ts': pd.Timestamp(cube['first_ms'].min(), unit='ms', tz='UTC'),
+        'last_ts': pd.Timestamp(cube['last_ms'].max(), unit='ms', tz='UTC'),
+        'skip_rate': cube['skips'].sum() / cube['skip_known'].sum() * 100,
+        'shuffle_rate': cube['shuffles'].sum() / cube['shuffle_known'].sum() * 100,
+    }
+
+def _rollup_counts(dimension):
+    def counts(df):
+        plays = _cube(df, dimension).groupby('key')['plays'].sum()
+        return plays.sort_values(ascending=False).rename_axis(dimension).rename('count')
+    return counts
+
+# Columns sketch mode counts distinct values of, and the subset it finds top keys of
+SKETCH_DISTINCT_COLUMNS = ['track_name', 'artist_name', 'album_name', 'ip_addr']
+SKETCH_TOP_COLUMNS = ['track_name', 'artist_name', 'album_name']
+
+# Rows fed to the sketches at once when sketching an in-memory frame
+SKETCH_CHUNK_SIZE = 1_000_000
+
+def enable_sketches(df, distinct_error=DEFAULT_DISTINCT_ERROR, top_k=DEFAULT_TOP_K):
+    """
+    Switch df to sketch mode: distinct counts come from HyperLogLog and the
+    top track/artist/album lists from space-saving and count-min sketches
+
+    Parameters:
+    df (pandas.DataFrame): Frame the analyses are run on
+    distinct_error (float): Relative standard error of distinct counts
+    top_k (int): Counters per top list; minutes and plays are off by at most total / top_k
+
+    Returns:
+    pandas.DataFrame: df, flagged for sketch mode
+    """
+    df.attrs['sketch'] = {'distinct_error': distinct_error, 'top_k': top_k}
+    return df
+
+def _stream_sketch(df):
+    # Sketch the frame's own rows when it has the columns, otherwise stream the stored parts
+    bounds = df.attrs['sketch']
+    if all(column in df.columns for column in SKETCH_TOP_COLUMNS + ['minutes_played']):
+        sketch = StreamSketch([column for column in SKETCH_DISTINCT_COLUMNS if column in df.columns], SKETCH_TOP_COLUMNS, **bounds)
+        for start in range(0, len(df), SKETCH_CHUNK_SIZE):
+            sketch.add(df.iloc[start:start + SKETCH_CHUNK_SIZE])
+        return sketch
+    
+    dataset_dir = df.attrs.get('dataset_path', DATASET_PATH)
+    log("  - Sketching the stored dataset part by part")
+    return sketch_dataset(dataset_dir, SKETCH_DISTINCT_COLUMNS, SKETCH_TOP_COLUMNS, **bounds)
+
+def _sketch_top(column, measure):
+    def top(df):
+        values = get_aggregate(df, 'stream_sketch').top(column, measure)
+        return values.rename('minutes_played' if measure == 'minutes' else 'count')
+    return top
+
+def _sketch_track_totals(df):
+    sketch = get_aggregate(df, 'stream_sketch')
+    totals = pd.concat([sketch.top('track_name', 'minutes').rename('sum'), sketch.top('track_name', 'plays').rename('count')], axis=1)
+    # Candidates heavy in only one measure get a count-min estimate of the other
+    for column, measure in (('sum', 'minutes'), ('count', 'plays')):
+        missing = totals[column].isna()
+        totals.loc[missing, column] = sketch.estimate('track_name', measure, totals.index[missing].to_series())
+    return totals.astype({'count': 'int64'})
+
+def distinct_count(df, column):
+    """
+    Number of distinct values in column, estimated with HyperLogLog in sketch mode
+    """
+    if df.attrs.get('sketch'):
+        return get_aggregate(df, 'stream_sketch').distinct(column)
+    if column in DISTINCT_AGGREGATES:
+        return len(get_aggregate(df, DISTINCT_AGGREGATES[column]))
+    return df[column].nunique()
+
+# Grouped results shared by the report functions, built at most once per DataFrame
+AGGREGATES = {
+    'track_totals': _track_totals,
+    'artist_minutes': _artist_minutes,
+    'album_minutes': _album_minutes,
+    'time_grid': _time_grid,
+    'totals': _totals,
+    'content_type_counts': _content_type_counts,
+    'platform_counts': _platform_counts,
+    'sessions': _session_tables,
+}
+
+# Aggregates whose group count is the number of distinct values of a name column
+DISTINCT_AGGREGATES = {
+    'track_name': 'track_totals',
+    'artist_name': 'artist_minutes',
+    'album_name': 'album_minutes',
+}
+
+# Aggregates replaced by approximate sketches in sketch mode (see enable_sketches)
+SKETCH_AGGREGATES = {
+    'stream_sketch': _stream_sketch,
+    'track_totals': _sketch_track_totals,
+    'artist_minutes': _sketch_top('artist_name', 'minutes'),
+    'album_minutes': _sketch_top('album_name', 'minutes'),
+}
+
+# Aggregates that can be answered from the hourly rollup cube instead of the rows
+ROLLUP_AGGREGATES = {
+    'track_totals': _rollup_track_totals,
+    'artist_minutes': _rollup_artist_minutes,
+    'album_minutes': _rollup_album_minutes,
+    'time_grid': _rollup_time_grid,
+    'totals': _rollup_totals,
+    'content_type_counts': _rollup_counts('content_type'),
+    'platform_counts': _rollup_counts('platform'),
+}
+
+_aggregate_cache = {}
+
+def get_aggregate(df, name):
+    """
+    Return a cached aggregate of df, computing it on first use
+
+    Results are cached per DataFrame object, so a full report hashes each key
+    column once no matter how many report functions read it. The cache assumes
+    df is not mutated after the first call. Frames from load_rollup_data are
+    answered from the rollup cube, frames passed to enable_sketches from
+    approximate sketches where they apply.
+
+    Parameters:
+    df (pandas.DataFrame): Preprocessed Spotify data
+    name (str): Key of AGGREGATES
+
+    Returns:
+    pandas.Series, pandas.DataFrame or dict: The aggregate
+    """
+    entry = _aggregate_cache.get(id(df))
+    if entry is None or entry[0]() is not df:
+        # Drop the entry as soon as the frame is garbage collected
+        ref = weakref.ref(df, lambda _, key=id(df): _aggregate_cache.pop(key, None))
+        entry = (ref, {})
+        _aggregate_cache[id(df)] = entry
+
+    results = entry[1]
+    if name not in results:
+        if df.attrs.get('sketch') and name in SKETCH_AGGREGATES:
+            builders = SKETCH_AGGREGATES
+        elif df.attrs.get('use_rollups'):
+            builders = ROLLUP_AGGREGATES
+        else:
+            builders = AGGREGATES
+        results[name] = builders[name](df)
+    return results[name]
 
+@instrumented(label="Statistics generation")
 def generate_basic_stats(df):
     """
     Generate basic statistics from the Spotify data
@@ -25,239 +425,231 @@ def generate_basic_stats(df):
     Returns:
     dict: Dictionary of basic statistics
     """
-    print("\nGenerating basic statistics...")
-    start_time = time.time()
+    log("\nGenerating basic statistics...")
     
     stats = {}
+    totals = get_aggregate(df, 'totals')
     
     # Total listening time
-    print("  - Calculating total listening time")
-    total_minutes = df['minutes_played'].sum()
-    stats['total_hours'] = total_minutes / 60
+    log("  - Calculating total listening time")
+    stats['total_hours'] = totals['minutes'] / 60
     
-    # Number of unique tracks, artists, and albums
-    print("  - Counting unique tracks, artists, and albums")
-    stats['unique_tracks'] = df['track_name'].nunique()
-    stats['unique_artists'] = df['artist_name'].nunique()
-    stats['unique_albums'] = df['album_name'].nunique()
+    # Number of unique tracks, artists, and albums (group sizes of the cached aggregates, or sketched)
+    log("  - Counting unique tracks, artists, and albums")
+    stats['unique_tracks'] = distinct_count(df, 'track_name')
+    stats['unique_artists'] = distinct_count(df, 'artist_name')
+    stats['unique_albums'] = distinct_count(df, 'album_name')
     
     # Content type distribution
-    print("  - Analyzing content type distribution")
-    stats['content_type_counts'] = df['content_type'].value_counts().to_dict()
+    log("  - Analyzing content type distribution")
+    stats['content_type_counts'] = get_aggregate(df, 'content_type_counts').to_dict()
     
     # Date range
-    print("  - Determining date range")
-    stats['date_range'] = (df['ts'].min(), df['ts'].max())
+    log("  - Determining date range")
+    stats['date_range'] = (totals['first_ts'], totals['last_ts'])
     
     # Platform usage
-    print("  - Analyzing platform usage")
-    stats['platform_usage'] = df['platform'].value_counts().head(5).to_dict()
-    
-    # Skip rate
-    print("  - Calculating skip and shuffle rates")
-    stats['skip_rate'] = df['skipped'].mean() * 100  # as percentage
+    log("  - Analyzing platform usage")
+    stats['platform_usage'] = get_aggregate(df, 'platform_counts').head(5).to_dict()
     
-    # Shuffle rate
-    stats['shuffle_rate'] = df['shuffle'].mean() * 100  # as percentage
-    
-    elapsed_time = time.time() - start_time
-    print(f"Statistics generation completed in {elapsed_time:.2f} seconds")
+    # Skip and shuffle rates
+    log("  - Calculating skip and shuffle rates")
+    stats['skip_rate'] = totals['skip_rate']  # as percentage
+    stats['shuffle_rate'] = totals['shuffle_rate']  # as percentage
     
     return stats
 
+@instrumented()
 def top_10_artists_all_time(df):
-    print("  - Generating top 10 artists chart")
-    plt.figure(figsize=(12, 6))
-    plt.subplot(2, 1, 1)
-    top_artists = df.groupby('artist_name')['minutes_played'].sum().sort_values(ascending=False).head(10)
-    sns.barplot(x=top_artists.values, y=top_artists.index)
-    plt.title('Top 10 Artists by Listening Time')
-    plt.xlabel('Minutes Played')
-    plt.ylabel('Artist')
-    plt.tight_layout()
-    plt.savefig('top_10_artists.png')
-    print("    ✓ Saved top_10_artists.png")
+    log("  - Generating top 10 artists chart")
+    top_artists = get_aggregate(df, 'artist_minutes').sort_values(ascending=False).head(10)
+    render_chart(chart_job('top_10_artists.png', 'barh', 'Top 10 Artists by Listening Time', 'Minutes Played', 'Artist',
+                           labels=top_artists.index.astype(str), values=top_artists.values))
+    return top_artists
 
+@instrumented()
 def listening_time_by_hour(df):
-    print("  - Generating hourly listening chart")
+    log("  - Generating hourly listening chart")
     
-    hourly_listening = df.groupby(['year', 'hour'])['minutes_played'].sum().unstack(level=0)
+    hourly_listening = get_aggregate(df, 'time_grid').groupby(level=['year', 'hour']).sum().unstack(level=0)
 
-    fig, ax = plt.subplots(figsize=(12, 6))
-    hourly_listening.plot(kind='bar', stacked=True, ax=ax)
-    
-    plt.title('Listening Time by Hour of Day')
-    plt.xlabel('Hour of Day')
-    plt.ylabel('Minutes Played')
-    plt.xticks(range(24))
-    plt.tight_layout()
-    plt.savefig('listening_by_hour.png')
-    print("    ✓ Saved listening_by_hour.png")
+    render_chart(chart_job('listening_by_hour.png', 'stacked_bar', 'Listening Time by Hour of Day', 'Hour of Day', 'Minutes Played',
+                           labels=hourly_listening.index, values=hourly_listening.values,
+                           series=hourly_listening.columns, xticks=range(24)))
     #hourly_listening.to_csv('listening_by_hour.csv')
+    return hourly_listening
 
+@instrumented()
 def listening_time_by_day(df):
-    print("  - Generating weekly listening chart")
-    plt.figure(figsize=(12, 6))
+    log("  - Generating weekly listening chart")
     day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    weekly_listening = df.groupby('day_of_week')['minutes_played'].sum()
-    sns.barplot(x=weekly_listening.index, y=weekly_listening.values)
-    plt.xticks(range(7), day_names)
-    plt.title('Listening Time by Day of Week')
-    plt.xlabel('Day of Week')
-    plt.ylabel('Minutes Played')
-    plt.tight_layout()
-    plt.savefig('listening_by_day.png')
-    print("    ✓ Saved listening_by_day.png")
+    weekly_listening = get_aggregate(df, 'time_grid').groupby(level='day_of_week').sum()
+    render_chart(chart_job('listening_by_day.png', 'bar', 'Listening Time by Day of Week', 'Day of Week', 'Minutes Played',
+                           labels=weekly_listening.index, values=weekly_listening.values,
+                           xticks=range(7), xticklabels=day_names))
+    return weekly_listening
 
+@instrumented()
 def most_played_albums(df):
-    print("  - Generating most played albums chart")
-    plt.figure(figsize=(12, 6))
-    top_albums = df.groupby('album_name')['minutes_played'].sum().sort_values(ascending=False).head(10)
-    sns.barplot(x=top_albums.values, y=top_albums.index)
-    plt.title('Top 10 Albums by Listening Time')
-    plt.xlabel('Minutes Played')
-    plt.ylabel('')
-    plt.tight_layout()
-    plt.savefig('top_albums.png')
-    print("    ✓ Saved top_albums.png")
+    log("  - Generating most played albums chart")
+    top_albums = get_aggregate(df, 'album_minutes').sort_values(ascending=False).head(10)
+    render_chart(chart_job('top_albums.png', 'barh', 'Top 10 Albums by Listening Time', 'Minutes Played', '',
+                           labels=top_albums.index.astype(str), values=top_albums.values))
+    return top_albums
+
+# Period granularities supported by analyze_yearly_trends and the chart file prefix for each
+PERIOD_NAMES = {'year': 'yearly', 'quarter': 'quarterly', 'month': 'monthly', 'week': 'weekly'}
+
+_EPOCH = pd.Timestamp(0, tz='UTC')
+
+def _period_keys(df, period):
+    """
+    Integer period key per row and a function turning a key into its label
+    
+    Keys are derived from the year/month columns where possible, so only
+    weekly periods need the timestamp column.
+    """
+    if period == 'year':
+        return df['year'].astype('int32'), lambda key: key
+    if period == 'quarter':
+        keys = df['year'].astype('int32') * 4 + (df['month'].astype('int32') - 1) // 3
+        return keys, lambda key: f"{key // 4}Q{key % 4 + 1}"
+    if period == 'month':
+        keys = df['year'].astype('int32') * 12 + df['month'].astype('int32') - 1
+        return keys, lambda key: f"{key // 12}-{key % 12 + 1:02d}"
+    if period == 'week':
+        # 1970-01-01 was a Thursday, shift by 3 days so weeks start on Monday
+        days = (pd.to_datetime(df['ts'], utc=True) - _EPOCH) // pd.Timedelta(days=1)
+        keys = (days + 3) // 7
+        return keys, lambda key: (_EPOCH + pd.Timedelta(days=int(key) * 7 - 3)).date().isoformat()
+    raise ValueError(f"Unknown period '{period}', expected one of {list(PERIOD_NAMES)}")
+
+def _top_per_period(df, keys, column, top_n):
+    # One grouped sum over (period, name), then the top N names within each period
+    totals = df.groupby([keys, df[column]], observed=True)['minutes_played'].sum()
+    top = totals.sort_values(ascending=False).groupby(level=0).head(top_n)
+    return {key: group.droplevel(0) for key, group in top.groupby(level=0)}
 
-def analyze_yearly_trends(df):
+@instrumented()
+def analyze_yearly_trends(df, period='year', top_n=5):
     """
-    Analyze trends by year
+    Analyze trends by year (or by quarter, month or week)
+    
+    All periods are computed with a fixed number of grouped passes over the
+    frame instead of filtering the frame once per period.
+    
+    Parameters:
+    df (pandas.DataFrame): Preprocessed Spotify data
+    period (str): One of 'year', 'quarter', 'month' or 'week'
+    top_n (int): Number of top artists and tracks kept per period
+    
+    Returns:
+    dict: Period label to top artists, top tracks, monthly listening and total hours
     """
-    print("\nAnalyzing yearly trends...")
+    log(f"\nAnalyzing {PERIOD_NAMES.get(period, period)} trends...")
+    
+    keys, label = _period_keys(df, period)
+    keys = keys.rename('period')
+    
+    top_artists = _top_per_period(df, keys, 'artist_name', top_n)
+    top_tracks = _top_per_period(df, keys, 'track_name', top_n)
+    monthly = df.groupby([keys, 'month'])['minutes_played'].sum()
+    period_totals = monthly.groupby(level=0).sum()
     
-    # Group by year and get stats
     yearly_stats = {}
     
-    for year in sorted(df['year'].unique()):
-        print(f"  - Processing data for {year}")
-        year_data = df[df['year'] == year]
-        
-        # Top 5 artists by year
-        top_artists = year_data.groupby('artist_name')['minutes_played'].sum().sort_values(ascending=False).head(5)
+    for key, total_time in period_totals.items():
+        log(f"  - Processing data for {label(key)}")
+        empty = pd.Series(dtype='float64')
+        period_artists = top_artists.get(key, empty)
+        period_tracks = top_tracks.get(key, empty)
+        monthly_listening = monthly.loc[key]
         
-        # Top 5 tracks by year
-        top_tracks = year_data.groupby('track_name')['minutes_played'].sum().sort_values(ascending=False).head(5)
+        log(period_artists)
+        log(period_tracks)
         
-        # Listening time by month for this year
-        monthly_listening = year_data.groupby('month')['minutes_played'].sum()
+        log(f"Time per month: {monthly_listening}")
+        log(f"{period.title()} time: {total_time}")
         
-        # Total listening time for the year
-        total_time = year_data['minutes_played'].sum()
-        
-        print(top_artists)
-        print(top_tracks)
-        
-        print(f"Time per month: {monthly_listening}")
-        print(f"Year time: {total_time}")
-
-        yearly_stats[year] = {
-            'top_artists': top_artists.to_dict(),
-            'top_tracks': top_tracks.to_dict(),
+        yearly_stats[label(key)] = {
+            'top_artists': period_artists.to_dict(),
+            'top_tracks': period_tracks.to_dict(),
             'monthly_listening': monthly_listening.to_dict(),
             'total_hours': total_time / 60
         }
     
-    # Create year-over-year comparison chart
-    years = sorted(yearly_stats.keys())
-    hours_per_year = [yearly_stats[year]['total_hours'] for year in years]
+    # Create period-over-period comparison chart
+    periods = list(yearly_stats.keys())
+    hours_per_period = [yearly_stats[key]['total_hours'] for key in periods]
+    filename = f'{PERIOD_NAMES[period]}_listening_comparison.png'
     
-    plt.figure(figsize=(12, 6))
-    sns.barplot(x=years, y=hours_per_year)
-    plt.title('Listening Hours by Year')
-    plt.xlabel('Year')
-    plt.ylabel('Hours')
-    plt.tight_layout()
-    plt.savefig('yearly_listening_comparison.png')
-    print("    ✓ Saved yearly_listening_comparison.png")
+    render_chart(chart_job(filename, 'bar', f'Listening Hours by {period.title()}', period.title(), 'Hours',
+                           labels=[str(key) for key in periods], values=hours_per_period))
     
     return yearly_stats
 
-def analyze_skip_behavior(df):
+@instrumented()
+def analyze_skip_behavior(df, min_plays=DEFAULT_MIN_PLAYS):
     """
     Analyze skipping behavior to find insights
+
+    Play counts, skip rates and completion ratios per track and per hour come
+    from one grouped pass over the play arrays (see engagement.engagement_stats).
+    Completion needs track lengths from enrichment.py and is left out without them.
+
+    Parameters:
+    df (pandas.DataFrame): Preprocessed Spotify data
+    min_plays (int): Minimum plays for a track to be ranked
+
+    Returns:
+    dict: skip_rate, play_count (and avg_completion) of the 10 most skipped tracks
     """
-    print("\nAnalyzing skip behavior...")
+    log("\nAnalyzing skip behavior...")
     
-    # Filter to tracks that were played more than once
-    track_counts = df['track_name'].value_counts()
-    repeated_tracks = track_counts[track_counts > 1].index
-    repeat_df = df[df['track_name'].isin(repeated_tracks)]
+    # Group on integer track ids when the dataset has them, otherwise on factorized names;
+    # plays without a name get -1 like plays without an id, and are only counted per hour
+    track_key = key_column(df, 'track_name')
+    if track_key == 'track_id':
+        keys, names = df['track_id'].to_numpy(), None
+    else:
+        keys, names = pd.factorize(df['track_name'])
     
-    # Calculate skip rates per track
-    track_skip_rates = repeat_df.groupby('track_name')['skipped'].mean() * 100
+    durations = None
+    if track_key == 'track_id' and 'ms_played' in df.columns:
+        durations = track_durations(df.attrs.get('dataset_path', DATASET_PATH))
     
-    # Most skipped tracks (that were played at least 5 times)
-    frequently_played = df['track_name'].value_counts()[df['track_name'].value_counts() >= 5].index
-    frequent_tracks_df = df[df['track_name'].isin(frequently_played)]
-    frequent_skip_rates = frequent_tracks_df.groupby('track_name').agg({
-        'skipped': ['mean', 'count']
-    })
-    frequent_skip_rates.columns = ['skip_rate', 'play_count']
-    frequent_skip_rates['skip_rate'] = frequent_skip_rates['skip_rate'] * 100
-    most_skipped = frequent_skip_rates.sort_values('skip_rate', ascending=False).head(10)
+    tracks, by_hour = engagement_stats(keys, df['skipped'], df['hour'].to_numpy(),
+                                       ms_played=df['ms_played'].to_numpy() if 'ms_played' in df.columns else None,
+                                       durations=durations, min_plays=min_plays)
+    
+    # Most skipped tracks among those played at least min_plays times
+    columns = {'skip_rate': 'skip_rate', 'plays': 'play_count'}
+    if 'avg_completion' in tracks.columns:
+        columns['avg_completion'] = 'avg_completion'
+    most_skipped = tracks.sort_values('skip_rate', ascending=False, kind='stable').head(10)[list(columns)].rename(columns=columns)
+    most_skipped.index = key_names(df, most_skipped.index, track_key) if names is None else pd.Index(names.take(most_skipped.index)).astype(str)
     
     # Visualize most skipped tracks
-    plt.figure(figsize=(12, 8))
-    ax = sns.barplot(x=most_skipped['skip_rate'].values, y=most_skipped.index)
-    plt.title('Most Frequently Skipped Tracks (Played at least 5 times)')
-    plt.xlabel('Skip Rate (%)')
-    plt.tight_layout()
-    plt.savefig('most_skipped_tracks.png')
-    print("    ✓ Saved most_skipped_tracks.png")
-    
-    # Calculate skip rates by time of day
-    hourly_skip_rates = df.groupby('hour')['skipped'].mean() * 100
-    
-    plt.figure(figsize=(12, 6))
-    sns.lineplot(x=hourly_skip_rates.index, y=hourly_skip_rates.values, marker='o')
-    plt.title('Skip Rates by Hour of Day')
-    plt.xlabel('Hour')
-    plt.ylabel('Skip Rate (%)')
-    plt.xticks(range(24))
-    plt.tight_layout()
-    plt.savefig('hourly_skip_rates.png')
-    print("    ✓ Saved hourly_skip_rates.png")
+    render_chart(chart_job('most_skipped_tracks.png', 'barh', f'Most Frequently Skipped Tracks (Played at least {min_plays} times)', 'Skip Rate (%)',
+                           labels=most_skipped.index, values=most_skipped['skip_rate'].values, figsize=(12, 8)))
+    
+    # Skip rates by time of day
+    hourly_skip_rates = by_hour['skip_rate'][by_hour['skip_known'] > 0]
+    
+    render_chart(chart_job('hourly_skip_rates.png', 'line', 'Skip Rates by Hour of Day', 'Hour', 'Skip Rate (%)',
+                           labels=hourly_skip_rates.index, values=hourly_skip_rates.values, xticks=range(24)))
     
     return most_skipped.to_dict()
 
+@instrumented()
 def discover_listening_sessions(df):
     """
     Identify listening sessions and analyze them
     """
-    print("\nIdentifying listening sessions...")
+    log("\nIdentifying listening sessions...")
     
-    # Sort by timestamp
-    df_sorted = df.sort_values('ts')
-    
-    # Define a session as continuous listening with gaps less than 20 minutes
-    SESSION_GAP_MINUTES = 20
-    
-    # Calculate time difference between consecutive tracks
-    df_sorted['next_ts'] = df_sorted['ts'].shift(-1)
-    df_sorted['time_diff'] = (df_sorted['next_ts'] - df_sorted['ts']).dt.total_seconds() / 60
-    
-    # Mark new sessions (where time gap > SESSION_GAP_MINUTES)
-    df_sorted['new_session'] = (df_sorted['time_diff'] > SESSION_GAP_MINUTES) | (df_sorted['time_diff'].isna())
-    df_sorted['session_id'] = df_sorted['new_session'].cumsum()
-    
-    # Analyze sessions
-    sessions = df_sorted.groupby('session_id').agg({
-        'ts': 'min',
-        'track_name': 'count',
-        'minutes_played': 'sum',
-        'time_diff': 'sum'
-    })
-    
-    sessions.columns = ['start_time', 'tracks_played', 'duration_minutes', 'gaps_minutes']
-    sessions['total_session_minutes'] = sessions['duration_minutes'] + sessions['gaps_minutes']
-    
-    # Add day of week and hour info
-    sessions['day_of_week'] = sessions['start_time'].dt.dayofweek
-    sessions['hour'] = sessions['start_time'].dt.hour
-    sessions['month'] = sessions['start_time'].dt.month
-    sessions['year'] = sessions['start_time'].dt.year
+    # A new session starts after a gap of more than SESSION_GAP_MINUTES (shared with binge detection)
+    sessions, _ = get_aggregate(df, 'sessions')
     
     # Session insights
     avg_session_length = sessions['duration_minutes'].mean()
@@ -265,28 +657,13 @@ def discover_listening_sessions(df):
     longest_session = sessions.sort_values('duration_minutes', ascending=False).iloc[0]
     
     # Visualize session lengths
-    plt.figure(figsize=(12, 6))
-    sns.histplot(sessions['duration_minutes'], bins=30)
-    plt.axvline(avg_session_length, color='r', linestyle='--', label=f'Average ({avg_session_length:.1f} min)')
-    plt.title('Distribution of Listening Session Lengths')
-    plt.xlabel('Session Duration (minutes)')
-    plt.ylabel('Count')
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig('session_length_distribution.png')
-    print("    ✓ Saved session_length_distribution.png")
+    render_chart(chart_job('session_length_distribution.png', 'hist', 'Distribution of Listening Session Lengths', 'Session Duration (minutes)', 'Count',
+                           values=sessions['duration_minutes'].values, bins=30, mean_line=avg_session_length))
     
     # Visualize sessions by hour of day
     hourly_sessions = sessions.groupby('hour').size()
-    plt.figure(figsize=(12, 6))
-    sns.barplot(x=hourly_sessions.index, y=hourly_sessions.values)
-    plt.title('Number of Listening Sessions by Hour of Day')
-    plt.xlabel('Hour')
-    plt.ylabel('Number of Sessions')
-    plt.xticks(range(24))
-    plt.tight_layout()
-    plt.savefig('sessions_by_hour.png')
-    print("    ✓ Saved sessions_by_hour.png")
+    render_chart(chart_job('sessions_by_hour.png', 'bar', 'Number of Listening Sessions by Hour of Day', 'Hour', 'Number of Sessions',
+                           labels=hourly_sessions.index, values=hourly_sessions.values, xticks=range(24)))
     
     session_stats = {
         'total_sessions': len(sessions),
@@ -299,134 +676,353 @@ def discover_listening_sessions(df):
     
     return session_stats, sessions
 
+@instrumented()
 def analyze_binge_listening(df):
     """
     Analyze binge listening patterns - consecutive plays of the same artist
     """
-    print("\nAnalyzing binge listening patterns...")
+    log("\nAnalyzing binge listening patterns...")
     
-    # Sort by timestamp
-    df_sorted = df.sort_values('ts').copy()
-    
-    # Add next artist column
-    df_sorted['next_artist'] = df_sorted['artist_name'].shift(-1)
-    
-    # Mark when artist changes
-    df_sorted['artist_change'] = df_sorted['artist_name'] != df_sorted['next_artist']
-    
-    # Create binge groups
-    df_sorted['binge_group'] = df_sorted['artist_change'].cumsum()
-    
-    # Count consecutive plays of the same artist
-    binge_counts = df_sorted.groupby('binge_group').agg({
-        'artist_name': ['first', 'count'],
-        'minutes_played': 'sum',
-        'ts': 'min'
-    })
-
-    binge_counts.columns = ['artist', 'consecutive_plays', 'duration_minutes', 'start_time']
+    # Runs of consecutive plays of the same artist (integer ids when the dataset has them)
+    artist_key = key_column(df, 'artist_name')
+    _, binge_counts = get_aggregate(df, 'sessions')
     
     # Find longest binges
     longest_binges = binge_counts.sort_values('consecutive_plays', ascending=False).head(10)
     # Visualize top binge artists
-    top_binge_artists = binge_counts[binge_counts['consecutive_plays'] >= 3].groupby('artist').size().sort_values(ascending=False).head(10)
-    
-    plt.figure(figsize=(12, 6))
-    sns.barplot(x=top_binge_artists.values, y=top_binge_artists.index)
-    plt.title('Artists Most Frequently Listened to in Binges (3+ Consecutive Tracks)')
-    plt.xlabel('Number of Binges')
-    plt.tight_layout()
+    binges = binge_counts[(binge_counts['consecutive_plays'] >= 3) & binge_counts['artist'].notna()]
+    if artist_key == 'artist_id':
+        binges = binges[binges['artist'] >= 0]
+    top_binge_artists = binges.groupby('artist', observed=True).size().sort_values(ascending=False).head(10)
+    top_binge_artists.index = key_names(df, top_binge_artists.index, artist_key)
     
-    plt.savefig('top_binge_artists.png')
-    print("    ✓ Saved top_binge_artists.png")
+    render_chart(chart_job('top_binge_artists.png', 'barh', 'Artists Most Frequently Listened to in Binges (3+ Consecutive Tracks)', 'Number of Binges',
+                           labels=top_binge_artists.index, values=top_binge_artists.values))
     
     # Distribution of binge lengths
-    plt.figure(figsize=(12, 6))
-    sns.histplot(binge_counts[binge_counts['consecutive_plays'] > 1]['consecutive_plays'], bins=20)
-    plt.title('Distribution of Artist Binge Lengths')
-    plt.xlabel('Consecutive Tracks')
-    plt.ylabel('Frequency')
-    plt.yscale('log')
-    plt.tight_layout()
-    plt.savefig('binge_length_distribution.png')
-    print("    ✓ Saved binge_length_distribution.png")
+    binge_lengths = binge_counts[binge_counts['consecutive_plays'] > 1]['consecutive_plays']
+    render_chart(chart_job('binge_length_distribution.png', 'hist', 'Distribution of Artist Binge Lengths', 'Consecutive Tracks', 'Frequency',
+                           values=binge_lengths.values, bins=20, log_y=True))
+    
+    longest_binges = longest_binges.assign(artist=key_names(df, longest_binges['artist'], artist_key))
+    return {'top_binge_artists': top_binge_artists, 'longest_binges': longest_binges}
 
+@instrumented()
 def top_tracks_all_time_by_listen_time(df):
-    top_tracks = df.groupby('track_name')['minutes_played'].sum().sort_values(ascending=False).head(10)
-    plt.figure(figsize=(12, 6))
-    sns.barplot(x=top_tracks.values, y=top_tracks.index)
-    plt.title('Top 10 Tracks by Listening Time')
-    plt.xlabel('Minutes')
-    plt.ylabel('Track')
-    plt.tight_layout()
-    plt.savefig('top_10_tracks.png')
-    print("    ✓ Saved top_10_tracks.png")
+    top_tracks = get_aggregate(df, 'track_totals')['sum'].sort_values(ascending=False).head(10)
+    render_chart(chart_job('top_10_tracks.png', 'barh', 'Top 10 Tracks by Listening Time', 'Minutes', 'Track',
+                           labels=top_tracks.index.astype(str), values=top_tracks.values))
+    return top_tracks
 
+@instrumented()
 def top_tracks_all_time_by_play_count(df):
-    top_tracks = df['track_name'].value_counts().head(10)
-    plt.figure(figsize=(12, 6))
-    sns.barplot(x=top_tracks.values, y=top_tracks.index)
-    plt.title('Top 10 Tracks by Play Count')
-    plt.xlabel('Play Count')
-    plt.ylabel('Track')
-    plt.tight_layout()
-    plt.savefig('top_10_tracks_play_count.png')
-    print("    ✓ Saved top_10_tracks_play_count.png")
+    top_tracks = get_aggregate(df, 'track_totals')['count'].sort_values(ascending=False).head(10)
+    render_chart(chart_job('top_10_tracks_play_count.png', 'barh', 'Top 10 Tracks by Play Count', 'Play Count', 'Track',
+                           labels=top_tracks.index.astype(str), values=top_tracks.values))
+    return top_tracks
 
+@instrumented()
 def count_ips(df):
-    c = df['ip_addr'].nunique()
-    print(f"Unique IP ADDRs: {c}")
+    c = distinct_count(df, 'ip_addr')
+    log(f"Unique IP ADDRs: {c}")
+    return c
 
-if __name__ == "__main__":
-    print("=" * 50)
-    print("SPOTIFY DATA ANALYSIS")
-    print("=" * 50)
+# Columns each analysis reads, so only those are loaded from the store
+ANALYSIS_COLUMNS = {
+    'generate_basic_stats': ['minutes_played', 'track_name', 'artist_name', 'album_name', 'content_type', 'ts', 'platform', 'skipped', 'shuffle'],
+    'top_10_artists_all_time': ['artist_name', 'minutes_played'],
+    'listening_time_by_hour': ['year', 'day_of_week', 'hour', 'minutes_played'],
+    'listening_time_by_day': ['year', 'day_of_week', 'hour', 'minutes_played'],
+    'most_played_albums': ['album_name', 'minutes_played'],
+    'analyze_yearly_trends': ['year', 'month', 'ts', 'artist_name', 'track_name', 'minutes_played'],
+    'analyze_skip_behavior': ['track_id', 'skipped', 'hour', 'ms_played'],
+    'discover_listening_sessions': ['ts', 'artist_id', 'minutes_played'],
+    'analyze_binge_listening': ['ts', 'artist_id', 'minutes_played'],
+    'top_tracks_all_time_by_listen_time': ['track_name', 'minutes_played'],
+    'top_tracks_all_time_by_play_count': ['track_name', 'minutes_played'],
+    'count_ips': ['ip_addr'],
+}
+
+# Subcommands whose aggregates all come from the rollup cube, so no rows need loading
+ROLLUP_COMMANDS = ['stats', 'top-artists', 'top-albums', 'top-tracks', 'top-tracks-plays', 'by-hour', 'by-day']
+
+# Subcommands that only need the session tables, which can be built from the dataset a year at a time
+SESSION_COMMANDS = ['sessions', 'binges']
+SESSION_COLUMNS = ['ts', 'artist_id', 'minutes_played']
+
+# CLI subcommand for each analysis
+COMMANDS = {
+    'stats': generate_basic_stats,
+    'ips': count_ips,
+    'top-artists': top_10_artists_all_time,
+    'top-albums': most_played_albums,
+    'top-tracks': top_tracks_all_time_by_listen_time,
+    'top-tracks-plays': top_tracks_all_time_by_play_count,
+    'by-hour': listening_time_by_hour,
+    'by-day': listening_time_by_day,
+    'trends': analyze_yearly_trends,
+    'skips': analyze_skip_behavior,
+    'sessions': discover_listening_sessions,
+    'binges': analyze_binge_listening,
+}
+
+def _jsonable(value):
+    # Convert analysis results (pandas objects, numpy scalars, timestamps) to JSON types
+    if isinstance(value, tuple) and len(value) == 2 and isinstance(value[1], pd.DataFrame):
+        # (summary, detail table) results report the summary only
+        return _jsonable(value[0])
+    if isinstance(value, pd.DataFrame):
+        return _jsonable(value.reset_index().to_dict(orient='records'))
+    if isinstance(value, pd.Series):
+        return _jsonable(value.to_dict())
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
 
-    # Start timing
-    overall_start_time = time.time()
+def print_basic_stats(stats):
+    print("\nBASIC STATISTICS:")
+    print("-" * 50)
+    print(f"Total listening time: {stats['total_hours']:.2f} hours")
+    print(f"Unique tracks: {stats['unique_tracks']}")
+    print(f"Unique artists: {stats['unique_artists']}")
+    print(f"Unique albums: {stats['unique_albums']}")
+    print(f"Date range: {stats['date_range'][0]} to {stats['date_range'][1]}")
+    print(f"Skip rate: {stats['skip_rate']:.2f}%")
+    print(f"Shuffle rate: {stats['shuffle_rate']:.2f}%")
     
-    # Load data
-    df_clean = load_spotify_data_csv('spotify_data_combined.csv')
+    # Top 5 platforms
+    print("\nTop 5 Platforms:")
+    for platform, usage_count in list(stats['platform_usage'].items())[:5]:
+        print(f"  - {platform}: {usage_count}")
+
+def print_result(command, result):
+    if command == 'stats':
+        print_basic_stats(result)
+        return
+    print(f"\n{command.upper()}:")
+    print("-" * 50)
+    print(json.dumps(_jsonable(result), indent=2, ensure_ascii=False))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Spotify listening history analysis")
+    parser.add_argument('commands', nargs='+', choices=list(COMMANDS) + ['all'], metavar='command',
+                        help=f"analyses to run: {', '.join(COMMANDS)} or all")
+    parser.add_argument('--data', default=DATASET_PATH, help="dataset written by load_clean_save_input.py")
+    parser.add_argument('--format', choices=['text', 'json', 'png'], default='text',
+                        help="print results as text or JSON, or render the charts as PNG")
+    parser.add_argument('--output-dir', default='.', help="directory for PNG charts")
+    parser.add_argument('--workers', type=int, default=None, help="chart rendering processes")
+    parser.add_argument('--period', choices=list(PERIOD_NAMES), default='year', help="granularity for trends")
+    parser.add_argument('--top-n', type=int, default=5, help="top artists/tracks per period for trends")
+    parser.add_argument('--from', dest='start', default=None,
+                        help="first date or period to analyze, e.g. 2023-06 (only the matching row groups are read)")
+    parser.add_argument('--to', dest='end', default=None, help="last date or period to analyze, e.g. 2023-09 (inclusive)")
+    parser.add_argument('--min-plays', type=int, default=DEFAULT_MIN_PLAYS, help="plays a track needs to be ranked by skip rate")
+    parser.add_argument('--session-gap', type=float, default=SESSION_GAP_MINUTES,
+                        help="minutes of silence that end a listening session")
+    parser.add_argument('--cache-dir', default=RESULT_CACHE_DIR, help="directory of cached analysis results")
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                        help="megabytes of cached results to keep (least recently used are evicted)")
+    parser.add_argument('--no-cache', action='store_true', help="recompute every analysis and do not store the results")
+    parser.add_argument('--no-rollup', action='store_true', help="scan the rows even when the rollup cube can answer")
+    parser.add_argument('--sketch', action='store_true',
+                        help="approximate distinct counts and top tracks/artists/albums with sketches instead of exact grouping")
+    parser.add_argument('--distinct-error', type=float, default=DEFAULT_DISTINCT_ERROR,
+                        help="relative standard error of sketched distinct counts")
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K,
+                        help="counters per sketched top list (error at most total / top-k)")
+    parser.add_argument('--trace', metavar='PATH', help="write a trace of every stage (durations, rows, bytes, memory) to PATH")
+    parser.add_argument('--trace-format', choices=['chrome', 'json'], default='chrome',
+                        help="Chrome trace events (chrome://tracing, Perfetto) or plain JSON with a per-stage summary")
+    parser.add_argument('--profile', nargs='+', metavar='STAGE', default=None,
+                        help="profile these stages (function names such as analyze_yearly_trends, or '*' for all)")
+    parser.add_argument('--profile-mode', choices=['cprofile', 'sample'], default=None,
+                        help="cProfile .prof files or sampled stacks in flame graph .folded format")
+    parser.add_argument('--quiet', action='store_true', help="do not print progress and stage timings, only the results")
+    return parser.parse_args(argv)
+
+def uses_rollups(data, commands, rollups=True, start=None, end=None):
+    """
+    True when the rollup cube can answer every command without reading rows
+    """
+    return (rollups and not data.endswith('.csv') and start is None and end is None
+            and all(command in ROLLUP_COMMANDS for command in commands) and has_rollups(data))
+
+def uses_chunked_sessions(data, commands):
+    """
+    True when the commands only need the session tables and the dataset would
+    otherwise be decoded whole: a dataset directory with artist ids and
+    without a memory-mapped copy of the session columns
+    """
+    if data.endswith('.csv') or not all(command in SESSION_COMMANDS for command in commands):
+        return False
+    if has_mapped_columns(data, SESSION_COLUMNS):
+        return False
+    return 'artist_id' in dataset_columns(data)
+
+def analysis_frame(data, commands, rollups=True, sketch=None, start=None, end=None, session_gap=SESSION_GAP_MINUTES):
+    """
+    Frame the given commands run on: the rollup stand-in when the cube covers
+    them all, the session stand-in when they only need sessions, otherwise
+    only the columns the commands touch
+    """
+    if uses_rollups(data, commands, rollups, start, end):
+        log("Answering from the rollup cube")
+        df_clean = load_rollup_data(data)
+    elif uses_chunked_sessions(data, commands):
+        log("Building sessions one year at a time")
+        df_clean = load_session_data(data, start, end)
+    else:
+        columns = required_columns([COMMANDS[command] for command in commands], available_columns(data))
+        df_clean = load_analysis_data(data, columns=columns, start=start, end=end)
+    df_clean.attrs['session_gap_minutes'] = session_gap
+    if sketch is not None:
+        enable_sketches(df_clean, **sketch)
+    return df_clean
+
+def run_command(df_clean, command, period='year', top_n=5, min_plays=DEFAULT_MIN_PLAYS):
+    """
+    Run one CLI analysis on a frame from analysis_frame
+    """
+    if command == 'trends':
+        return analyze_yearly_trends(df_clean, period=period, top_n=top_n)
+    if command == 'skips':
+        return analyze_skip_behavior(df_clean, min_plays=min_plays)
+    return COMMANDS[command](df_clean)
+
+# Parameters of run_command and analysis_frame each command's result depends on
+COMMAND_PARAMS = {
+    'trends': ['period', 'top_n'],
+    'skips': ['min_plays'],
+    'sessions': ['session_gap'],
+    'binges': ['session_gap'],
+}
+
+def command_inputs(data, command, params, rollups=False, sketch=None, start=None, end=None):
+    """
+    Everything one command's result depends on, for keying cached results
 
-    # Generate basic statistics
-    #stats = generate_basic_stats(df_clean)
+    Only the parameters the command reads are included, so changing the
+    session gap does not invalidate the trends and vice versa.
+
+    Parameters:
+    data (str): Dataset written by load_clean_save_input.py
+    command (str): Key of COMMANDS
+    params (dict): period, top_n, min_plays and session_gap
+    rollups (bool): The command is answered from the rollup cube
+    sketch (dict): Sketch settings, or None for exact results
+    start, end (str): Analyzed time range
+
+    Returns:
+    dict: JSON-serializable description of the inputs
+    """
+    inputs = {
+        'command': command,
+        'function': COMMANDS[command].__name__,
+        'data': dataset_signature(data, rollups),
+        'params': {name: params[name] for name in COMMAND_PARAMS.get(command, [])},
+        'sketch': sketch,
+        'range': [start, end],
+    }
+    if command == 'skips' and not data.endswith('.csv'):
+        # Completion ratios come from the enrichment metadata cache
+        inputs['metadata'] = file_signature([os.path.join(data, '_metadata', 'tracks.jsonl')])
+    return inputs
+
+def run_analyses(data, commands, period='year', top_n=5, rollups=True, sketch=None, start=None, end=None,
+                 min_plays=DEFAULT_MIN_PLAYS, session_gap=SESSION_GAP_MINUTES, cache=None):
+    """
+    Run the given CLI analyses on a dataset and collect their chart jobs
+
+    With a result cache, each command's result and charts are looked up by
+    the signature of the files it reads, the command and the parameters it
+    uses before anything is loaded; only the misses are computed, and stored.
+
+    Parameters:
+    data (str): Dataset written by load_clean_save_input.py
+    commands (list): Keys of COMMANDS
+    period (str): Granularity for trends
+    top_n (int): Top artists/tracks per period for trends
+    rollups (bool): Answer from the rollup cube when it covers every command
+    sketch (dict): Keyword arguments for enable_sketches, or None for exact results
+    start (str): First date or period to analyze, e.g. '2023-06' (None for the beginning)
+    end (str): Last date or period to analyze, e.g. '2023-09' (None for the end)
+    min_plays (int): Plays a track needs to be ranked by skip rate
+    session_gap (float): Minutes of silence that end a listening session
+    cache (result_cache.ResultCache): Cache of earlier results, or None to compute everything
+
+    Returns:
+    tuple: (command to result dict, list of chart jobs)
+    """
+    params = {'period': period, 'top_n': top_n, 'min_plays': min_plays, 'session_gap': session_gap}
+    from_rollups = uses_rollups(data, commands, rollups, start, end)
     
-    # Print basic statistics
-    #print("\nBASIC STATISTICS:")
-    #print("-" * 50)
-    #print(f"Total listening time: {stats['total_hours']:.2f} hours")
-    #print(f"Unique tracks: {stats['unique_tracks']}")
-    #print(f"Unique artists: {stats['unique_artists']}")
-    #print(f"Unique albums: {stats['unique_albums']}")
-    #print(f"Date range: {stats['date_range'][0]} to {stats['date_range'][1]}")
-    #print(f"Skip rate: {stats['skip_rate']:.2f}%")
-    #print(f"Shuffle rate: {stats['shuffle_rate']:.2f}%")
+    # Each entry holds a command's result and the chart jobs it produced
+    entries, keys = {}, {}
+    if cache is not None:
+        with stage('result_cache', commands=commands) as event:
+            for command in commands:
+                keys[command] = result_key(command_inputs(data, command, params, from_rollups, sketch, start, end))
+                entry = cache.get(keys[command])
+                if entry is not None:
+                    log(f"  - {command}: cached result")
+                    entries[command] = entry
+            event['hits'] = len(entries)
     
-   
+    missing = [command for command in commands if command not in entries]
+    if missing:
+        df_clean = analysis_frame(data, missing, from_rollups, sketch, start, end, session_gap)
+        for command in missing:
+            # Charts are only collected here; plotting libraries load when they are rendered
+            with defer_rendering() as jobs:
+                result = run_command(df_clean, command, period, top_n, min_plays)
+            entries[command] = (result, jobs)
+            if cache is not None:
+                cache.put(keys[command], entries[command])
     
-    # Top 5 platforms
-    #print("\nTop 5 Platforms:")
-    #for platform, usage_count in list(stats['platform_usage'].items())[:5]:
-    #    print(f"  - {platform}: {usage_count}")
-
-    #top_tracks_all_time_by_listen_time(df_clean)
-    #top_10_artists_all_time(df_clean)
-    #most_played_albums(df_clean)
-    #listening_time_by_day(df_clean)
-    #listening_time_by_hour(df_clean)
-
-    #analyze_yearly_trends(df_clean)
-    #analyze_skip_behavior(df_clean)
-    #discover_listening_sessions(df_clean)
-    #analyze_listening_moods(df_clean)
-    #analyze_binge_listening(df_clean)
-
-    #top_tracks_all_time_by_play_count(df_clean)
-    #top_tracks_all_time_by_listen_time(df_clean)
-
-    count_ips(df_clean)
-
-    # Calculate overall execution time
-    overall_elapsed_time = time.time() - overall_start_time
-    print(f"\nTotal execution time: {overall_elapsed_time:.2f} seconds")
-    print("=" * 50)
+    results = {command: entries[command][0] for command in commands}
+    chart_jobs = [job for command in commands for job in entries[command][1]]
+    return results, chart_jobs
+
+def main(argv=None):
+    args = parse_args(argv)
+    commands = list(COMMANDS) if 'all' in args.commands else args.commands
+    configure(verbose=False if args.quiet else None, profile_stages=args.profile, profile_mode=args.profile_mode)
+    
+    # In JSON mode stdout carries only the JSON document; progress goes to stderr
+    progress = contextlib.redirect_stdout(sys.stderr) if args.format == 'json' else contextlib.nullcontext()
+    
+    with progress:
+        log("=" * 50)
+        log("SPOTIFY DATA ANALYSIS")
+        log("=" * 50)
+        
+        with stage('analysis', label="\nTotal execution", commands=commands):
+            sketch = {'distinct_error': args.distinct_error, 'top_k': args.top_k} if args.sketch else None
+            cache = None if args.no_cache else ResultCache(args.cache_dir, args.cache_size * 1024 * 1024)
+            results, chart_jobs = run_analyses(args.data, commands, period=args.period, top_n=args.top_n,
+                                               rollups=not args.no_rollup, sketch=sketch, start=args.start, end=args.end,
+                                               min_plays=args.min_plays, session_gap=args.session_gap, cache=cache)
+            
+            if args.format == 'png':
+                render_charts(chart_jobs, output_dir=args.output_dir, workers=args.workers)
+            elif args.format == 'text':
+                for command, result in results.items():
+                    print_result(command, result)
+        
+        if args.trace:
+            print(f"Trace written to {get_tracer().write(args.trace, args.trace_format)}")
+        log("=" * 50)
+    
+    if args.format == 'json':
+        json.dump(_jsonable(results), sys.stdout, indent=2, ensure_ascii=False)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,566 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Typed, compressed columnar store: a directory holding one Parquet part per ingested export file
+DATASET_PATH = "spotify_data"
+COMPRESSION = 'zstd'
+
+# Manifest of ingested files; the leading underscore keeps Parquet readers from treating it as data
+MANIFEST_NAME = "_manifest.json"
+MANIFEST_VERSION = 1
+
+# Rows per Parquet row group; the timestamp index resolves range queries to row groups
+ROW_GROUP_SIZE = 32_768
+
+# Timestamp index: ts range and row count of every row group of every part
+TS_INDEX_NAME = "_ts_index.parquet"
+
+# A play is identified by when it started, what was played and for how long
+RECORD_KEY_COLUMNS = ['ts', 'spotify_track_uri', 'spotify_episode_uri', 'audiobook_chapter_uri', 'ms_played']
+
+# Strings are dictionary-encoded so repeated artist/track names are stored once per row group
+STRING_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+COLUMN_TYPES = {
+    'ts': pa.timestamp('us', tz='UTC'),
+    'date': pa.date32(),
+    'ms_played': pa.int64(),
+    'minutes_played': pa.float64(),
+    'year': pa.int16(),
+    'month': pa.int8(),
+    'day': pa.int8(),
+    'hour': pa.int8(),
+    'day_of_week': pa.int8(),
+    'shuffle': pa.bool_(),
+    'skipped': pa.bool_(),
+    'offline': pa.bool_(),
+    'incognito_mode': pa.bool_(),
+    'offline_timestamp': pa.int64(),
+    'track_id': pa.int32(),
+    'artist_id': pa.int32(),
+    'album_id': pa.int32(),
+}
+
+# Dimension tables mapping the integer keys of the fact table back to names.
+# Each id equals the row position in its table; -1 in the fact table means unknown.
+DIMENSIONS = {
+    'tracks': ['track_id', 'track_key', 'track_name', 'artist_id', 'album_id', 'content_type'],
+    'artists': ['artist_id', 'artist_name'],
+    'albums': ['album_id', 'album_name'],
+}
+
+
+def _column_type(name, inferred_type):
+    if name in COLUMN_TYPES:
+        return COLUMN_TYPES[name]
+    if pa.types.is_string(inferred_type) or pa.types.is_large_string(inferred_type) or pa.types.is_null(inferred_type):
+        return STRING_TYPE
+    if pa.types.is_dictionary(inferred_type):
+        return STRING_TYPE
+    return inferred_type
+
+def to_arrow_table(df, schema=None):
+    """
+    Convert a preprocessed DataFrame into an Arrow table with the store's column types
+
+    Parameters:
+    df (pandas.DataFrame): Preprocessed Spotify data
+    schema (pyarrow.Schema): Target schema; inferred from the frame when omitted
+
+    Returns:
+    pyarrow.Table: Table conforming to the target schema
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if schema is None:
+        schema = pa.schema([pa.field(field.name, _column_type(field.name, field.type)) for field in table.schema])
+
+    # Conform column order and fill columns this batch does not carry
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table[field.name].cast(field.type))
+        else:
+            columns.append(pa.nulls(len(table), type=field.type))
+
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def write_dataset(chunks, path=DATASET_PATH):
+    """
+    Write an iterable of preprocessed DataFrame chunks to a single Parquet file
+
+    Each chunk becomes one or more row groups, so chunks can be written as they
+    are produced without holding the whole history in memory.
+
+    Parameters:
+    chunks (iterable): Preprocessed pandas.DataFrame chunks
+    path (str): Output Parquet file path
+
+    Returns:
+    int: Number of rows written
+    """
+    writer = None
+    rows = 0
+
+    try:
+        for chunk in chunks:
+            table = to_arrow_table(chunk, writer.schema if writer else None)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression=COMPRESSION)
+            writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+            rows += len(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows
+
+def save_dataset(df, path=DATASET_PATH):
+    """
+    Save a preprocessed DataFrame to the columnar store
+
+    Parameters:
+    df (pandas.DataFrame): Preprocessed Spotify data
+    path (str): Output Parquet file path
+
+    Returns:
+    int: Number of rows written
+    """
+    return write_dataset([df], path)
+
+def load_dataset(path=DATASET_PATH, columns=None):
+    """
+    Load the columnar store, reading only the requested columns
+
+    Strings come back as pandas categoricals, ts as a UTC datetime and
+    nullable booleans as the pandas boolean dtype.
+
+    Parameters:
+    path (str): Parquet file (or directory of Parquet files) to read
+    columns (list): Columns to read; all columns when omitted
+
+    Returns:
+    pandas.DataFrame: Typed Spotify data
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No dataset found at {path}, run load_clean_save_input.py first")
+
+    table = pq.read_table(path, columns=columns)
+    return table.to_pandas(types_mapper={pa.bool_(): pd.BooleanDtype()}.get)
+
+def dataset_bytes(path=DATASET_PATH, columns=None):
+    """
+    Compressed on-disk size of the given columns, from the Parquet footers
+
+    Parameters:
+    path (str): Parquet file or dataset directory
+    columns (list): Columns to count; all columns when omitted
+
+    Returns:
+    int: Bytes a read of those columns has to fetch
+    """
+    paths = part_paths(path) if os.path.isdir(path) else [path]
+    total = 0
+    for part in paths:
+        metadata = pq.read_metadata(part)
+        for row_group in range(metadata.num_row_groups):
+            group = metadata.row_group(row_group)
+            for index in range(group.num_columns):
+                chunk = group.column(index)
+                if columns is None or chunk.path_in_schema in columns:
+                    total += chunk.total_compressed_size
+    return total
+
+def iter_year_chunks(path=DATASET_PATH, columns=None, start=None, end=None):
+    """
+    Yield the dataset one year at a time, each chunk sorted by ts
+
+    Only one year's rows (of the requested columns) are held in memory, and
+    chunks come out in time order, as required by sessions.SessionBuilder.
+    The years and the row groups to read come from the timestamp index.
+
+    Parameters:
+    path (str): Dataset directory or Parquet file
+    columns (list): Columns to read; must include ts
+    start (pandas.Timestamp): Inclusive lower bound (None for the beginning)
+    end (pandas.Timestamp): Exclusive upper bound (None for the end)
+
+    Returns:
+    generator: Yields pandas.DataFrame chunks
+    """
+    index = load_ts_index(path)
+    index = index[index['rows'] > 0]
+    if index.empty:
+        return
+    for year in range(index['ts_min'].min().year, index['ts_max'].max().year + 1):
+        lower = pd.Timestamp(year=year, month=1, day=1, tz='UTC')
+        upper = lower + pd.DateOffset(years=1)
+        lower = lower if start is None else max(lower, start)
+        upper = upper if end is None else min(upper, end)
+        if lower >= upper:
+            continue
+        chunk = load_range(path, lower, upper, columns, index=index)
+        if len(chunk):
+            yield chunk
+
+def _row_group_ranges(part_path):
+    # ts range of each row group, read from the Parquet footer statistics
+    metadata = pq.read_metadata(part_path)
+    names = metadata.schema.names
+    # Parts without rows keep a placeholder entry so the index still records them as indexed
+    ranges = [{'part': os.path.basename(part_path), 'row_group': -1, 'ts_min': None, 'ts_max': None, 'rows': 0}]
+    if 'ts' not in names:
+        return ranges
+    ts_column = names.index('ts')
+    for row_group in range(metadata.num_row_groups):
+        group = metadata.row_group(row_group)
+        statistics = group.column(ts_column).statistics
+        if group.num_rows == 0:
+            continue
+        if statistics is None or not statistics.has_min_max:
+            ts_min, ts_max = pd.Timestamp.min.tz_localize('UTC'), pd.Timestamp.max.tz_localize('UTC')
+        else:
+            ts_min, ts_max = pd.Timestamp(statistics.min), pd.Timestamp(statistics.max)
+        ranges.append({'part': os.path.basename(part_path), 'row_group': row_group,
+                       'ts_min': ts_min, 'ts_max': ts_max, 'rows': group.num_rows})
+    return ranges[1:] if len(ranges) > 1 else ranges
+
+def _ts_index_frame(ranges):
+    frame = pd.DataFrame(ranges, columns=['part', 'row_group', 'ts_min', 'ts_max', 'rows'])
+    for column in ('ts_min', 'ts_max'):
+        frame[column] = pd.to_datetime(frame[column], utc=True)
+    return frame.astype({'row_group': 'int32', 'rows': 'int64'})
+
+def update_ts_index(dataset_dir=DATASET_PATH):
+    """
+    Bring the timestamp index in line with the parts on disk
+
+    Entries of removed parts are dropped and parts not indexed yet are read
+    from their Parquet footers; existing entries are kept as they are.
+
+    Returns:
+    pandas.DataFrame: The index (part, row_group, ts_min, ts_max, rows)
+    """
+    index_path = os.path.join(dataset_dir, TS_INDEX_NAME)
+    parts = {os.path.basename(path): path for path in part_paths(dataset_dir)}
+
+    index = pq.read_table(index_path).to_pandas() if os.path.exists(index_path) else _ts_index_frame([])
+    index = index[index['part'].isin(list(parts))]
+    missing = [path for name, path in parts.items() if name not in set(index['part'])]
+    if missing:
+        added = _ts_index_frame([entry for path in missing for entry in _row_group_ranges(path)])
+        index = pd.concat([index, added], ignore_index=True) if len(index) else added
+
+    index = index.sort_values(['ts_min', 'part', 'row_group'], ignore_index=True)
+    tmp_path = index_path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(index, preserve_index=False), tmp_path, compression=COMPRESSION)
+    os.replace(tmp_path, index_path)
+    return index
+
+def remove_from_ts_index(part, dataset_dir=DATASET_PATH):
+    """
+    Drop the index entries of a part that is being replaced
+    """
+    index_path = os.path.join(dataset_dir, TS_INDEX_NAME)
+    if os.path.exists(index_path):
+        index = pq.read_table(index_path).to_pandas()
+        index = index[index['part'] != part]
+        pq.write_table(pa.Table.from_pandas(index, preserve_index=False), index_path + ".tmp", compression=COMPRESSION)
+        os.replace(index_path + ".tmp", index_path)
+
+def load_ts_index(path=DATASET_PATH):
+    """
+    Timestamp index of a dataset directory (or of a single Parquet file)
+
+    The stored index is used when it covers exactly the parts on disk;
+    otherwise it is brought up to date first.
+    """
+    if not os.path.isdir(path):
+        return _ts_index_frame(_row_group_ranges(path))
+
+    index_path = os.path.join(path, TS_INDEX_NAME)
+    if os.path.exists(index_path):
+        index = pq.read_table(index_path).to_pandas()
+        if set(index['part']) == {os.path.basename(part) for part in part_paths(path)}:
+            return index
+    return update_ts_index(path)
+
+def parse_time_range(start=None, end=None):
+    """
+    UTC bounds for a range given as dates or periods, both ends inclusive
+
+    '2023-06' to '2023-09' covers June 1st through the end of September.
+
+    Returns:
+    tuple: (start Timestamp or None, exclusive end Timestamp or None)
+    """
+    def bound(text, edge):
+        if text is None:
+            return None
+        period = pd.Period(str(text))
+        stamp = period.start_time if edge == 'start' else (period + 1).start_time
+        return stamp.tz_localize('UTC') if stamp.tzinfo is None else stamp.tz_convert('UTC')
+    return bound(start, 'start'), bound(end, 'end')
+
+def load_range(path=DATASET_PATH, start=None, end=None, columns=None, index=None):
+    """
+    Load the plays with start <= ts < end, reading only the row groups that can contain them
+
+    Parameters:
+    path (str): Dataset directory or Parquet file
+    start (pandas.Timestamp): Inclusive lower bound (None for the beginning)
+    end (pandas.Timestamp): Exclusive upper bound (None for the end)
+    columns (list): Columns to return; all columns when omitted
+    index (pandas.DataFrame): Timestamp index to use instead of loading it
+
+    Returns:
+    pandas.DataFrame: Typed Spotify data sorted by ts
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No dataset found at {path}, run load_clean_save_input.py first")
+    index = load_ts_index(path) if index is None else index
+
+    selected = index[index['rows'] > 0]
+    if start is not None:
+        selected = selected[selected['ts_max'] >= start]
+    if end is not None:
+        selected = selected[selected['ts_min'] < end]
+
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ['ts']))
+    tables = []
+    for part, groups in selected.groupby('part', sort=False):
+        part_path = os.path.join(path, part) if os.path.isdir(path) else path
+        table = pq.ParquetFile(part_path).read_row_groups(sorted(groups['row_group'].tolist()), columns=read_columns)
+        tables.append(table)
+
+    if not tables:
+        empty = pq.read_schema(part_paths(path)[0] if os.path.isdir(path) else path).empty_table()
+        tables = [empty.select(read_columns) if read_columns else empty]
+
+    df = pa.concat_tables(tables, promote_options='default').to_pandas(types_mapper={pa.bool_(): pd.BooleanDtype()}.get)
+    mask = np.ones(len(df), dtype=bool)
+    if start is not None:
+        mask &= (df['ts'] >= start).to_numpy()
+    if end is not None:
+        mask &= (df['ts'] < end).to_numpy()
+    df = df[mask].sort_values('ts', kind='stable', ignore_index=True)
+    return df if columns is None else df[list(columns)]
+
+def load_manifest(dataset_dir=DATASET_PATH):
+    """
+    Load the manifest of already-ingested export files
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+
+    Returns:
+    dict: Manifest with a 'files' mapping of source path to size, mtime, hash, part and time range
+    """
+    manifest_path = os.path.join(dataset_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {'version': MANIFEST_VERSION, 'files': {}}
+
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_manifest(manifest, dataset_dir=DATASET_PATH):
+    """
+    Atomically write the manifest so an interrupted run never leaves it half written
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    manifest_path = os.path.join(dataset_dir, MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+def file_hash(file_path, block_size=1 << 20):
+    """
+    SHA-256 of a file's contents, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def part_name(source_path):
+    """
+    Name of the Parquet part holding the rows ingested from a source file
+    """
+    return f"part-{hashlib.sha256(source_path.encode('utf-8')).hexdigest()[:16]}.parquet"
+
+def record_keys(df):
+    """
+    Hash each row's identifying columns into a single uint64 key
+
+    Timestamps are normalized to epoch milliseconds and strings are hashed by
+    value, so keys match across categorical/string dtypes and timestamp units.
+
+    Parameters:
+    df (pandas.DataFrame): Spotify data containing ts and ms_played
+
+    Returns:
+    numpy.ndarray: uint64 key per row
+    """
+    keys = pd.DataFrame(index=df.index)
+    for column in RECORD_KEY_COLUMNS:
+        if column not in df.columns:
+            continue
+        if column == 'ts':
+            keys[column] = (pd.to_datetime(df[column], utc=True) - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)
+        elif column == 'ms_played':
+            keys[column] = df[column].astype('int64')
+        else:
+            keys[column] = df[column].astype(object)
+
+    return pd.util.hash_pandas_object(keys, index=False).to_numpy()
+
+def part_paths(dataset_dir=DATASET_PATH):
+    """
+    Sorted Parquet part files in a dataset directory
+    """
+    if not os.path.isdir(dataset_dir):
+        return []
+    return sorted(
+        os.path.join(dataset_dir, name)
+        for name in os.listdir(dataset_dir)
+        if name.endswith('.parquet') and not name.startswith(('_', '.'))
+    )
+
+def dataset_columns(path=DATASET_PATH):
+    """
+    Columns every part of the dataset has, read from the Parquet footers
+
+    Parameters:
+    path (str): Parquet file or dataset directory
+
+    Returns:
+    list: Column names, in the order of the first part
+    """
+    paths = part_paths(path) if os.path.isdir(path) else [path] if os.path.exists(path) else []
+    columns = None
+    for part in paths:
+        names = pq.read_schema(part).names
+        columns = names if columns is None else [column for column in columns if column in names]
+    return columns or []
+
+def read_record_keys(dataset_dir=DATASET_PATH, start=None, end=None):
+    """
+    Record keys of the rows already stored, reading only the key columns
+
+    With a time range only the row groups that can hold plays in it are read.
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+    start (pandas.Timestamp): Inclusive lower bound (None for the beginning)
+    end (pandas.Timestamp): Exclusive upper bound (None for the end)
+
+    Returns:
+    numpy.ndarray: uint64 keys
+    """
+    keys = [np.empty(0, dtype=np.uint64)]
+    if start is None and end is None:
+        for path in part_paths(dataset_dir):
+            available = pq.read_schema(path).names
+            columns = [column for column in RECORD_KEY_COLUMNS if column in available]
+            keys.append(record_keys(load_dataset(path, columns)))
+        return np.concatenate(keys)
+
+    if not part_paths(dataset_dir):
+        return keys[0]
+    index = load_ts_index(dataset_dir)
+    selected = index[index['rows'] > 0]
+    if start is not None:
+        selected = selected[selected['ts_max'] >= start]
+    if end is not None:
+        selected = selected[selected['ts_min'] < end]
+    for part, groups in selected.groupby('part', sort=False):
+        path = os.path.join(dataset_dir, part)
+        available = pq.read_schema(path).names
+        # Keys are hashed over the columns each part has, as for a whole-part read
+        columns = [column for column in RECORD_KEY_COLUMNS if column in available]
+        keys.append(record_keys(load_range(path, start, end, columns, index=groups)))
+    return np.concatenate(keys)
+
+class StoredKeys:
+    """
+    Record keys of the stored plays, read one time range at a time as ingested chunks need them
+
+    A chunk only has to be checked against stored plays from its own time
+    span, so adding recent plays to a long history reads the keys of the
+    last few row groups instead of every part.
+    """
+
+    def __init__(self, dataset_dir=DATASET_PATH):
+        self.dataset_dir = dataset_dir
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.start = None
+        self.end = None
+
+    def cover(self, start, end):
+        """
+        Load the keys of the stored plays with start <= ts < end not loaded yet
+
+        Returns:
+        int: Number of keys read
+        """
+        # The loaded span stays contiguous, so a range beyond it also loads the gap in between
+        ranges = [(start, end)] if self.start is None else [(start, self.start), (self.end, end)]
+        read = 0
+        for lower, upper in ranges:
+            if lower < upper:
+                keys = read_record_keys(self.dataset_dir, lower, upper)
+                self.add(keys)
+                read += len(keys)
+        self.start = start if self.start is None else min(start, self.start)
+        self.end = end if self.end is None else max(end, self.end)
+        return read
+
+    def add(self, keys):
+        self.keys = np.concatenate([self.keys, keys])
+
+    def isin(self, keys):
+        return np.isin(keys, self.keys)
+
+def dimension_path(dataset_dir, name):
+    """
+    Path of a dimension table ('tracks', 'artists' or 'albums') in a dataset directory
+    """
+    return os.path.join(dataset_dir, f"_dim_{name}.parquet")
+
+def load_dimensions(dataset_dir=DATASET_PATH):
+    """
+    Load the track/artist/album dimension tables of a dataset
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+
+    Returns:
+    dict: Dimension name to DataFrame (empty tables for a new dataset)
+    """
+    dims = {}
+    for name, columns in DIMENSIONS.items():
+        path = dimension_path(dataset_dir, name)
+        if os.path.exists(path):
+            dims[name] = pq.read_table(path).to_pandas()
+        else:
+            dims[name] = pd.DataFrame({column: pd.Series(dtype='int32' if column.endswith('_id') else object) for column in columns})
+    return dims
+
+def save_dimensions(dims, dataset_dir=DATASET_PATH):
+    """
+    Write the dimension tables next to the fact parts
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    for name, df in dims.items():
+        tmp_path = dimension_path(dataset_dir, name) + ".tmp"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path, compression=COMPRESSION)
+        os.replace(tmp_path, dimension_path(dataset_dir, name))
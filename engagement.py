@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+from data_store import DATASET_PATH, load_dimensions
+
+
+# Tracks need at least this many plays to be ranked by skip rate
+DEFAULT_MIN_PLAYS = 5
+
+HOURS = 24
+
+
+def track_durations(dataset_dir=DATASET_PATH):
+    """
+    Known track length in ms per track_id, from the enrichment metadata cache
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+
+    Returns:
+    numpy.ndarray: float64 durations indexed by track_id (NaN where unknown), or None without metadata
+    """
+    from enrichment import load_track_metadata
+    metadata = load_track_metadata(dataset_dir)
+    if metadata.empty:
+        return None
+    tracks = load_dimensions(dataset_dir)['tracks']
+    durations = np.full(len(tracks), np.nan)
+    durations[tracks['track_id'].to_numpy()] = pd.to_numeric(
+        metadata['duration_ms'].reindex(tracks['track_key']), errors='coerce').to_numpy(dtype='float64')
+    return durations
+
+def engagement_stats(keys, skipped, hours, ms_played=None, durations=None, min_plays=DEFAULT_MIN_PLAYS, key_count=None):
+    """
+    Per-track and per-hour engagement from the play arrays in one grouped pass
+
+    Every measure is a bincount over the same integer keys, so the cost is
+    linear in the number of plays and nothing is copied beyond the arrays
+    themselves. Skip rates count only plays whose skipped flag is known;
+    completion is ms_played over the track length, capped at 1, for plays of
+    tracks with a known length.
+
+    Parameters:
+    keys (numpy.ndarray): Integer track key per play; negative for plays without a track
+    skipped (pandas.Series): Nullable boolean skipped flag per play
+    hours (numpy.ndarray): Hour of day per play
+    ms_played (numpy.ndarray): Milliseconds played per play (None to skip completion)
+    durations (numpy.ndarray): Track length in ms indexed by key, NaN where unknown
+    min_plays (int): Tracks with fewer plays are left out of the per-track table
+    key_count (int): Number of distinct keys (default: max key + 1)
+
+    Plays without a track (negative keys, e.g. no URI or name) are counted
+    per hour but left out of the per-track table.
+
+    Returns:
+    tuple: (per-track DataFrame indexed by key, per-hour DataFrame indexed by hour), each with
+        plays, skips, skip_known, skip_rate (%) and avg_completion
+    """
+    keys = np.asarray(keys, dtype='int64')
+    hours = np.asarray(hours, dtype='int64')
+    key_count = key_count if key_count is not None else (max(int(keys.max()) + 1, 0) if len(keys) else 0)
+    # Plays without a track share a bucket of their own; bincount needs non-negative groups
+    no_track = keys < 0
+
+    skip_known = skipped.notna().to_numpy()
+    skips = skipped.to_numpy(dtype='bool', na_value=False)
+
+    completion = completion_known = None
+    if ms_played is not None and durations is not None and len(durations):
+        # Length of each play's track, gathered by key; plays without a known track have no length
+        length = np.append(durations, np.nan)[np.where(no_track, len(durations), np.minimum(keys, len(durations)))]
+        completion_known = ~np.isnan(length) & (length > 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            completion = np.where(completion_known, np.minimum(np.asarray(ms_played, dtype='float64') / length, 1.0), 0.0)
+
+    def measures(groups, size):
+        table = pd.DataFrame({
+            'plays': np.bincount(groups, minlength=size),
+            'skips': np.bincount(groups, weights=skips, minlength=size).astype('int64'),
+            'skip_known': np.bincount(groups, weights=skip_known, minlength=size).astype('int64'),
+        })
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table['skip_rate'] = table['skips'] / table['skip_known'] * 100
+            if completion is not None:
+                table['avg_completion'] = (np.bincount(groups, weights=completion, minlength=size)
+                                           / np.bincount(groups, weights=completion_known, minlength=size))
+        return table
+
+    # Shift keys by one so the no-track bucket is group 0, then drop it
+    tracks = measures(np.where(no_track, 0, keys + 1), key_count + 1).iloc[1:]
+    tracks.index = pd.RangeIndex(key_count)
+    tracks = tracks[tracks['plays'] >= min_plays]
+    by_hour = measures(hours, HOURS)
+    return tracks, by_hour
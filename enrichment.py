@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import pandas as pd
+
+from data_store import DATASET_PATH, load_dataset, part_paths
+from instrumentation import stage
+from spotify_api import API_BASE_URL, TOKEN_URL, DEFAULT_CONCURRENCY, SpotifyClient, SpotifyAPIError
+
+
+# On-disk metadata cache next to the dataset: one JSON line per fetched object,
+# appended as each batch arrives so an interrupted run keeps what it fetched
+METADATA_DIR = "_metadata"
+METADATA_KINDS = ['tracks', 'artists', 'features']
+
+# Largest id lists the batch endpoints accept
+TRACK_BATCH = 50
+ARTIST_BATCH = 50
+FEATURES_BATCH = 100
+
+AUDIO_FEATURES = ['danceability', 'energy', 'valence', 'tempo', 'acousticness', 'instrumentalness',
+                  'speechiness', 'liveness', 'loudness', 'key', 'mode', 'time_signature']
+
+TRACK_URI_PREFIX = "spotify:track:"
+
+
+def _cache_path(dataset_dir, kind):
+    return os.path.join(dataset_dir, METADATA_DIR, f"{kind}.jsonl")
+
+def load_cache(kind, dataset_dir=DATASET_PATH):
+    """
+    Cached metadata records of one kind ('tracks', 'artists' or 'features')
+
+    Returns:
+    dict: Spotify id to record; ids the API did not know map to {'id': ..., 'missing': True}
+    """
+    records = {}
+    path = _cache_path(dataset_dir, kind)
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a truncated last line
+                continue
+            records[record['id']] = record
+    return records
+
+def _append_cache(file, records):
+    file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+    file.flush()
+
+def history_track_ids(dataset_dir=DATASET_PATH):
+    """
+    Distinct Spotify track ids in the listening history
+    """
+    ids = set()
+    for path in part_paths(dataset_dir):
+        uris = load_dataset(path, ['spotify_track_uri'])['spotify_track_uri']
+        ids.update(uri[len(TRACK_URI_PREFIX):] for uri in uris.cat.categories if uri.startswith(TRACK_URI_PREFIX))
+    return sorted(ids)
+
+def _track_record(track):
+    album = track.get('album') or {}
+    images = album.get('images') or []
+    return {
+        'id': track['id'],
+        'name': track.get('name'),
+        'duration_ms': track.get('duration_ms'),
+        'popularity': track.get('popularity'),
+        'explicit': track.get('explicit'),
+        'album_id': album.get('id'),
+        'album_image': images[0]['url'] if images else None,
+        'release_date': album.get('release_date'),
+        'artist_ids': [artist['id'] for artist in track.get('artists') or [] if artist.get('id')],
+    }
+
+def _artist_record(artist):
+    return {'id': artist['id'], 'name': artist.get('name'), 'genres': artist.get('genres') or []}
+
+def _features_record(features):
+    return {'id': features['id'], **{name: features.get(name) for name in AUDIO_FEATURES}}
+
+async def _fetch_batches(client, path, field, ids, batch_size, to_record, cache_file):
+    # Fetch ids through a batch endpoint concurrently, appending each response to the cache as it arrives
+    batches = [ids[start:start + batch_size] for start in range(0, len(ids), batch_size)]
+
+    async def fetch(batch):
+        body = await client.get(path, {'ids': ','.join(batch)})
+        items = body.get(field) or []
+        # The API answers null for ids it does not know; remember those so they are not asked again
+        return [to_record(item) if item else {'id': id, 'missing': True} for id, item in zip(batch, items)]
+
+    fetched = 0
+    tasks = [asyncio.ensure_future(fetch(batch)) for batch in batches]
+    try:
+        for result in asyncio.as_completed(tasks):
+            records = await result
+            _append_cache(cache_file, records)
+            fetched += len(records)
+    except BaseException:
+        # Stop the batches still running and collect their outcome, so their errors are not left unretrieved
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return fetched
+
+async def enrich_async(client, dataset_dir=DATASET_PATH, features=True):
+    """
+    Fetch metadata for every history track not in the cache yet, using an open SpotifyClient
+
+    Tracks come first (duration, album art, artist ids), then the artists
+    they reference (genres), then audio features. Each id is fetched once.
+
+    Returns:
+    dict: Number of newly fetched records per kind
+    """
+    os.makedirs(os.path.join(dataset_dir, METADATA_DIR), exist_ok=True)
+    fetched = dict.fromkeys(METADATA_KINDS, 0)
+    track_ids = history_track_ids(dataset_dir)
+
+    tracks = load_cache('tracks', dataset_dir)
+    missing = [id for id in track_ids if id not in tracks]
+    print(f"  - {len(track_ids)} distinct tracks, {len(missing)} not cached")
+    with stage('enrich:tracks', rows=len(missing)), open(_cache_path(dataset_dir, 'tracks'), 'a', encoding='utf-8') as file:
+        fetched['tracks'] = await _fetch_batches(client, '/tracks', 'tracks', missing, TRACK_BATCH, _track_record, file)
+
+    tracks = load_cache('tracks', dataset_dir)
+    artists = load_cache('artists', dataset_dir)
+    artist_ids = sorted({id for track in tracks.values() for id in track.get('artist_ids', [])} - set(artists))
+    with stage('enrich:artists', rows=len(artist_ids)), open(_cache_path(dataset_dir, 'artists'), 'a', encoding='utf-8') as file:
+        fetched['artists'] = await _fetch_batches(client, '/artists', 'artists', artist_ids, ARTIST_BATCH, _artist_record, file)
+
+    if features:
+        cached = load_cache('features', dataset_dir)
+        feature_ids = [id for id in track_ids if id not in cached and not tracks.get(id, {}).get('missing')]
+        try:
+            with stage('enrich:features', rows=len(feature_ids)), open(_cache_path(dataset_dir, 'features'), 'a', encoding='utf-8') as file:
+                fetched['features'] = await _fetch_batches(client, '/audio-features', 'audio_features', feature_ids,
+                                                           FEATURES_BATCH, _features_record, file)
+        except SpotifyAPIError as error:
+            # Apps registered after late 2024 are refused audio features; the rest of the metadata is still useful
+            if error.status not in (403, 404):
+                raise
+            print(f"  ! audio features unavailable ({error.status}), skipped")
+
+    return fetched
+
+def enrich(dataset_dir=DATASET_PATH, concurrency=DEFAULT_CONCURRENCY, base_url=API_BASE_URL, token_url=TOKEN_URL, features=True):
+    """
+    Resolve the history's track URIs into durations, album art, genres and audio features
+
+    Parameters:
+    dataset_dir (str): Dataset written by load_clean_save_input.py
+    concurrency (int): Requests in flight at once
+    base_url (str): Web API base URL (point it at a mock server for testing)
+    token_url (str): Token endpoint URL
+    features (bool): Also fetch audio features
+
+    Returns:
+    dict: Number of newly fetched records per kind
+    """
+    async def run():
+        async with SpotifyClient(base_url=base_url, token_url=token_url, concurrency=concurrency) as client:
+            fetched = await enrich_async(client, dataset_dir, features)
+            print(f"  - {client.requests} requests, {client.throttled} rate limited")
+            return fetched
+
+    with stage('enrich', label="Enrichment"):
+        return asyncio.run(run())
+
+def load_track_metadata(dataset_dir=DATASET_PATH):
+    """
+    Cached metadata of the history's tracks, one row per track URI
+
+    Genres are the union of the track's artists' genres.
+
+    Returns:
+    pandas.DataFrame: Indexed by spotify_track_uri with duration_ms, popularity, explicit,
+        album_image, release_date, genres and the AUDIO_FEATURES that were fetched
+    """
+    tracks = [record for record in load_cache('tracks', dataset_dir).values() if not record.get('missing')]
+    if not tracks:
+        return pd.DataFrame(columns=['duration_ms', 'popularity', 'explicit', 'album_image', 'release_date', 'genres'],
+                            index=pd.Index([], name='spotify_track_uri'))
+    artists = load_cache('artists', dataset_dir)
+    features = load_cache('features', dataset_dir)
+
+    metadata = pd.DataFrame(tracks).set_index('id')
+    metadata['genres'] = [
+        sorted({genre for id in artist_ids for genre in artists.get(id, {}).get('genres', [])})
+        for artist_ids in metadata['artist_ids']
+    ]
+    found = [record for record in features.values() if not record.get('missing')]
+    if found:
+        metadata = metadata.join(pd.DataFrame(found).set_index('id')[AUDIO_FEATURES])
+
+    metadata.index = TRACK_URI_PREFIX + metadata.index
+    metadata.index.name = 'spotify_track_uri'
+    return metadata.drop(columns=['id', 'name', 'artist_ids', 'album_id'], errors='ignore')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch Spotify metadata for the tracks in the listening history")
+    parser.add_argument('--data', default=DATASET_PATH, help="dataset written by load_clean_save_input.py")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="requests in flight at once")
+    parser.add_argument('--base-url', default=API_BASE_URL, help="Web API base URL (e.g. a local mock server)")
+    parser.add_argument('--token-url', default=TOKEN_URL, help="token endpoint URL")
+    parser.add_argument('--no-features', action='store_true', help="skip audio features")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("Enriching track metadata...")
+    try:
+        fetched = enrich(args.data, args.concurrency, args.base_url, args.token_url, features=not args.no_features)
+    except SpotifyAPIError as error:
+        print(f"Enrichment stopped: {error}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Fetched {fetched['tracks']} tracks, {fetched['artists']} artists and {fetched['features']} audio features")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import threading
+import functools
+import contextlib
+import collections
+
+
+# Environment switches, so production runs can be traced and profiled without code changes
+TRACE_ENV = "SPOTWRAPPED_TRACE"  # write the trace to this path at exit
+TRACE_FORMAT_ENV = "SPOTWRAPPED_TRACE_FORMAT"  # 'chrome' (default) or 'json'
+PROFILE_ENV = "SPOTWRAPPED_PROFILE"  # comma-separated stage names to profile, '*' for all
+PROFILE_MODE_ENV = "SPOTWRAPPED_PROFILE_MODE"  # 'cprofile' (default) or 'sample'
+PROFILE_DIR_ENV = "SPOTWRAPPED_PROFILE_DIR"
+QUIET_ENV = "SPOTWRAPPED_QUIET"  # set to 1 to silence stage timing lines
+
+TRACE_VERSION = 1
+SAMPLE_INTERVAL = 0.005
+
+# Most recent stage events kept for the trace, so a long-running process (the
+# poller, a dashboard server) does not grow without bound; the per-stage
+# summary is kept as running totals and still counts the dropped ones
+MAX_EVENTS = 100_000
+
+
+def max_rss(children=False):
+    """
+    Peak resident set size in bytes of this process, or of its largest finished child
+
+    Returns:
+    int: ru_maxrss in bytes, or None where getrusage is unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    value = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return value if sys.platform == 'darwin' else value * 1024
+
+def current_rss():
+    """
+    Resident set size of this process in bytes
+
+    Read from /proc on Linux; elsewhere falls back to the ru_maxrss high-water mark.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return max_rss()
+
+class _StackSampler:
+    # Samples one thread's Python stack at a fixed interval into collapsed (flame graph) stacks
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path):
+        self._done.set()
+        self._thread.join()
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+class Tracer:
+    """
+    Structured record of pipeline stages
+
+    Each stage records its start, duration, RSS before/after and any counts
+    the code attaches (rows, bytes, files...). Stages nest; the trace can be
+    written as plain JSON or in the Chrome trace event format (open it in
+    chrome://tracing or Perfetto). Selected stages can be profiled with
+    cProfile or a stack sampler.
+
+    Usage:
+        with stage('preprocess', label='Preprocessing', rows=len(df)) as event:
+            ...
+            event['rows_out'] = len(df_clean)
+        get_tracer().write('trace.json')
+    """
+
+    def __init__(self, verbose=True, profile_stages=(), profile_mode='cprofile', profile_dir='profiles', max_events=MAX_EVENTS):
+        self.events = collections.deque(maxlen=max_events)
+        self.dropped = 0
+        self._totals = {}
+        self.verbose = verbose
+        self.profile_stages = set(profile_stages)
+        self.profile_mode = profile_mode
+        self.profile_dir = profile_dir
+        self._origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profile_counts = collections.Counter()
+
+    @classmethod
+    def from_environment(cls):
+        profile = os.environ.get(PROFILE_ENV, '')
+        return cls(
+            verbose=os.environ.get(QUIET_ENV, '') in ('', '0'),
+            profile_stages=[name.strip() for name in profile.split(',') if name.strip()],
+            profile_mode=os.environ.get(PROFILE_MODE_ENV, 'cprofile'),
+            profile_dir=os.environ.get(PROFILE_DIR_ENV, 'profiles'),
+        )
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _profiled(self, name):
+        # Only one profiler can run per thread, so stages nested in a profiled stage are covered by it
+        if getattr(self._local, 'profiling', False):
+            return False
+        return '*' in self.profile_stages or name in self.profile_stages
+
+    def _profile_path(self, name, extension):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        with self._lock:
+            self._profile_counts[name] += 1
+            count = self._profile_counts[name]
+        safe_name = ''.join(char if char.isalnum() or char in '-_' else '_' for char in name)
+        return os.path.join(self.profile_dir, f"{safe_name}-{count}.{extension}")
+
+    @contextlib.contextmanager
+    def stage(self, name, label=None, **fields):
+        """
+        Time a block as a named stage
+
+        Parameters:
+        name (str): Stage name in the trace
+        label (str): Prints '<label> completed in N seconds' when the stage ends (unless quiet)
+        fields: Counts known up front (rows, bytes, ...); more can be set on the yielded dict
+
+        Returns:
+        contextmanager: Yields the event dict
+        """
+        stack = self._stack()
+        event = {
+            'name': name,
+            'parent': stack[-1]['name'] if stack else None,
+            'depth': len(stack),
+            'thread': threading.get_ident(),
+            **fields,
+        }
+
+        profiler = sampler = None
+        if self._profiled(name):
+            self._local.profiling = True
+            if self.profile_mode == 'sample':
+                sampler = _StackSampler(threading.get_ident())
+                sampler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+
+        stack.append(event)
+        rss_before = current_rss()
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            duration = time.perf_counter() - start
+            rss_after = current_rss()
+            stack.pop()
+
+            if profiler is not None or sampler is not None:
+                self._local.profiling = False
+            if profiler is not None:
+                profiler.disable()
+                event['profile'] = self._profile_path(name, 'prof')
+                profiler.dump_stats(event['profile'])
+            if sampler is not None:
+                event['profile'] = self._profile_path(name, 'folded')
+                sampler.stop(event['profile'])
+
+            event['start'] = start - self._origin
+            event['duration'] = duration
+            event['rss_before'] = rss_before
+            event['rss_delta'] = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+            self._add(event)
+
+            if label:
+                self.log(f"{label} completed in {duration:.2f} seconds")
+
+    def _add(self, event):
+        with self._lock:
+            if len(self.events) == self.events.maxlen:
+                self.dropped += 1
+            self.events.append(event)
+            total = self._totals.setdefault(event['name'], {'calls': 0, 'seconds': 0.0, 'rows': 0, 'bytes': 0})
+            total['calls'] += 1
+            total['seconds'] += event['duration']
+            total['rows'] += event.get('rows') or 0
+            total['bytes'] += event.get('bytes') or 0
+
+    def log(self, message):
+        """
+        Print a progress message unless the tracer is quiet
+        """
+        if self.verbose:
+            print(message)
+
+    def record(self, name, duration, **fields):
+        """
+        Add a stage that was timed elsewhere (e.g. in a worker process), ending now
+        """
+        stack = self._stack()
+        event = {
+            'name': name,
+            'parent': stack[-1]['name'] if stack else None,
+            'depth': len(stack),
+            'thread': threading.get_ident(),
+            **fields,
+            'start': time.perf_counter() - self._origin - duration,
+            'duration': duration,
+            'rss_before': None,
+            'rss_delta': None,
+        }
+        self._add(event)
+        return event
+
+    def summary(self):
+        """
+        Total time, call count, rows and bytes per stage name, over every stage run so far
+        """
+        with self._lock:
+            return {name: dict(total) for name, total in self._totals.items()}
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        trace_events = []
+        for event in sorted(self.events, key=lambda item: item['start']):
+            args = {key: value for key, value in event.items() if key not in ('name', 'start', 'duration', 'thread', 'depth', 'parent')}
+            trace_events.append({
+                'name': event['name'],
+                'cat': event['name'].split(':')[0],
+                'ph': 'X',
+                'ts': event['start'] * 1e6,
+                'dur': event['duration'] * 1e6,
+                'pid': pid,
+                'tid': event['thread'],
+                'args': args,
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def to_json(self):
+        return {'version': TRACE_VERSION, 'events': list(self.events), 'dropped_events': self.dropped, 'summary': self.summary()}
+
+    def write(self, path, format='chrome'):
+        """
+        Write the trace as 'chrome' trace events or plain 'json' with a per-stage summary
+        """
+        document = self.to_chrome_trace() if format == 'chrome' else self.to_json()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(document, file, indent=1, default=str)
+        return path
+
+_tracer = Tracer.from_environment()
+
+def get_tracer():
+    return _tracer
+
+def configure(verbose=None, profile_stages=None, profile_mode=None, profile_dir=None):
+    """
+    Change the verbosity and profiling of the process-wide tracer
+    """
+    if verbose is not None:
+        _tracer.verbose = verbose
+    if profile_stages is not None:
+        _tracer.profile_stages = set(profile_stages)
+    if profile_mode is not None:
+        _tracer.profile_mode = profile_mode
+    if profile_dir is not None:
+        _tracer.profile_dir = profile_dir
+    return _tracer
+
+def stage(name, label=None, **fields):
+    return _tracer.stage(name, label=label, **fields)
+
+def record(name, duration, **fields):
+    return _tracer.record(name, duration, **fields)
+
+def log(message):
+    return _tracer.log(message)
+
+def instrumented(name=None, label=None):
+    """
+    Decorator running a function as a stage; the first argument's length is recorded as rows
+    """
+    def decorate(function):
+        stage_name = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            rows = len(args[0]) if args and hasattr(args[0], '__len__') else None
+            with _tracer.stage(stage_name, label=label, rows=rows):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+if os.environ.get(TRACE_ENV):
+    atexit.register(_tracer.write, os.environ[TRACE_ENV], os.environ.get(TRACE_FORMAT_ENV, 'chrome'))
@@ -1,76 +1,416 @@
+import io
 import time
 import os
 import pandas as pd
 import json
 import glob
+import shutil
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
+from data_store import (
+    DATASET_PATH, load_dataset, write_dataset, load_manifest, save_manifest, file_hash, part_name, part_paths, record_keys,
+    read_record_keys, StoredKeys, load_dimensions, save_dimensions, update_ts_index, remove_from_ts_index,
+)
+from instrumentation import stage, record, log
+from rollup import (
+    ROLLUP_DIR, ROLLUP_DIMENSIONS, compute_rollups, load_rollup, write_part_rollups, remove_part_rollups, backfill_rollups,
+)
+from column_store import update_mapped_columns
 
-def load_spotify_data(directory_path):
+# Streaming ingestion settings: bytes read from disk per refill and records per emitted chunk
+READ_BUFFER_SIZE = 1 << 20
+DEFAULT_CHUNK_SIZE = 100_000
+
+# Progress of the file being ingested: its finished chunks and the byte offset after the last one
+CHECKPOINT_DIR = "_ingest_checkpoint"
+CHECKPOINT_STATE_NAME = "state.json"
+
+# Records that fail parsing or validation, one JSON line each, and a per-file summary
+QUARANTINE_DIR = "_quarantine"
+QUARANTINE_REPORT_NAME = "report.json"
+# Longest raw text kept for a malformed fragment
+QUARANTINE_RAW_CHARS = 1000
+
+# Columns coerced to compact dtypes as each chunk is built
+INTEGER_COLUMNS = ['ms_played']
+BOOLEAN_COLUMNS = ['shuffle', 'skipped', 'offline', 'incognito_mode']
+
+
+def load_spotify_file(file_path):
+    """
+    Load a single Spotify JSON file into a typed DataFrame batch
+    
+    Records that fail validation are skipped and counted instead of failing
+    the load; a file that is not valid JSON is re-read incrementally, keeping
+    every record around the malformed fragments. Nothing is printed here, so
+    worker processes stay quiet; the caller reports the skipped records.
+    
+    Parameters:
+    file_path (str): Path to a Spotify JSON file
+    
+    Returns:
+    tuple: (file_path, pandas.DataFrame batch, elapsed seconds, number of skipped records)
+    """
+    start_time = time.time()
+    
+    skipped = []
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            records = json.load(file)
+        if not isinstance(records, list):
+            raise ValueError("not a JSON array")
+    except ValueError:
+        records = [record for record, _ in iter_json_records_at(file_path, on_error=lambda *error: skipped.append(error[1]))]
+    
+    objects = [record for record in records if isinstance(record, dict)]
+    skipped.extend(['not an object'] * (len(records) - len(objects)))
+    batch = records_to_frame(objects, skipped)
+    
+    return file_path, batch, time.time() - start_time, len(skipped)
+
+def load_spotify_data(directory_path, workers=None):
     """
     Load all Spotify JSON files from a directory into a single pandas DataFrame
     
+    Files are parsed in parallel by a process pool; each worker returns a
+    columnar batch and the batches are concatenated once in file-name order.
+    
     Parameters:
     directory_path (str): Path to the directory containing Spotify JSON files
+    workers (int): Number of worker processes (default: one per CPU, 1 disables the pool)
     
     Returns:
     pandas.DataFrame: Combined DataFrame of all streaming history
     """
     print("Starting to load Spotify data files...")
     
-    # Get all JSON files in the directory
-    json_files = glob.glob(os.path.join(directory_path, "*.json"))
+    # Get all JSON files in the directory, sorted so row order is deterministic
+    json_files = sorted(glob.glob(os.path.join(directory_path, "*.json")))
     
     print(f"Found {len(json_files)} JSON files")
     
-    # Initialize an empty list to store data
-    all_data = []
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(json_files)))
     
-    # Process each JSON file
-    for i, file_path in enumerate(json_files):
-        print(f"Processing file {i+1}/{len(json_files)}: {os.path.basename(file_path)}")
-        start_time = time.time()
+    with stage('load', label="Loading", files=len(json_files), workers=workers) as event:
+        if workers == 1:
+            results = map(load_spotify_file, json_files)
+        else:
+            print(f"Parsing with {workers} worker processes")
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(load_spotify_file, json_files)
         
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            file_records = len(data)
-            all_data.extend(data)  # Combine all data from each file
+        # map() yields in submission order, so batches stay in file order;
+        # per-file timings go to the trace instead of the console
+        batches = []
+        try:
+            for file_path, batch, elapsed_time, skipped in results:
+                record('load_file', elapsed_time, file=os.path.basename(file_path), rows=len(batch), bytes=os.path.getsize(file_path),
+                       skipped=skipped)
+                if skipped:
+                    log(f"  ! Skipped {skipped} bad records in {os.path.basename(file_path)}")
+                batches.append(batch)
+        finally:
+            if workers > 1:
+                executor.shutdown()
         
-        elapsed_time = time.time() - start_time
-        print(f"  - Loaded {file_records} records in {elapsed_time:.2f} seconds")
-    
-    total_records = len(all_data)
-    print(f"Completed loading {total_records} records in total")
+        event['bytes'] = sum(os.path.getsize(file_path) for file_path in json_files)
+        if not batches:
+            event['rows'] = 0
+            return pd.DataFrame()
+        
+        # Concatenate all batches once
+        with stage('load:concat'):
+            df = pd.concat(batches, ignore_index=True)
+        event['rows'] = len(df)
     
-    # Convert to DataFrame
-    print("Converting to DataFrame...")
-    df = pd.DataFrame(all_data)
+    print(f"Completed loading {len(df)} records in total")
     print(f"DataFrame created with shape: {df.shape}")
     
     return df
 
-def preprocess_data(df):
+def _skip_whitespace(buffer, pos):
+    while pos < len(buffer) and buffer[pos].isspace():
+        pos += 1
+    return pos
+
+def iter_json_records_at(file_path, start=0, buffer_size=READ_BUFFER_SIZE, on_error=None):
+    """
+    Incrementally parse a JSON array file from a byte offset, yielding each
+    record with the byte offset just past it
+    
+    An offset yielded here can be passed back as start to continue after
+    that record, so an interrupted parse resumes without re-reading the file.
+    
+    Without on_error, malformed JSON raises ValueError. With it, the parser
+    reports each malformed fragment, skips ahead to the next record and keeps
+    going; a file cut off mid-array keeps the records before the cut.
+    
+    Parameters:
+    file_path (str): Path to a Spotify JSON file containing a top-level array
+    start (int): Byte offset to resume at (0, or an offset yielded by an earlier parse)
+    buffer_size (int): Number of characters read from disk per refill
+    on_error (callable): Called as on_error(offset, reason, detail, raw) for each malformed fragment
+    
+    Returns:
+    generator: Yields (record, end offset) in file order
+    """
+    decoder = json.JSONDecoder()
+    
+    def fail(offset, reason, detail, raw=''):
+        if on_error is None:
+            raise ValueError(f"{file_path}: {detail}")
+        on_error(offset, reason, detail, raw[:QUARANTINE_RAW_CHARS])
+    
+    with open(file_path, 'rb') as raw_file:
+        raw_file.seek(start)
+        # No newline translation, so characters map back to byte offsets
+        file = io.TextIOWrapper(raw_file, encoding='utf-8', newline='')
+        buffer = ''
+        pos = 0
+        eof = False
+        # Byte offset of buffer[mark], advanced as offsets are asked for so each character is encoded once
+        mark, mark_bytes = 0, start
+        
+        def offset(position):
+            nonlocal mark, mark_bytes
+            segment = buffer[mark:position]
+            mark_bytes += len(segment) if segment.isascii() else len(segment.encode('utf-8'))
+            mark = position
+            return mark_bytes
+        
+        def fill(buffer, pos):
+            # Drop the consumed prefix and append the next block from disk
+            nonlocal mark
+            offset(pos)
+            mark = 0
+            data = file.read(buffer_size)
+            return buffer[pos:] + data, 0, not data
+        
+        if start == 0:
+            # Find the opening bracket of the top-level array
+            while True:
+                pos = _skip_whitespace(buffer, pos)
+                if pos < len(buffer) or eof:
+                    break
+                buffer, pos, eof = fill(buffer, pos)
+            if pos >= len(buffer) or buffer[pos] != '[':
+                fail(offset(pos), 'not a JSON array', "does not contain a JSON array", buffer[pos:])
+                return
+            pos += 1
+            expect_value = True
+        else:
+            # A resume offset points just past a record
+            expect_value = False
+        
+        while True:
+            pos = _skip_whitespace(buffer, pos)
+            if pos >= len(buffer):
+                if eof:
+                    fail(offset(pos), 'truncated file', "ended before the JSON array was closed")
+                    return
+                buffer, pos, eof = fill(buffer, pos)
+                continue
+            
+            char = buffer[pos]
+            if char == ']':
+                return
+            if not expect_value:
+                if char == ',':
+                    pos += 1
+                else:
+                    # Carry on as if the separator were there; the next value is checked anyway
+                    fail(offset(pos), 'missing separator', f"expected ',' at offset {mark_bytes}", buffer[pos:pos + 80])
+                expect_value = True
+                continue
+            
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as error:
+                if not eof and len(buffer) - pos < buffer_size:
+                    # The record may just be cut off at the buffer edge, read more and retry
+                    buffer, pos, eof = fill(buffer, pos)
+                    continue
+                if on_error is None:
+                    raise
+                # Skip to the next object; records are flat, so any '{' starts one
+                following = buffer.find('{', pos + 1)
+                while following == -1 and not eof:
+                    buffer, pos, eof = fill(buffer, pos)
+                    following = buffer.find('{', pos + 1)
+                if following == -1:
+                    fail(offset(pos), 'truncated file', f"invalid JSON at the end of the file: {error.msg}", buffer[pos:])
+                    return
+                fail(offset(pos), 'invalid JSON', error.msg, buffer[pos:following])
+                pos = following
+                continue
+            if end == len(buffer) and not eof:
+                # A scalar may have been cut off at the buffer edge, re-read it
+                buffer, pos, eof = fill(buffer, pos)
+                continue
+            
+            if isinstance(record, dict):
+                yield record, offset(end)
+            else:
+                fail(offset(pos), 'not an object', "array element is not an object", json.dumps(record))
+            pos = end
+            expect_value = False
+
+def invalid_records(df, ts=None):
+    """
+    Reason each record of a raw batch fails validation, None for valid ones
+    
+    Checked column-wise over the batch: ts must parse as a timestamp,
+    ms_played must be a non-negative whole number and the boolean flags
+    true, false or missing.
+    
+    Parameters:
+    df (pandas.DataFrame): Raw records as built by pandas.DataFrame.from_records
+    ts (pandas.Series): df['ts'] already parsed with errors='coerce', so it is not parsed twice
+    
+    Returns:
+    numpy.ndarray: object array with one reason (or None) per row
+    """
+    reasons = np.full(len(df), None, dtype=object)
+    
+    def flag(bad, reason):
+        bad = np.asarray(bad, dtype=bool)
+        # The first problem found is the one reported
+        reasons[bad & pd.isna(reasons)] = reason
+    
+    if 'ts' not in df.columns:
+        flag(np.ones(len(df), dtype=bool), 'missing ts')
+    else:
+        flag(df['ts'].isna(), 'missing ts')
+        if ts is None:
+            ts = pd.to_datetime(df['ts'], errors='coerce')
+        flag(df['ts'].notna() & ts.isna(), 'invalid ts')
+    for column in INTEGER_COLUMNS:
+        if column not in df.columns:
+            flag(np.ones(len(df), dtype=bool), f'missing {column}')
+            continue
+        values = pd.to_numeric(df[column], errors='coerce')
+        flag(df[column].isna(), f'missing {column}')
+        flag(df[column].notna() & ~((values >= 0) & (values % 1 == 0)).fillna(False), f'invalid {column}')
+    for column in BOOLEAN_COLUMNS:
+        if column in df.columns:
+            flag(~(df[column].isna() | df[column].isin([True, False])), f'invalid {column}')
+    return reasons
+
+def records_to_frame(records, rejected=None):
+    """
+    Convert a batch of raw records into a typed, columnar DataFrame
+    
+    Parameters:
+    records (list): List of record dicts from a Spotify export
+    rejected (list): When given, records that fail validation (see invalid_records)
+        are dropped and appended to it as (position in records, reason) instead of
+        failing the whole batch
+    
+    Returns:
+    pandas.DataFrame: Batch with parsed timestamps and compact numeric/boolean columns
+    """
+    df = pd.DataFrame.from_records(records)
+    validate = rejected is not None and len(df) > 0
+    
+    if 'ts' in df.columns:
+        ts = pd.to_datetime(df['ts'], errors='coerce' if validate else 'raise')
+    if validate:
+        reasons = invalid_records(df, ts if 'ts' in df.columns else None)
+        bad = np.flatnonzero(pd.notna(reasons))
+        if len(bad):
+            rejected.extend(zip(bad.tolist(), reasons[bad].tolist()))
+            keep = np.ones(len(df), dtype=bool)
+            keep[bad] = False
+            df = df[keep].reset_index(drop=True)
+            ts = ts[keep].reset_index(drop=True)
+    
+    if 'ts' in df.columns:
+        df['ts'] = ts
+    for column in INTEGER_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('int64')
+    for column in BOOLEAN_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('boolean')
+    
+    return df
+
+def iter_file_chunks_at(file_path, chunk_size=DEFAULT_CHUNK_SIZE, start=0, quarantine=None):
+    """
+    Stream one export file as validated DataFrame chunks, starting at a byte offset
+    
+    Malformed fragments and records failing validation are passed to
+    quarantine instead of stopping the stream.
+    
+    Parameters:
+    file_path (str): Path to a Spotify JSON file
+    chunk_size (int): Maximum number of records per emitted chunk
+    start (int): Byte offset to resume at (0, or an offset yielded earlier)
+    quarantine (callable): Called with a dict (offset, reason, detail and the record or raw text) per bad record
+    
+    Returns:
+    generator: Yields (pandas.DataFrame chunk, byte offset after its last record)
+    """
+    quarantine = quarantine or (lambda entry: None)
+    
+    def on_error(offset, reason, detail, raw):
+        quarantine({'offset': offset, 'reason': reason, 'detail': detail, 'raw': raw})
+    
+    def to_frame(batch, offsets):
+        rejected = []
+        frame = records_to_frame(batch, rejected)
+        for position, reason in rejected:
+            quarantine({'offset': offsets[position], 'reason': reason, 'record': batch[position]})
+        return frame
+    
+    batch, offsets = [], []
+    offset = start
+    for record, end in iter_json_records_at(file_path, start, on_error=on_error):
+        batch.append(record)
+        offsets.append(offset)
+        offset = end
+        if len(batch) >= chunk_size:
+            yield to_frame(batch, offsets), offset
+            batch, offsets = [], []
+    
+    if batch:
+        yield to_frame(batch, offsets), offset
+
+def preprocess_data(df, lean=False):
     """
     Clean and preprocess the Spotify data
     
     Parameters:
     df (pandas.DataFrame): Raw Spotify data
+    lean (bool): Use the memory-lean path, which modifies df in place (see _preprocess_data_lean)
     
     Returns:
     pandas.DataFrame: Preprocessed data
     """
-    print("\nStarting data preprocessing...")
-    start_time = time.time()
+    log("\nStarting data preprocessing...")
     
+    with stage('preprocess', label="Preprocessing", rows=len(df), lean=lean):
+        if lean:
+            return _preprocess_data_lean(df)
+        return _preprocess_data_copy(df)
+
+def _preprocess_data_copy(df):
+    """
+    Original preprocessing: works on a copy and leaves df untouched
+    """
     # Make a copy to avoid modifying the original
-    print("  - Creating working copy of DataFrame")
+    log("  - Creating working copy of DataFrame")
     df_clean = df.copy()
     
     # Convert timestamp to datetime
-    print("  - Converting timestamps to datetime")
+    log("  - Converting timestamps to datetime")
     df_clean['ts'] = pd.to_datetime(df_clean['ts'])
     
     # Extract date and time components
-    print("  - Extracting date and time components")
+    log("  - Extracting date and time components")
     df_clean['date'] = df_clean['ts'].dt.date
     df_clean['year'] = df_clean['ts'].dt.year
     df_clean['month'] = df_clean['ts'].dt.month
@@ -79,17 +419,17 @@ def preprocess_data(df):
     df_clean['day_of_week'] = df_clean['ts'].dt.dayofweek  # 0 = Monday, 6 = Sunday
     
     # Convert ms_played to minutes for easier interpretation
-    print("  - Converting milliseconds to minutes")
+    log("  - Converting milliseconds to minutes")
     df_clean['minutes_played'] = df_clean['ms_played'] / 60000
     
     # Identify songs vs. podcasts vs. audiobooks
-    print("  - Identifying content types")
+    log("  - Identifying content types")
     df_clean['content_type'] = 'song'
     df_clean.loc[~df_clean['episode_name'].isna(), 'content_type'] = 'podcast'
     df_clean.loc[~df_clean['audiobook_title'].isna(), 'content_type'] = 'audiobook'
     
     # Combine metadata for easier analysis
-    print("  - Normalizing track, artist, and album names")
+    log("  - Normalizing track, artist, and album names")
     df_clean['track_name'] = df_clean['master_metadata_track_name']
     df_clean['artist_name'] = df_clean['master_metadata_album_artist_name']
     df_clean['album_name'] = df_clean['master_metadata_album_album_name']
@@ -104,17 +444,440 @@ def preprocess_data(df):
     df_clean.loc[audiobook_mask, 'track_name'] = df_clean.loc[audiobook_mask, 'audiobook_chapter_title']
     df_clean.loc[audiobook_mask, 'album_name'] = df_clean.loc[audiobook_mask, 'audiobook_title']
     
-    elapsed_time = time.time() - start_time
-    print(f"Preprocessing completed in {elapsed_time:.2f} seconds")
-    
     return df_clean
 
+def _categorical_or_empty(df, column):
+    if column in df.columns:
+        return df[column].astype('category')
+    return pd.Series(pd.Categorical.from_codes(np.full(len(df), -1, dtype='int8'), categories=[]), index=df.index)
+
+def _select_categorical(conditions, sources):
+    """
+    Vectorized select over categorical columns, working on their integer codes
+    
+    The first source whose condition is true wins; the last source is the default.
+    """
+    categories = sources[0].cat.categories
+    for source in sources[1:]:
+        categories = categories.union(source.cat.categories)
+    codes = [source.cat.set_categories(categories).cat.codes.to_numpy() for source in sources]
+    selected = np.select(conditions, codes[:-1], default=codes[-1])
+    return pd.Categorical.from_codes(selected, categories=categories)
+
+def _preprocess_data_lean(df):
+    """
+    Memory-lean preprocessing: same columns as preprocess_data, smaller dtypes
+    
+    Skips the defensive copy (df is modified and returned), stores date as
+    datetime64 instead of Python date objects, uses int8/int16 date parts and
+    builds the normalized names with one vectorized select into categoricals.
+    """
+    log("  - Converting timestamps to datetime (in place)")
+    with stage('preprocess:timestamps'):
+        df['ts'] = pd.to_datetime(df['ts'])
+        ts = df['ts'].dt
+    
+    log("  - Extracting compact date and time components")
+    with stage('preprocess:date_parts'):
+        df['date'] = ts.normalize()
+        df['year'] = ts.year.astype('int16')
+        df['month'] = ts.month.astype('int8')
+        df['day'] = ts.day.astype('int8')
+        df['hour'] = ts.hour.astype('int8')
+        df['day_of_week'] = ts.dayofweek.astype('int8')  # 0 = Monday, 6 = Sunday
+    
+    log("  - Converting milliseconds to minutes")
+    df['minutes_played'] = df['ms_played'] / 60000
+    
+    log("  - Identifying content types")
+    with stage('preprocess:content_types'):
+        is_audiobook = df['audiobook_title'].notna().to_numpy() if 'audiobook_title' in df.columns else np.zeros(len(df), dtype=bool)
+        is_podcast = df['episode_name'].notna().to_numpy() & ~is_audiobook if 'episode_name' in df.columns else np.zeros(len(df), dtype=bool)
+        content_codes = np.where(is_audiobook, 2, np.where(is_podcast, 1, 0)).astype('int8')
+        df['content_type'] = pd.Categorical.from_codes(content_codes, categories=['song', 'podcast', 'audiobook'])
+    
+    # One select per name column: audiobook, then podcast, otherwise the music metadata
+    log("  - Normalizing track, artist, and album names")
+    with stage('preprocess:names'):
+        conditions = [is_audiobook, is_podcast]
+        names = {
+            'track_name': ('master_metadata_track_name', 'audiobook_chapter_title', 'episode_name'),
+            'artist_name': ('master_metadata_album_artist_name', 'master_metadata_album_artist_name', 'episode_show_name'),
+            'album_name': ('master_metadata_album_album_name', 'audiobook_title', 'master_metadata_album_album_name'),
+        }
+        for name, (music, audiobook, podcast) in names.items():
+            sources = [_categorical_or_empty(df, column) for column in (audiobook, podcast, music)]
+            df[name] = _select_categorical(conditions, sources)
+        
+        for column in ['platform', 'conn_country']:
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+    
+    return df
+
+
+def _first_present(df, columns):
+    # First non-null value across columns, row by row
+    result = pd.Series(None, index=df.index, dtype=object)
+    for column in columns:
+        if column in df.columns:
+            result = result.fillna(df[column].astype(object))
+    return result
+
+def _assign_ids(dimension, id_column, key_column, keys, attributes=None):
+    """
+    Look up (and append) integer ids for keys in a dimension table
+    
+    Returns the updated dimension table and an int32 id per key (-1 for missing keys).
+    """
+    known = pd.Index(dimension[key_column])
+    present = keys.notna()
+    first_rows = ~keys.duplicated() & present & ~keys.isin(known)
+    
+    if first_rows.any():
+        new = pd.DataFrame({key_column: keys[first_rows].to_numpy()})
+        for column, values in (attributes or {}).items():
+            new[column] = values[first_rows].to_numpy()
+        new.insert(0, id_column, np.arange(len(dimension), len(dimension) + len(new), dtype='int32'))
+        dimension = pd.concat([dimension, new], ignore_index=True) if len(dimension) else new
+        known = pd.Index(dimension[key_column])
+    
+    ids = known.get_indexer(keys).astype('int32')
+    return dimension, ids
+
+def assign_dimension_ids(df_clean, dims):
+    """
+    Add int32 track_id, artist_id and album_id columns, growing the dimension tables
+    
+    Tracks are keyed by their Spotify URI (track, episode or audiobook chapter);
+    plays without a URI fall back to their artist and track name. Artists and
+    albums are keyed by name.
+    
+    Parameters:
+    df_clean (pandas.DataFrame): Preprocessed Spotify data, modified in place
+    dims (dict): Dimension tables from data_store.load_dimensions
+    
+    Returns:
+    dict: Updated dimension tables
+    """
+    artist_names = df_clean['artist_name'].astype(object)
+    album_names = df_clean['album_name'].astype(object)
+    track_names = df_clean['track_name'].astype(object)
+    
+    dims['artists'], artist_ids = _assign_ids(dims['artists'], 'artist_id', 'artist_name', artist_names)
+    dims['albums'], album_ids = _assign_ids(dims['albums'], 'album_id', 'album_name', album_names)
+    
+    track_keys = _first_present(df_clean, ['spotify_track_uri', 'spotify_episode_uri', 'audiobook_chapter_uri'])
+    local_keys = 'local:' + artist_names.fillna('') + ':' + track_names
+    track_keys = track_keys.fillna(local_keys)
+    
+    dims['tracks'], track_ids = _assign_ids(dims['tracks'], 'track_id', 'track_key', track_keys, {
+        'track_name': track_names,
+        'artist_id': pd.Series(artist_ids, index=df_clean.index),
+        'album_id': pd.Series(album_ids, index=df_clean.index),
+        'content_type': df_clean['content_type'].astype(object),
+    })
+    
+    df_clean['track_id'] = track_ids
+    df_clean['artist_id'] = artist_ids
+    df_clean['album_id'] = album_ids
+    return dims
+
+def find_changed_files(directory_path, manifest):
+    """
+    Compare export files on disk against the ingest manifest
+    
+    Files whose size and mtime match the manifest are skipped without being
+    read. Otherwise the content hash decides whether the file really changed.
+    
+    Parameters:
+    directory_path (str): Path to the directory containing Spotify JSON files
+    manifest (dict): Manifest loaded with data_store.load_manifest
+    
+    Returns:
+    list: (file_path, stat, content hash) for every new or modified file
+    """
+    changed = []
+    
+    for file_path in sorted(glob.glob(os.path.join(directory_path, "*.json"))):
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        entry = manifest['files'].get(file_path)
+        
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            continue
+        
+        content_hash = file_hash(file_path)
+        if entry and entry['sha256'] == content_hash:
+            # Touched but not modified, just refresh the stored mtime
+            entry['mtime'] = stat.st_mtime_ns
+            continue
+        
+        changed.append((file_path, stat, content_hash))
+    
+    return changed
+
+def load_checkpoint(dataset_dir=DATASET_PATH):
+    """
+    Progress saved by an ingest that stopped partway through a file, or None
+    """
+    path = os.path.join(dataset_dir, CHECKPOINT_DIR, CHECKPOINT_STATE_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_checkpoint(state, dataset_dir=DATASET_PATH):
+    path = os.path.join(dataset_dir, CHECKPOINT_DIR, CHECKPOINT_STATE_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+def clear_checkpoint(dataset_dir=DATASET_PATH):
+    shutil.rmtree(os.path.join(dataset_dir, CHECKPOINT_DIR), ignore_errors=True)
+
+def update_quarantine_report(file_path, quarantined, reasons, quarantine_name, dataset_dir=DATASET_PATH):
+    """
+    Record how many records of a source file were quarantined and why
+    
+    The report maps each source file with bad records to its count, the
+    count per reason and the file holding the records themselves.
+    """
+    directory = os.path.join(dataset_dir, QUARANTINE_DIR)
+    path = os.path.join(directory, QUARANTINE_REPORT_NAME)
+    report = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            report = json.load(file)
+    
+    if quarantined:
+        report[file_path] = {'quarantined': quarantined, 'reasons': reasons, 'records': quarantine_name}
+    elif report.pop(file_path, None) is None:
+        return
+    
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+
+def _ingest_file(file_path, stat, content_hash, dataset_dir, chunk_size, seen_keys, dims):
+    """
+    Ingest one export file into its part, checkpointing after every chunk
+    
+    Each preprocessed chunk is written to the checkpoint directory together
+    with the byte offset it ended at, so a run that stops resumes this file
+    at that offset. Once the whole file is read its chunks are combined into
+    the part. Bad records go to the file's quarantine instead of stopping the run.
+    
+    Returns:
+    tuple: (manifest entry, updated seen keys, updated dimension tables)
+    """
+    part = part_name(file_path)
+    checkpoint_dir = os.path.join(dataset_dir, CHECKPOINT_DIR)
+    quarantine_name = os.path.join(QUARANTINE_DIR, os.path.splitext(part)[0] + ".jsonl")
+    quarantine_path = os.path.join(dataset_dir, quarantine_name)
+    
+    state = load_checkpoint(dataset_dir)
+    if state and state['file'] == file_path and state['sha256'] == content_hash:
+        # Chunks past the saved state were written by a run that stopped before recording them
+        for path in part_paths(checkpoint_dir)[state['chunks']:]:
+            os.remove(path)
+        seen_keys.add(read_record_keys(checkpoint_dir))
+        print(f"  - Resuming after {state['records']} records at byte {state['offset']}")
+    else:
+        clear_checkpoint(dataset_dir)
+        state = {
+            'file': file_path,
+            'sha256': content_hash,
+            'offset': 0,
+            'chunks': 0,
+            'records': 0,
+            'rows': 0,
+            'ts_min': None,
+            'ts_max': None,
+            'quarantined': 0,
+            'reasons': {},
+            'quarantine_bytes': 0,
+        }
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(quarantine_path), exist_ok=True)
+    
+    with open(quarantine_path, 'ab') as quarantine_file:
+        # Records quarantined after the last checkpoint are found again when the file is re-read from it
+        quarantine_file.truncate(state['quarantine_bytes'])
+        
+        def quarantine(item):
+            line = json.dumps({'file': file_path, **item}, ensure_ascii=False, default=str) + '\n'
+            quarantine_file.write(line.encode('utf-8'))
+            state['quarantined'] += 1
+            state['reasons'][item['reason']] = state['reasons'].get(item['reason'], 0) + 1
+        
+        for chunk, offset in iter_file_chunks_at(file_path, chunk_size, state['offset'], quarantine):
+            if len(chunk):
+                df_clean = preprocess_data(chunk, lean=True)
+                
+                state['records'] += len(df_clean)
+                ts_min, ts_max = df_clean['ts'].min().isoformat(), df_clean['ts'].max().isoformat()
+                state['ts_min'] = min(state['ts_min'] or ts_min, ts_min)
+                state['ts_max'] = max(state['ts_max'] or ts_max, ts_max)
+                
+                # Remove duplicates within the chunk and against the stored plays of its time span
+                with stage('ingest:read_keys') as event:
+                    event['rows'] = seen_keys.cover(df_clean['ts'].min(), df_clean['ts'].max() + pd.Timedelta(milliseconds=1))
+                keys = record_keys(df_clean)
+                fresh = ~pd.Series(keys).duplicated().to_numpy() & ~seen_keys.isin(keys)
+                seen_keys.add(keys[fresh])
+                
+                # Rows go out in time order so each row group covers a narrow ts range
+                df_clean = df_clean[fresh].sort_values('ts', kind='stable', ignore_index=True)
+                dims = assign_dimension_ids(df_clean, dims)
+                state['rows'] += len(df_clean)
+                
+                chunk = f"chunk-{state['chunks']:05d}.parquet"
+                chunk_path = os.path.join(checkpoint_dir, chunk)
+                write_dataset([df_clean], chunk_path + ".tmp")
+                os.replace(chunk_path + ".tmp", chunk_path)
+                write_part_rollups(compute_rollups(df_clean), chunk, checkpoint_dir)
+                save_dimensions(dims, dataset_dir)
+                state['chunks'] += 1
+            
+            state['offset'] = offset
+            quarantine_file.flush()
+            state['quarantine_bytes'] = quarantine_file.tell()
+            save_checkpoint(state, dataset_dir)
+    
+    if not state['quarantined']:
+        os.remove(quarantine_path)
+        if not os.listdir(os.path.dirname(quarantine_path)):
+            os.rmdir(os.path.dirname(quarantine_path))
+    update_quarantine_report(file_path, state['quarantined'], state['reasons'], quarantine_name, dataset_dir)
+    
+    entry = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime_ns,
+        'sha256': content_hash,
+        'part': None,
+        'records': state['records'],
+        'rows': state['rows'],
+        'ts_min': state['ts_min'],
+        'ts_max': state['ts_max'],
+        'quarantined': state['quarantined'],
+        'quarantine': quarantine_name if state['quarantined'] else None,
+    }
+    if state['records']:
+        # A single chunk already is the part; several are combined in order
+        chunk_paths = part_paths(checkpoint_dir)
+        part_path = os.path.join(dataset_dir, part)
+        if len(chunk_paths) == 1:
+            os.replace(chunk_paths[0], part_path)
+        else:
+            write_dataset((load_dataset(path) for path in chunk_paths), part_path + ".tmp")
+            os.replace(part_path + ".tmp", part_path)
+        entry['part'] = part
+        if len(chunk_paths) == 1:
+            chunk = os.path.basename(chunk_paths[0])
+            for dimension in ROLLUP_DIMENSIONS:
+                os.makedirs(os.path.join(dataset_dir, ROLLUP_DIR, dimension), exist_ok=True)
+                os.replace(os.path.join(checkpoint_dir, ROLLUP_DIR, dimension, chunk), os.path.join(dataset_dir, ROLLUP_DIR, dimension, part))
+        else:
+            write_part_rollups({dimension: load_rollup(dimension, checkpoint_dir) for dimension in ROLLUP_DIMENSIONS}, part, dataset_dir)
+        update_ts_index(dataset_dir)
+    
+    return entry, seen_keys, dims
 
-# Load data
-path = "/Users/student/Projects/Portfolio/SpotWrapped/SpotifyExtendedStreamingHistory"
-df = load_spotify_data(path)
+def ingest_directory(directory_path, dataset_dir=DATASET_PATH, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Incrementally ingest new or modified export files into the stored dataset
+    
+    Each source file is preprocessed in chunks and written to its own Parquet
+    part. Records already present in the dataset (overlapping exports) are
+    dropped. A modified file replaces the part it produced previously.
+    The hourly rollup cube and the timestamp index are updated alongside
+    each part they describe; the memory-mapped columns are rebuilt at the end.
+    
+    Progress is saved after every file (the manifest) and every chunk (the
+    checkpoint), so an interrupted run picks up where it stopped. Malformed
+    or invalid records are quarantined with a report instead of stopping it.
+    
+    Parameters:
+    directory_path (str): Path to the directory containing Spotify JSON files
+    dataset_dir (str): Dataset directory holding the Parquet parts and manifest
+    chunk_size (int): Maximum number of records preprocessed at once
+    
+    Returns:
+    int: Number of new rows appended
+    """
+    with stage('ingest', label="Ingest") as event:
+        event['rows'] = _ingest_directory(directory_path, dataset_dir, chunk_size)
+    return event['rows']
 
-# Preprocess data
-df_clean = preprocess_data(df)
+def _ingest_directory(directory_path, dataset_dir, chunk_size):
+    print("Checking for new or modified export files...")
+    
+    manifest = load_manifest(dataset_dir)
+    changed = find_changed_files(directory_path, manifest)
+    
+    if not changed:
+        # A checkpoint left behind belongs to a file that has been ingested or removed since
+        clear_checkpoint(dataset_dir)
+        save_manifest(manifest, dataset_dir)
+        backfill_rollups(dataset_dir)
+        update_mapped_columns(dataset_dir)
+        print("Dataset is up to date")
+        return 0
+    
+    print(f"Found {len(changed)} new or modified files")
+    os.makedirs(dataset_dir, exist_ok=True)
+    
+    # Drop parts produced by earlier versions of modified files before reading existing keys
+    for file_path, _, _ in changed:
+        entry = manifest['files'].pop(file_path, None)
+        if entry and entry.get('part'):
+            stale_part = os.path.join(dataset_dir, entry['part'])
+            if os.path.exists(stale_part):
+                os.remove(stale_part)
+            remove_part_rollups(entry['part'], dataset_dir)
+            remove_from_ts_index(entry['part'], dataset_dir)
+    save_manifest(manifest, dataset_dir)
+    
+    # Keys of stored plays are read as the chunks reach their time span
+    seen_keys = StoredKeys(dataset_dir)
+    dims = load_dimensions(dataset_dir)
+    total_rows = 0
+    quarantined = 0
+    
+    for file_path, stat, content_hash in changed:
+        print(f"Ingesting {os.path.basename(file_path)}")
+        with stage('ingest_file', file=os.path.basename(file_path), bytes=stat.st_size) as event:
+            entry, seen_keys, dims = _ingest_file(file_path, stat, content_hash, dataset_dir, chunk_size, seen_keys, dims)
+            event['rows'] = entry['rows']
+            event['records'] = entry['records']
+            event['quarantined'] = entry['quarantined']
+        manifest['files'][file_path] = entry
+        save_manifest(manifest, dataset_dir)
+        # The file is complete in the manifest, its checkpoint is no longer needed
+        clear_checkpoint(dataset_dir)
+        
+        print(f"  - Appended {entry['rows']} new rows ({entry['records'] - entry['rows']} duplicates dropped)")
+        if entry['quarantined']:
+            print(f"  ! {entry['quarantined']} bad records quarantined to {os.path.join(dataset_dir, entry['quarantine'])}")
+        total_rows += entry['rows']
+        quarantined += entry['quarantined']
+    
+    # Parts ingested before the rollup cube existed get their slices here
+    with stage('ingest:backfill_rollups'):
+        backfill_rollups(dataset_dir)
+    # Later plays are appended to the memory-mapped columns; anything else rewrites them in global ts order
+    with stage('ingest:mapped_columns') as event:
+        event['rows'] = update_mapped_columns(dataset_dir)
+    print(f"Ingested {total_rows} new rows")
+    if quarantined:
+        print(f"Quarantined {quarantined} bad records, see {os.path.join(dataset_dir, QUARANTINE_DIR, QUARANTINE_REPORT_NAME)}")
+    return total_rows
+
+if __name__ == "__main__":
+    path = "/Users/student/Projects/Portfolio/SpotWrapped/SpotifyExtendedStreamingHistory"
+    
+    # Only new or modified export files are read; each is streamed in bounded chunks
+    ingest_directory(path, DATASET_PATH)
 
-df_clean.to_csv("spotify_data_combined.csv", index=False)
@@ -0,0 +1,253 @@
+import os
+import sys
+import json
+import asyncio
+import argparse
+import pandas as pd
+
+from data_store import DATASET_PATH
+from spotify_api import API_BASE_URL, TOKEN_URL, UserClient, SpotifyAPIError
+
+
+# Polled plays are kept as export-format JSON files, one per month, so they go
+# through the same incremental ingest as the downloaded exports
+POLL_PATH = "recent_plays"
+POLL_FILE_PATTERN = "Streaming_History_Polled_{month}.json"
+
+# Cursor of the last poll; the leading dot keeps the ingest from reading it as an export file
+POLLER_STATE_NAME = ".poller.json"
+
+# Most plays the endpoint returns per request
+RECENT_LIMIT = 50
+
+# Plays shown on the website
+RECENT_TRACKS_PATH = "recent_tracks.json"
+RECENT_TRACKS_COUNT = 3
+
+EXPORT_FIELDS = [
+    'ts', 'platform', 'ms_played', 'conn_country', 'ip_addr', 'master_metadata_track_name',
+    'master_metadata_album_artist_name', 'master_metadata_album_album_name', 'spotify_track_uri',
+    'episode_name', 'episode_show_name', 'spotify_episode_uri', 'audiobook_title', 'audiobook_uri',
+    'audiobook_chapter_uri', 'audiobook_chapter_title', 'reason_start', 'reason_end', 'shuffle',
+    'skipped', 'offline', 'offline_timestamp', 'incognito_mode',
+]
+
+
+def load_state(poll_dir=POLL_PATH):
+    path = os.path.join(poll_dir, POLLER_STATE_NAME)
+    if not os.path.exists(path):
+        return {'after': None, 'plays': 0}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def save_state(state, poll_dir=POLL_PATH):
+    os.makedirs(poll_dir, exist_ok=True)
+    path = os.path.join(poll_dir, POLLER_STATE_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _played_at_ms(item):
+    return int(pd.Timestamp(item['played_at']).value // 1_000_000)
+
+def play_record(item):
+    """
+    Export-format record for a recently-played item
+
+    The API does not say how long the track was played, so ms_played is the
+    track length; session fields the exports carry (platform, skipped, ...) are unknown.
+    """
+    track = item['track']
+    album = track.get('album') or {}
+    artists = track.get('artists') or []
+    record = dict.fromkeys(EXPORT_FIELDS)
+    record.update({
+        # Same second-resolution format as the exports
+        'ts': pd.Timestamp(item['played_at']).tz_convert('UTC').strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'ms_played': track.get('duration_ms'),
+        'master_metadata_track_name': track.get('name'),
+        'master_metadata_album_artist_name': artists[0]['name'] if artists else None,
+        'master_metadata_album_album_name': album.get('name'),
+        'spotify_track_uri': track.get('uri'),
+    })
+    return record
+
+async def fetch_recent_plays(client, after=None, limit=RECENT_LIMIT):
+    """
+    Plays after the cursor, oldest first, following the cursors while full pages come back
+
+    Parameters:
+    client (spotify_api.UserClient): Open client
+    after (int): Only plays after this time (epoch ms); None for the most recent ones
+    limit (int): Plays per request (the API maximum is 50)
+
+    Returns:
+    list: recently-played items
+    """
+    items = []
+    params = {'limit': limit}
+    if after is not None:
+        params['after'] = after
+
+    while True:
+        body = await client.get('/me/player/recently-played', params)
+        page = (body or {}).get('items') or []
+        items.extend(page)
+        cursor = ((body or {}).get('cursors') or {}).get('after')
+        if len(page) < limit or not body.get('next') or not cursor:
+            break
+        params = {'limit': limit, 'after': cursor}
+
+    items.sort(key=_played_at_ms)
+    return items
+
+def append_plays(records, poll_dir=POLL_PATH):
+    """
+    Add plays to the monthly export files, skipping plays already stored
+
+    Only the files of months that received new plays are rewritten.
+
+    Returns:
+    int: Number of plays added
+    """
+    os.makedirs(poll_dir, exist_ok=True)
+    added = 0
+    by_month = {}
+    for record in records:
+        by_month.setdefault(record['ts'][:7], []).append(record)
+
+    for month, month_records in sorted(by_month.items()):
+        path = os.path.join(poll_dir, POLL_FILE_PATTERN.format(month=month))
+        stored = []
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+        # Same identity as the dataset's record keys: start time, track and duration
+        seen = {(record['ts'], record['spotify_track_uri'], record['ms_played']) for record in stored}
+        new = []
+        for record in month_records:
+            key = (record['ts'], record['spotify_track_uri'], record['ms_played'])
+            if key not in seen:
+                seen.add(key)
+                new.append(record)
+        if not new:
+            continue
+
+        with open(path + ".tmp", 'w', encoding='utf-8') as file:
+            json.dump(stored + new, file, indent=2, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        added += len(new)
+    return added
+
+def recent_track(item):
+    # Entry in the format the website reads from recent_tracks.json
+    track = item['track']
+    album = track.get('album') or {}
+    images = album.get('images') or []
+    return {
+        'name': track.get('name'),
+        'artists': ', '.join(artist['name'] for artist in track.get('artists') or []),
+        'album': album.get('name'),
+        'link': (track.get('external_urls') or {}).get('spotify'),
+        'album_image': images[0]['url'] if images else None,
+    }
+
+def write_recent_tracks(items, path=RECENT_TRACKS_PATH, count=RECENT_TRACKS_COUNT):
+    tracks = [recent_track(item) for item in sorted(items, key=_played_at_ms, reverse=True)[:count]]
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(tracks, file, indent=4, ensure_ascii=False)
+
+async def poll_once(client, poll_dir=POLL_PATH, dataset_dir=DATASET_PATH, recent_tracks_path=None):
+    """
+    Fetch the plays since the last poll, store the new ones and ingest them
+
+    A poll without new plays writes nothing and skips the ingest.
+
+    Parameters:
+    client (spotify_api.UserClient): Open client
+    poll_dir (str): Directory of polled export files and the cursor
+    dataset_dir (str): Dataset to ingest into, or None to only collect the plays
+    recent_tracks_path (str): Also refresh the website's recent tracks file
+
+    Returns:
+    int: Number of new plays
+    """
+    state = load_state(poll_dir)
+    items = await fetch_recent_plays(client, state['after'])
+    if not items:
+        print("No new plays")
+        return 0
+
+    added = append_plays([play_record(item) for item in items if item.get('track')], poll_dir)
+    state['after'] = max(state['after'] or 0, max(_played_at_ms(item) for item in items))
+    state['plays'] = state.get('plays', 0) + added
+    save_state(state, poll_dir)
+    print(f"Fetched {len(items)} plays, {added} new")
+
+    if recent_tracks_path:
+        write_recent_tracks(items, recent_tracks_path)
+    if added and dataset_dir:
+        # Only the changed monthly files are re-read; duplicates of stored plays are dropped
+        from load_clean_save_input import ingest_directory
+        ingest_directory(poll_dir, dataset_dir)
+    return added
+
+async def poll_async(client, poll_dir=POLL_PATH, dataset_dir=DATASET_PATH, interval=None, recent_tracks_path=None):
+    """
+    Poll once, or every interval seconds until cancelled, over one open client
+
+    A single poll raises SpotifyAPIError when it fails. With an interval the
+    error is logged and the next poll tries again from the same cursor.
+
+    Returns:
+    int: Number of new plays
+    """
+    total = 0
+    while True:
+        try:
+            total += await poll_once(client, poll_dir, dataset_dir, recent_tracks_path)
+        except SpotifyAPIError as error:
+            if not interval:
+                raise
+            print(f"Poll failed, retrying in {interval:g}s: {error}", file=sys.stderr)
+        if not interval:
+            return total
+        await asyncio.sleep(interval)
+
+def poll(poll_dir=POLL_PATH, dataset_dir=DATASET_PATH, interval=None, recent_tracks_path=None,
+         base_url=API_BASE_URL, token_url=TOKEN_URL):
+    """
+    Poll the recently-played endpoint once, or every interval seconds over one connection and token
+
+    Returns:
+    int: Number of new plays
+    """
+    async def run():
+        async with UserClient(base_url=base_url, token_url=token_url, concurrency=1) as client:
+            return await poll_async(client, poll_dir, dataset_dir, interval, recent_tracks_path)
+
+    return asyncio.run(run())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Append recently played Spotify tracks to the listening history")
+    parser.add_argument('--poll-dir', default=POLL_PATH, help="directory for the polled plays and the cursor")
+    parser.add_argument('--data', default=DATASET_PATH, help="dataset to ingest new plays into")
+    parser.add_argument('--no-ingest', action='store_true', help="only collect the plays, do not touch the dataset")
+    parser.add_argument('--interval', type=float, default=None, help="keep polling every this many seconds")
+    parser.add_argument('--recent-tracks', metavar='PATH', default=None,
+                        help=f"also write the latest {RECENT_TRACKS_COUNT} tracks for the website (e.g. {RECENT_TRACKS_PATH})")
+    parser.add_argument('--base-url', default=API_BASE_URL, help="Web API base URL (e.g. a local mock server)")
+    parser.add_argument('--token-url', default=TOKEN_URL, help="token endpoint URL")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        poll(args.poll_dir, None if args.no_ingest else args.data, args.interval, args.recent_tracks,
+             args.base_url, args.token_url)
+    except SpotifyAPIError as error:
+        print(f"Polling stopped: {error}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
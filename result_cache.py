@@ -0,0 +1,133 @@
+import os
+import glob
+import json
+import pickle
+import hashlib
+
+from data_store import part_paths
+
+
+# Analysis results are pickled here, one file per result, keyed by a hash of
+# the data files they were computed from, the analysis and its parameters
+RESULT_CACHE_DIR = ".result_cache"
+
+# Bump when analysis code changes in a way that changes results, so cached ones are recomputed
+RESULT_CACHE_VERSION = 1
+
+# Least recently used results are evicted beyond this many bytes
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+ENTRY_SUFFIX = ".pkl"
+
+
+def file_signature(paths):
+    """
+    Name, size and modification time of each existing file, in a stable order
+    """
+    return [(os.path.basename(path), os.path.getsize(path), os.stat(path).st_mtime_ns) for path in sorted(paths) if os.path.exists(path)]
+
+def dataset_signature(data, rollups=False):
+    """
+    Signature of the files an analysis of data reads
+
+    A legacy CSV is one file; a dataset directory is its fact parts (or its
+    rollup cube when the analysis is answered from it) and its dimension tables.
+    """
+    if data.endswith('.csv'):
+        return {'csv': file_signature([data])}
+    signature = {'dimensions': file_signature(glob.glob(os.path.join(data, '_dim_*.parquet')))}
+    if rollups:
+        signature['rollups'] = file_signature(glob.glob(os.path.join(data, '_rollup', '*', '*.parquet')))
+    else:
+        signature['parts'] = file_signature(part_paths(data))
+    return signature
+
+def result_key(inputs):
+    """
+    Stable hash of everything a result depends on
+    """
+    payload = json.dumps([RESULT_CACHE_VERSION, inputs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """
+    Size-bounded on-disk store of analysis results
+
+    Entries are pickles named by their key. A read touches the file's
+    modification time, so eviction removes the least recently used entries
+    first; an entry larger than the whole budget is not stored.
+    """
+
+    def __init__(self, directory=RESULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """
+        The stored value, or None when the key is not cached
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as file:
+                value = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # Missing, or left unreadable by an interrupted write
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        with open(path + ".tmp", 'wb') as file:
+            file.write(data)
+        os.replace(path + ".tmp", path)
+        self.evict()
+
+    def entries(self):
+        """
+        (path, size, last use) of each entry, least recently used first
+        """
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*' + ENTRY_SUFFIX)):
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, info.st_size, info.st_mtime_ns))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits its budget
+
+        Returns:
+        int: Number of entries removed
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            os.remove(path)
@@ -0,0 +1,216 @@
+import os
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_store import DATASET_PATH, COMPRESSION, load_dataset, part_paths
+from sessions import epoch_ms
+
+
+# Pre-aggregated cube: minutes/plays/skips per (UTC hour bucket x dimension key),
+# stored per fact part under <dataset>/_rollup/<dimension>/ so it is updated incrementally
+ROLLUP_DIR = "_rollup"
+
+# Dimension name to the fact column it is keyed on ('total' has no key)
+ROLLUP_DIMENSIONS = {
+    'total': None,
+    'artist': 'artist_id',
+    'track': 'track_id',
+    'album': 'album_id',
+    'platform': 'platform',
+    'content_type': 'content_type',
+}
+
+MEASURES = ['minutes', 'plays', 'skips', 'skip_known', 'shuffles', 'shuffle_known']
+
+# Fixed column types so slices written from different parts always read back as one table
+MEASURE_TYPES = {
+    'hour': pa.int32(),
+    'minutes': pa.float64(),
+    'plays': pa.int64(),
+    'skips': pa.int64(),
+    'skip_known': pa.int64(),
+    'shuffles': pa.int64(),
+    'shuffle_known': pa.int64(),
+    'first_ms': pa.int64(),
+    'last_ms': pa.int64(),
+}
+
+# Calendar fields a query can roll the hour buckets up to
+ROLLUP_FIELDS = ['year', 'month', 'date', 'day_of_week', 'hour']
+
+# Fact columns needed to build the cube
+ROLLUP_SOURCE_COLUMNS = ['ts', 'minutes_played', 'skipped', 'shuffle'] + [column for column in ROLLUP_DIMENSIONS.values() if column]
+
+
+def compute_rollups(df):
+    """
+    Aggregate preprocessed rows into hourly cube slices, one per dimension
+
+    Parameters:
+    df (pandas.DataFrame): Preprocessed rows with ROLLUP_SOURCE_COLUMNS
+
+    Returns:
+    dict: Dimension name to DataFrame of (hour, key, measures)
+    """
+    ts_ms = epoch_ms(df['ts'])
+    base = pd.DataFrame({
+        'hour': (ts_ms // 3_600_000).astype('int32'),
+        'minutes': df['minutes_played'].to_numpy(dtype='float64'),
+        'plays': 1,
+        'skips': df['skipped'].fillna(False).astype('int32').to_numpy(),
+        'skip_known': df['skipped'].notna().astype('int32').to_numpy(),
+        'shuffles': df['shuffle'].fillna(False).astype('int32').to_numpy(),
+        'shuffle_known': df['shuffle'].notna().astype('int32').to_numpy(),
+    })
+
+    rollups = {}
+    for dimension, column in ROLLUP_DIMENSIONS.items():
+        if column is None:
+            grouped = base.assign(first_ms=ts_ms, last_ms=ts_ms).groupby('hour').agg(
+                {**{measure: 'sum' for measure in MEASURES}, 'first_ms': 'min', 'last_ms': 'max'})
+        else:
+            if column in ('platform', 'content_type'):
+                keys = df[column].astype(object) if column in df.columns else None
+            else:
+                # Parts written before the dimension tables existed count as unknown (-1)
+                keys = df[column].to_numpy() if column in df.columns else -1
+            grouped = base.assign(key=keys).groupby(['hour', 'key'], dropna=False)[MEASURES].sum()
+        rollups[dimension] = grouped.reset_index()
+
+    return rollups
+
+def merge_rollups(rollup_list):
+    """
+    Combine cube slices (e.g. one per chunk) into one slice per dimension
+    """
+    merged = {}
+    for dimension in ROLLUP_DIMENSIONS:
+        frames = [rollups[dimension] for rollups in rollup_list if dimension in rollups]
+        if not frames:
+            continue
+        combined = pd.concat(frames, ignore_index=True)
+        keys = ['hour'] if dimension == 'total' else ['hour', 'key']
+        aggregations = {measure: 'sum' for measure in MEASURES}
+        if dimension == 'total':
+            aggregations.update({'first_ms': 'min', 'last_ms': 'max'})
+        merged[dimension] = combined.groupby(keys, dropna=False).agg(aggregations).reset_index()
+    return merged
+
+def _rollup_path(dataset_dir, dimension, part):
+    return os.path.join(dataset_dir, ROLLUP_DIR, dimension, part)
+
+def _rollup_schema(dimension, columns):
+    key_type = pa.string() if dimension in ('platform', 'content_type') else pa.int32()
+    return pa.schema([pa.field(column, key_type if column == 'key' else MEASURE_TYPES[column]) for column in columns])
+
+def write_part_rollups(rollups, part, dataset_dir=DATASET_PATH):
+    """
+    Store the cube slices computed from one fact part
+    """
+    for dimension, frame in rollups.items():
+        path = _rollup_path(dataset_dir, dimension, part)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(frame, schema=_rollup_schema(dimension, frame.columns), preserve_index=False)
+        pq.write_table(table, path + ".tmp", compression=COMPRESSION)
+        os.replace(path + ".tmp", path)
+
+def remove_part_rollups(part, dataset_dir=DATASET_PATH):
+    """
+    Drop the cube slices of a fact part that is being replaced
+    """
+    for dimension in ROLLUP_DIMENSIONS:
+        path = _rollup_path(dataset_dir, dimension, part)
+        if os.path.exists(path):
+            os.remove(path)
+
+def _has_part_rollups(part, dataset_dir):
+    return all(os.path.exists(_rollup_path(dataset_dir, dimension, part)) for dimension in ROLLUP_DIMENSIONS)
+
+def has_rollups(dataset_dir=DATASET_PATH):
+    """
+    True when every fact part of the dataset has its cube slices
+    """
+    parts = part_paths(dataset_dir)
+    return bool(parts) and all(_has_part_rollups(os.path.basename(path), dataset_dir) for path in parts)
+
+def backfill_rollups(dataset_dir=DATASET_PATH, rebuild=False):
+    """
+    Build cube slices for fact parts that do not have them yet
+
+    Parameters:
+    dataset_dir (str): Dataset directory
+    rebuild (bool): Discard the whole cube and rebuild it from the fact parts
+
+    Returns:
+    int: Number of parts processed
+    """
+    if rebuild:
+        shutil.rmtree(os.path.join(dataset_dir, ROLLUP_DIR), ignore_errors=True)
+
+    built = 0
+    for path in part_paths(dataset_dir):
+        part = os.path.basename(path)
+        if _has_part_rollups(part, dataset_dir):
+            continue
+        available = pq.read_schema(path).names
+        df = load_dataset(path, [column for column in ROLLUP_SOURCE_COLUMNS if column in available])
+        write_part_rollups(compute_rollups(df), part, dataset_dir)
+        built += 1
+    return built
+
+def load_rollup(dimension='total', dataset_dir=DATASET_PATH):
+    """
+    Load one dimension of the cube, summed across parts
+
+    Parameters:
+    dimension (str): Key of ROLLUP_DIMENSIONS
+    dataset_dir (str): Dataset directory
+
+    Returns:
+    pandas.DataFrame: (hour, [key], measures) with one row per hour bucket and key
+    """
+    directory = os.path.join(dataset_dir, ROLLUP_DIR, dimension)
+    if not os.path.isdir(directory) or not os.listdir(directory):
+        raise FileNotFoundError(f"No {dimension} rollup in {dataset_dir}, run load_clean_save_input.py first")
+
+    frame = pq.read_table(directory).to_pandas()
+    return merge_rollups([{dimension: frame}])[dimension]
+
+def rollup(dimension='total', by=('year',), dataset_dir=DATASET_PATH, cube=None):
+    """
+    Query the cube at a coarser granularity
+
+    Parameters:
+    dimension (str): Key of ROLLUP_DIMENSIONS
+    by (tuple): Calendar fields from ROLLUP_FIELDS to group the hour buckets by;
+        the dimension key is always kept for keyed dimensions
+    dataset_dir (str): Dataset directory
+    cube (pandas.DataFrame): Already loaded cube to query instead of reading it
+
+    Returns:
+    pandas.DataFrame: Summed measures indexed by the requested fields (and key)
+    """
+    if cube is None:
+        cube = load_rollup(dimension, dataset_dir)
+
+    hours = pd.to_datetime(cube['hour'].astype('int64') * 3600, unit='s', utc=True)
+    fields = {
+        'year': hours.dt.year,
+        'month': hours.dt.month,
+        'date': hours.dt.date,
+        'day_of_week': hours.dt.dayofweek,
+        'hour': hours.dt.hour,
+    }
+    unknown = [field for field in by if field not in fields]
+    if unknown:
+        raise ValueError(f"Unknown rollup fields {unknown}, expected some of {ROLLUP_FIELDS}")
+
+    groups = [fields[field].rename(field) for field in by]
+    if dimension != 'total':
+        groups.append(cube['key'])
+    if not groups:
+        return cube[MEASURES].sum().to_frame().T
+
+    return cube.groupby(groups, dropna=False)[MEASURES].sum()
@@ -20,4 +20,63 @@ fetch("./recent_tracks.json")
         })
         .catch(error => {
             console.error("Error loading recent tracks:", error);
-        });
\ No newline at end of file
+        });
+
+// Everything else on the page comes from the dashboard feed written by dashboard.py, in one request;
+// until a feed is published the figures already in index.html stay up
+fetch("./dashboard.json")
+    .then(response => {
+        if (!response.ok) throw new Error(`dashboard.json returned ${response.status}`);
+        return response.json();
+    })
+    .then(feed => {
+        const sections = feed.sections;
+        const setText = (id, text) => {
+            const element = document.getElementById(id);
+            if (element) element.textContent = text;
+        };
+        const fillList = (id, entries, unit) => {
+            const list = document.getElementById(id);
+            if (!list || !entries) return;
+            list.innerHTML = '';
+            Object.entries(entries).slice(0, 10).forEach(([name, value]) => {
+                const item = document.createElement("li");
+                item.textContent = `${name} (${Math.round(value).toLocaleString()} ${unit})`;
+                list.appendChild(item);
+            });
+        };
+
+        if (sections.stats) {
+            const stats = sections.stats.result;
+            setText("num-songs", stats.unique_tracks.toLocaleString());
+            setText("num-artists", stats.unique_artists.toLocaleString());
+            setText("num-hours", stats.total_hours.toFixed(2));
+            setText("time-frame", `${stats.date_range[0].slice(0, 10)} to ${stats.date_range[1].slice(0, 10)}`);
+            setText("skip-rate", `${stats.skip_rate.toFixed(2)}%`);
+            setText("shuffle-rate", `${stats.shuffle_rate.toFixed(2)}%`);
+
+            const table = document.getElementById("platform-table");
+            table.innerHTML = '';
+            Object.entries(stats.platform_usage).forEach(([platform, plays]) => {
+                const row = document.createElement("tr");
+                [platform, plays.toLocaleString()].forEach(text => {
+                    const cell = document.createElement("th");
+                    cell.textContent = text;
+                    row.appendChild(cell);
+                });
+                table.appendChild(row);
+            });
+        }
+
+        if (sections["top-artists"]) fillList("top-artists-list", sections["top-artists"].result, "min");
+        if (sections["top-tracks-plays"]) fillList("top-songs-list", sections["top-tracks-plays"].result, "plays");
+
+        if (sections.sessions) {
+            const summary = sections.sessions.result;
+            setText("session-summary", `${summary.total_sessions.toLocaleString()} listening sessions, `
+                + `${summary.avg_session_length.toFixed(1)} minutes and ${summary.avg_tracks_per_session.toFixed(1)} tracks on average`);
+        }
+    })
+    .catch(error => {
+        console.error("Error loading dashboard feed:", error);
+    });
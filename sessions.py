@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+
+
+# Define a session as continuous listening with gaps of at most 20 minutes
+SESSION_GAP_MINUTES = 20
+
+_EPOCH = pd.Timestamp(0, tz='UTC')
+
+
+def epoch_ms(ts):
+    """
+    Timestamps as int64 milliseconds since the epoch, whatever their unit
+    """
+    return ((pd.to_datetime(ts, utc=True) - _EPOCH) // pd.Timedelta(milliseconds=1)).to_numpy(dtype='int64')
+
+def _segments(starts, ts, minutes, keys):
+    # Collapse rows into segments beginning wherever starts is True
+    first = np.flatnonzero(starts)
+    end = np.append(first[1:], len(ts))
+    return pd.DataFrame({
+        'start': ts[first],
+        'last': ts[end - 1],
+        'count': end - first,
+        'minutes': np.add.reduceat(minutes, first),
+        'key': keys[first],
+    })
+
+class SessionBuilder:
+    """
+    Single-pass session and same-artist run detection over time-ordered chunks
+
+    Feed chunks with add() in timestamp order; the session and run still open
+    at the end of a chunk are carried into the next one, so a history can be
+    processed chunk by chunk without a sorted copy of the whole frame.
+
+    Usage:
+        builder = SessionBuilder()
+        for chunk in chunks:
+            builder.add(epoch_ms(chunk['ts']), chunk['artist_id'].to_numpy(), chunk['minutes_played'].to_numpy())
+        sessions, binges = builder.finish()
+    """
+
+    def __init__(self, gap_minutes=SESSION_GAP_MINUTES):
+        self.gap_ms = gap_minutes * 60_000
+        self._closed = {'sessions': [], 'runs': []}
+        self._open = {'sessions': None, 'runs': None}
+        self._last_ts = None
+        self._last_key = None
+
+    def add(self, ts, keys, minutes):
+        """
+        Add one chunk of plays
+
+        Parameters:
+        ts (numpy.ndarray): int64 epoch milliseconds, sorted, not earlier than the previous chunk
+        keys (numpy.ndarray): int artist key per play, negative for unknown
+        minutes (numpy.ndarray): Minutes played per play
+        """
+        if len(ts) == 0:
+            return
+        ts = np.asarray(ts, dtype='int64')
+        keys = np.asarray(keys)
+        minutes = np.asarray(minutes, dtype='float64')
+
+        # Session boundaries: gap to the previous play; run boundaries: artist change
+        session_starts = np.empty(len(ts), dtype=bool)
+        session_starts[1:] = np.diff(ts) > self.gap_ms
+        session_starts[0] = self._last_ts is None or ts[0] - self._last_ts > self.gap_ms
+
+        # Plays with an unknown artist never extend a run
+        known = keys >= 0
+        run_starts = np.empty(len(ts), dtype=bool)
+        run_starts[1:] = (keys[1:] != keys[:-1]) | ~known[1:] | ~known[:-1]
+        run_starts[0] = self._last_key is None or keys[0] != self._last_key or not known[0] or self._last_key < 0
+
+        # The first row always opens a segment here; _extend merges it into the open one if needed
+        for kind, starts in (('sessions', session_starts), ('runs', run_starts)):
+            starts_new = bool(starts[0])
+            starts[0] = True
+            self._extend(kind, _segments(starts, ts, minutes, keys), starts_new)
+
+        self._last_ts = ts[-1]
+        self._last_key = keys[-1]
+
+    def _extend(self, kind, segments, starts_new):
+        open_segment = self._open[kind]
+        if open_segment is not None and not starts_new:
+            # The first segment of this chunk continues the open one
+            merged = open_segment.copy()
+            merged['last'] = segments['last'].iloc[0]
+            merged['count'] += segments['count'].iloc[0]
+            merged['minutes'] += segments['minutes'].iloc[0]
+            segments = pd.concat([merged, segments.iloc[1:]], ignore_index=True)
+        elif open_segment is not None:
+            segments = pd.concat([open_segment, segments], ignore_index=True)
+
+        self._closed[kind].append(segments.iloc[:-1])
+        self._open[kind] = segments.iloc[-1:].reset_index(drop=True)
+
+    def _collect(self, kind):
+        parts = self._closed[kind] + ([self._open[kind]] if self._open[kind] is not None else [])
+        if not parts:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in
+                                 [('start', 'int64'), ('last', 'int64'), ('count', 'int64'), ('minutes', 'float64'), ('key', 'int64')]})
+        return pd.concat(parts, ignore_index=True)
+
+    def finish(self):
+        """
+        Close the open session and run and return compact tables
+
+        Returns:
+        tuple: (sessions DataFrame, binges DataFrame)
+        """
+        segments = self._collect('sessions')
+        start_time = pd.to_datetime(segments['start'], unit='ms', utc=True)
+        sessions = pd.DataFrame({
+            'start_time': start_time,
+            'tracks_played': segments['count'].astype('int32'),
+            'duration_minutes': segments['minutes'],
+            'gaps_minutes': (segments['last'] - segments['start']) / 60_000,
+        })
+        sessions['total_session_minutes'] = sessions['duration_minutes'] + sessions['gaps_minutes']
+        sessions['day_of_week'] = start_time.dt.dayofweek.astype('int8')
+        sessions['hour'] = start_time.dt.hour.astype('int8')
+        sessions['month'] = start_time.dt.month.astype('int8')
+        sessions['year'] = start_time.dt.year.astype('int16')
+        sessions.index.name = 'session_id'
+
+        runs = self._collect('runs')
+        binges = pd.DataFrame({
+            'artist': runs['key'],
+            'consecutive_plays': runs['count'].astype('int32'),
+            'duration_minutes': runs['minutes'],
+            'start_time': pd.to_datetime(runs['start'], unit='ms', utc=True),
+        })
+        binges.index.name = 'binge_group'
+
+        return sessions, binges
+
+def build_sessions(ts, keys, minutes, gap_minutes=SESSION_GAP_MINUTES):
+    """
+    Sessions and same-artist runs for unsorted in-memory arrays
+
+    Only the timestamp array is argsorted; the frame itself is never copied.
+
+    Parameters:
+    ts (numpy.ndarray): int64 epoch milliseconds
+    keys (numpy.ndarray): int artist key per play, negative for unknown
+    minutes (numpy.ndarray): Minutes played per play
+    gap_minutes (int): Longest pause that still continues a session
+
+    Returns:
+    tuple: (sessions DataFrame, binges DataFrame)
+    """
+    order = np.argsort(ts, kind='stable')
+    builder = SessionBuilder(gap_minutes)
+    builder.add(np.asarray(ts)[order], np.asarray(keys)[order], np.asarray(minutes)[order])
+    return builder.finish()
+
+def build_sessions_chunked(chunks, key_column='artist_id', gap_minutes=SESSION_GAP_MINUTES):
+    """
+    Sessions and same-artist runs over an iterable of time-ordered DataFrame chunks
+
+    Parameters:
+    chunks (iterable): DataFrames with ts, key_column and minutes_played; each
+        chunk sorted by ts and starting no earlier than the previous one ended
+    key_column (str): Integer artist key column
+    gap_minutes (int): Longest pause that still continues a session
+
+    Returns:
+    tuple: (sessions DataFrame, binges DataFrame)
+    """
+    builder = SessionBuilder(gap_minutes)
+    for chunk in chunks:
+        builder.add(epoch_ms(chunk['ts']), chunk[key_column].to_numpy(), chunk['minutes_played'].to_numpy())
+    return builder.finish()
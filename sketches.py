@@ -0,0 +1,412 @@
+import os
+import sys
+import time
+import math
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from data_store import DATASET_PATH, load_dataset, part_paths
+
+
+# Default error bounds for sketch mode
+DEFAULT_DISTINCT_ERROR = 0.01  # relative standard error of HyperLogLog counts
+DEFAULT_TOP_K = 1000  # counters kept per top-K summary; a count is off by at most total / DEFAULT_TOP_K
+DEFAULT_CMS_EPSILON = 0.0001  # count-min overestimates by at most epsilon * total ...
+DEFAULT_CMS_DELTA = 0.01  # ... with probability 1 - delta
+
+# Count-min row salts are fixed so sketches built in different runs can be merged
+_CMS_SEED = 0x5eed
+
+
+def hash_values(values):
+    """
+    Stable uint64 hash of each non-null value
+
+    Categoricals hash their categories once and gather by code, so a column of
+    repeated names costs one hash per distinct name. Equal strings hash equally
+    whatever their dtype, which keeps sketches from different files mergeable.
+
+    Parameters:
+    values (pandas.Series): Values to hash
+
+    Returns:
+    tuple: (uint64 hashes, boolean mask of the non-null positions)
+    """
+    values = pd.Series(values)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        present = codes >= 0
+        category_hashes = pd.util.hash_array(values.cat.categories.to_numpy(dtype=object))
+        return category_hashes[codes[present]], present
+
+    present = values.notna().to_numpy()
+    return pd.util.hash_array(values[present].to_numpy(dtype=object)), present
+
+def _bit_length(values):
+    # Vectorized int.bit_length for uint64; frexp rounds up near powers of two, so correct downwards
+    _, exponent = np.frexp(values.astype('float64'))
+    exponent = exponent.astype('int64')
+    too_high = (exponent > 0) & ((values >> np.maximum(exponent - 1, 0).astype('uint64')) == 0)
+    return exponent - too_high
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter
+
+    Uses 2**precision one-byte registers; the relative standard error is
+    about 1.04 / sqrt(2**precision). Sketches with the same precision merge
+    by taking the register-wise maximum.
+    """
+
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    @classmethod
+    def from_error(cls, relative_error=DEFAULT_DISTINCT_ERROR):
+        """
+        Smallest sketch whose relative standard error is at most relative_error
+        """
+        precision = math.ceil(2 * math.log2(1.04 / relative_error))
+        return cls(min(max(precision, 4), 18))
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return self
+        bits = 64 - self.precision
+        index = (hashes >> np.uint64(bits)).astype(np.int64)
+        rest = hashes & np.uint64((1 << bits) - 1)
+        rank = (bits - _bit_length(rest) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+
+    def add(self, values):
+        hashes, _ = hash_values(values)
+        return self.add_hashes(hashes)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate while many registers are still empty
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    @property
+    def nbytes(self):
+        return self.registers.nbytes
+
+class CountMinSketch:
+    """
+    Count-min sketch of weighted counts per key
+
+    Estimates never undercount and overcount by at most epsilon * total
+    weight with probability 1 - delta. Sketches with the same epsilon and
+    delta merge by adding their tables.
+    """
+
+    def __init__(self, epsilon=DEFAULT_CMS_EPSILON, delta=DEFAULT_CMS_DELTA):
+        self.epsilon = epsilon
+        self.delta = delta
+        # Power-of-two width so a row index is just the top bits of a salted hash
+        self.width_bits = max(1, math.ceil(math.log2(math.e / epsilon)))
+        depth = max(1, math.ceil(math.log(1 / delta)))
+        salts = np.random.default_rng(_CMS_SEED).integers(0, np.iinfo(np.uint64).max, size=(depth, 2), dtype=np.uint64, endpoint=True)
+        self._multipliers = salts[:, 0] | np.uint64(1)
+        self._offsets = salts[:, 1]
+        self.table = np.zeros((depth, 1 << self.width_bits), dtype=np.float64)
+        self.total = 0.0
+
+    def _columns(self, row, hashes):
+        return ((hashes * self._multipliers[row] + self._offsets[row]) >> np.uint64(64 - self.width_bits)).astype(np.int64)
+
+    def add_hashes(self, hashes, weights=None):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        weights = np.ones(len(hashes)) if weights is None else np.asarray(weights, dtype=np.float64)
+        with np.errstate(over='ignore'):
+            for row in range(len(self.table)):
+                np.add.at(self.table[row], self._columns(row, hashes), weights)
+        self.total += float(weights.sum())
+        return self
+
+    def add(self, values, weights=None):
+        hashes, present = hash_values(values)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)[present]
+        return self.add_hashes(hashes, weights)
+
+    def estimate_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if not len(hashes):
+            return np.empty(0)
+        with np.errstate(over='ignore'):
+            return np.min([self.table[row][self._columns(row, hashes)] for row in range(len(self.table))], axis=0)
+
+    def estimate(self, values):
+        """
+        Estimated total weight of each value (NaN for null values)
+        """
+        hashes, present = hash_values(values)
+        estimates = np.full(len(present), np.nan)
+        estimates[present] = self.estimate_hashes(hashes)
+        return estimates
+
+    def merge(self, other):
+        if self.table.shape != other.table.shape:
+            raise ValueError("Cannot merge count-min sketches with different error bounds")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+class SpaceSaving:
+    """
+    Space-saving heavy-hitter summary of weighted counts
+
+    Keeps at most k counters. Each kept count overestimates its key by at
+    most the recorded error, itself at most total / k, and every key whose
+    true count exceeds total / k is kept. Summaries merge by adding counters,
+    charging keys missing from a full summary that summary's smallest count.
+    Counters are indexed by the keys' uint64 hashes; the keys themselves are
+    only kept for the counters that survive.
+    """
+
+    def __init__(self, k=DEFAULT_TOP_K):
+        self.k = k
+        self.counters = pd.DataFrame({'count': pd.Series(dtype='float64'), 'error': pd.Series(dtype='float64')},
+                                     index=pd.Index([], dtype='uint64'))
+        self.labels = pd.Series(dtype=object, index=pd.Index([], dtype='uint64'))
+        self.total = 0.0
+
+    def _floor(self):
+        # Largest count a key missing from this summary could have
+        return self.counters['count'].min() if len(self.counters) >= self.k else 0.0
+
+    def _combine(self, counters, labels, floor, total):
+        union = self.counters.index.union(counters.index)
+        own_floor = self._floor()
+        combined = pd.DataFrame({
+            'count': self.counters['count'].reindex(union, fill_value=own_floor) + counters['count'].reindex(union, fill_value=floor),
+            'error': self.counters['error'].reindex(union, fill_value=own_floor) + counters['error'].reindex(union, fill_value=floor),
+        })
+        self.counters = combined.nlargest(self.k, 'count')
+        labels = pd.concat([self.labels, labels])
+        self.labels = labels[~labels.index.duplicated()].reindex(self.counters.index)
+        self.total += total
+        return self
+
+    def add(self, values, weights=None):
+        """
+        Add one chunk; it is summarized exactly, then merged into the counters
+        """
+        values = pd.Series(values)
+        weights = pd.Series(1.0 if weights is None else np.asarray(weights, dtype=np.float64), index=values.index)
+        chunk = weights.groupby(values, observed=True, sort=False).sum()
+        hashes, _ = hash_values(chunk.index.to_series())
+        counters = pd.DataFrame({'count': chunk.to_numpy(), 'error': 0.0}, index=pd.Index(hashes))
+        labels = pd.Series(chunk.index.astype(object), index=pd.Index(hashes))
+        return self._combine(counters, labels, 0.0, float(chunk.sum()))
+
+    def merge(self, other):
+        return self._combine(other.counters, other.labels, other._floor(), other.total)
+
+    def top(self, n=10):
+        """
+        The n heaviest keys with estimated counts, largest first
+        """
+        top = self.counters['count'].nlargest(n)
+        return pd.Series(top.to_numpy(), index=pd.Index(self.labels.reindex(top.index).to_numpy()), name='count')
+
+    @property
+    def nbytes(self):
+        return int(self.counters.memory_usage(deep=True).sum() + self.labels.memory_usage(deep=True))
+
+class StreamSketch:
+    """
+    Distinct counts and minutes/plays top-K for a listening history, built chunk by chunk
+
+    Usage:
+        sketch = StreamSketch(['track_name', 'artist_name'])
+        for chunk in chunks:
+            sketch.add(chunk)
+        sketch.distinct('artist_name'), sketch.top('artist_name', 'minutes')
+    """
+
+    def __init__(self, distinct_columns=(), top_columns=(), distinct_error=DEFAULT_DISTINCT_ERROR, top_k=DEFAULT_TOP_K,
+                 epsilon=DEFAULT_CMS_EPSILON, delta=DEFAULT_CMS_DELTA):
+        self.distinct_sketches = {column: HyperLogLog.from_error(distinct_error) for column in distinct_columns}
+        self.top_sketches = {
+            (column, measure): (SpaceSaving(top_k), CountMinSketch(epsilon, delta))
+            for column in top_columns for measure in ('minutes', 'plays')
+        }
+
+    def add(self, chunk):
+        for column, sketch in self.distinct_sketches.items():
+            sketch.add(chunk[column])
+        for (column, measure), (heavy, counts) in self.top_sketches.items():
+            weights = chunk['minutes_played'].to_numpy(dtype='float64') if measure == 'minutes' else None
+            heavy.add(chunk[column], weights)
+            counts.add(chunk[column], weights)
+        return self
+
+    def merge(self, other):
+        for column, sketch in self.distinct_sketches.items():
+            sketch.merge(other.distinct_sketches[column])
+        for key, (heavy, counts) in self.top_sketches.items():
+            heavy.merge(other.top_sketches[key][0])
+            counts.merge(other.top_sketches[key][1])
+        return self
+
+    def distinct(self, column):
+        return self.distinct_sketches[column].count()
+
+    def top(self, column, measure='minutes', n=None):
+        """
+        Heavy hitters of a column by minutes or plays
+
+        Candidates from the space-saving summary are re-estimated with the
+        count-min sketch and the tighter of the two (over)estimates is kept.
+        """
+        heavy, counts = self.top_sketches[(column, measure)]
+        candidates = heavy.counters['count']
+        estimates = np.minimum(candidates.to_numpy(), counts.estimate_hashes(candidates.index.to_numpy()))
+        labels = pd.Index(heavy.labels.reindex(candidates.index).to_numpy(), name=column)
+        result = pd.Series(estimates, index=labels, name=measure).sort_values(ascending=False)
+        if measure == 'plays':
+            result = result.round().astype('int64')
+        return result if n is None else result.head(n)
+
+    def estimate(self, column, measure, values):
+        """
+        Count-min estimate of the minutes or plays of arbitrary values
+        """
+        return self.top_sketches[(column, measure)][1].estimate(values)
+
+    @property
+    def nbytes(self):
+        return (sum(sketch.nbytes for sketch in self.distinct_sketches.values())
+                + sum(heavy.nbytes + counts.nbytes for heavy, counts in self.top_sketches.values()))
+
+def _dataset_files(path):
+    return part_paths(path) if os.path.isdir(path) else [path]
+
+def iter_dataset_chunks(path=DATASET_PATH, columns=None):
+    """
+    Yield the dataset one Parquet part at a time, reading only the given columns
+    """
+    for part in _dataset_files(path):
+        yield load_dataset(part, columns)
+
+def sketch_dataset(path=DATASET_PATH, distinct_columns=(), top_columns=(), **bounds):
+    """
+    Build a StreamSketch over a stored dataset, holding one part in memory at a time
+
+    Distinct columns the dataset does not have are skipped.
+
+    Parameters:
+    path (str): Dataset directory or Parquet file
+    distinct_columns (list): Columns to count distinct values of
+    top_columns (list): Columns to find the top keys of by minutes and plays
+    bounds: distinct_error, top_k, epsilon and delta for StreamSketch
+
+    Returns:
+    StreamSketch: The sketch of every part
+    """
+    files = _dataset_files(path)
+    available = pq.read_schema(files[0]).names if files else []
+    distinct_columns = [column for column in distinct_columns if column in available]
+    columns = list(dict.fromkeys(list(distinct_columns) + list(top_columns) + (['minutes_played'] if top_columns else [])))
+    sketch = StreamSketch(distinct_columns, top_columns, **bounds)
+    for chunk in iter_dataset_chunks(path, columns):
+        sketch.add(chunk)
+    return sketch
+
+def _measure(function):
+    # Wall time of an untraced call, then peak traced allocation of a second call (tracing slows pandas down)
+    start_time = time.time()
+    result = function()
+    elapsed = time.time() - start_time
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def benchmark_sketches(path=DATASET_PATH, columns=('track_name', 'artist_name', 'album_name'), top_n=10, **bounds):
+    """
+    Compare exact and sketched distinct counts and top lists on a stored dataset
+
+    Parameters:
+    path (str): Dataset directory or Parquet file
+    columns (tuple): Name columns to count and rank
+    top_n (int): Length of the top lists compared
+    bounds: Error bounds passed to StreamSketch
+
+    Returns:
+    dict: Timing, peak memory and accuracy of both modes
+    """
+    columns = list(columns)
+
+    def exact():
+        df = load_dataset(path, columns + ['minutes_played'])
+        return {
+            'distinct': {column: int(df[column].nunique()) for column in columns},
+            'top': {column: df.groupby(column, observed=True)['minutes_played'].sum().nlargest(top_n) for column in columns},
+        }
+
+    def approximate():
+        sketch = sketch_dataset(path, columns, columns, **bounds)
+        return sketch, {
+            'distinct': {column: sketch.distinct(column) for column in columns},
+            'top': {column: sketch.top(column, 'minutes', top_n) for column in columns},
+        }
+
+    print("Running exact aggregation...")
+    exact_result, exact_time, exact_peak = _measure(exact)
+    print("Running sketch aggregation...")
+    (sketch, sketch_result), sketch_time, sketch_peak = _measure(approximate)
+
+    report = {
+        'exact': {'seconds': exact_time, 'peak_bytes': exact_peak},
+        'sketch': {'seconds': sketch_time, 'peak_bytes': sketch_peak, 'sketch_bytes': sketch.nbytes},
+        'columns': {},
+    }
+    for column in columns:
+        true_count = exact_result['distinct'][column]
+        exact_top = exact_result['top'][column]
+        sketch_top = sketch_result['top'][column]
+        report['columns'][column] = {
+            'distinct_exact': true_count,
+            'distinct_sketch': sketch_result['distinct'][column],
+            'distinct_relative_error': abs(sketch_result['distinct'][column] - true_count) / max(true_count, 1),
+            'top_overlap': len(set(exact_top.index.astype(str)) & set(sketch_top.index.astype(str))) / max(len(exact_top), 1),
+            'top_max_relative_error': float(((sketch_top - exact_top.reindex(sketch_top.index)).abs() / exact_top.reindex(sketch_top.index)).max()),
+        }
+    return report
+
+if __name__ == "__main__":
+    report = benchmark_sketches(sys.argv[1] if len(sys.argv) > 1 else DATASET_PATH)
+
+    print(f"\nExact:  {report['exact']['seconds']:.2f} s, peak {report['exact']['peak_bytes'] / 2**20:.1f} MiB")
+    print(f"Sketch: {report['sketch']['seconds']:.2f} s, peak {report['sketch']['peak_bytes'] / 2**20:.1f} MiB "
+          f"(sketches {report['sketch']['sketch_bytes'] / 2**20:.1f} MiB)")
+    for column, result in report['columns'].items():
+        print(f"  - {column}: distinct {result['distinct_sketch']} vs {result['distinct_exact']} "
+              f"({result['distinct_relative_error']:.2%} off), top-10 overlap {result['top_overlap']:.0%}, "
+              f"max top-10 error {result['top_max_relative_error']:.2%}")
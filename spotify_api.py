@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import email.utils
+
+
+# Endpoints; override them (e.g. with a local mock server) through the environment or the client arguments
+API_BASE_URL = os.environ.get("SPOTIFY_API_BASE_URL", "https://api.spotify.com/v1")
+TOKEN_URL = os.environ.get("SPOTIFY_TOKEN_URL", "https://accounts.spotify.com/api/token")
+
+# Same credentials as the GitHub workflow
+CLIENT_ID_ENV = "SPOTIPY_CLIENT_ID"
+CLIENT_SECRET_ENV = "SPOTIPY_CLIENT_SECRET"
+
+# Endpoints under /me act for a user and need a refresh token from the authorization code flow
+REFRESH_TOKEN_ENV = "SPOTIFY_REFRESH_TOKEN"
+REFRESH_TOKEN_LIFETIME = 10 * 365 * 24 * 3600
+
+# Access tokens are kept here until shortly before they expire, so runs do not request a new one each time
+TOKEN_CACHE_PATH = os.environ.get("SPOTIFY_TOKEN_CACHE", ".spotify_token.json")
+TOKEN_EXPIRY_MARGIN = 60
+
+DEFAULT_CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 6
+DEFAULT_RETRY_AFTER = 1.0
+MAX_BACKOFF = 30.0
+# Rate limiting is not an error, so 429s have their own, much larger budget than MAX_RETRIES
+MAX_RATE_LIMITED = 100
+
+
+class SpotifyAPIError(Exception):
+    def __init__(self, status, url, message=''):
+        super().__init__(f"Spotify API returned {status} for {url}: {message[:200]}")
+        self.status = status
+        self.url = url
+
+def retry_after_seconds(value):
+    """
+    Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date
+    """
+    if value is None:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        resume = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+    return max(0.0, resume.timestamp() - time.time())
+
+class TokenCache:
+    """
+    Access tokens stored on disk until they expire, keyed by client and grant
+    """
+
+    def __init__(self, path=TOKEN_CACHE_PATH):
+        self.path = path
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key):
+        entry = self._load().get(key)
+        if entry and entry['expires_at'] - TOKEN_EXPIRY_MARGIN > time.time():
+            return entry['access_token']
+        return None
+
+    def put(self, key, access_token, expires_in):
+        if not self.path:
+            return
+        tokens = self._load()
+        tokens[key] = {'access_token': access_token, 'expires_at': time.time() + expires_in}
+        tmp_path = self.path + ".tmp"
+        # The file holds credentials, keep it private to the user
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='utf-8') as file:
+            json.dump(tokens, file)
+        os.replace(tmp_path, self.path)
+
+class SpotifyClient:
+    """
+    Async Spotify Web API client with pooled connections and rate limiting
+
+    At most `concurrency` requests are in flight over one pooled session. A
+    429 response pauses every request until its Retry-After has passed, including
+    the ones already queued for a slot; these pauses do not use up the retries.
+    Server errors are retried with exponential backoff, and an expired token is
+    refreshed once. Tokens come from the TokenCache while they are valid.
+
+    Usage:
+        async with SpotifyClient() as client:
+            tracks = await client.get('/tracks', {'ids': '...'})
+    """
+
+    def __init__(self, client_id=None, client_secret=None, base_url=API_BASE_URL, token_url=TOKEN_URL,
+                 concurrency=DEFAULT_CONCURRENCY, token_cache=None):
+        self.client_id = client_id or os.environ.get(CLIENT_ID_ENV)
+        self.client_secret = client_secret or os.environ.get(CLIENT_SECRET_ENV)
+        self.base_url = base_url.rstrip('/')
+        self.token_url = token_url
+        self.concurrency = concurrency
+        self.token_cache = token_cache if token_cache is not None else TokenCache()
+        self.session = None
+        self.requests = 0
+        self.throttled = 0
+        self._token = None
+        self._token_lock = None
+        self._slots = None
+        self._resume_at = 0.0
+
+    async def __aenter__(self):
+        # aiohttp is only needed to talk to the API, not to read what was cached from it
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT))
+        self._token_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    def _token_key(self):
+        return f"client_credentials:{self.client_id}"
+
+    def _token_request(self):
+        # Form data for the token endpoint
+        return {'grant_type': 'client_credentials'}
+
+    async def token(self, rejected=None):
+        """
+        Access token from memory, the on-disk cache or the token endpoint, in that order
+
+        Parameters:
+        rejected (str): Token the API just refused; a new one is requested unless another request already did
+        """
+        async with self._token_lock:
+            if rejected is None or self._token != rejected:
+                self._token = self._token or self.token_cache.get(self._token_key())
+                if self._token:
+                    return self._token
+
+            if not self.client_id or not self.client_secret:
+                raise SpotifyAPIError(401, self.token_url, f"set {CLIENT_ID_ENV} and {CLIENT_SECRET_ENV}")
+            credentials = base64.b64encode(f"{self.client_id}:{self.client_secret}".encode('utf-8')).decode('ascii')
+            headers = {'Authorization': f"Basic {credentials}"}
+            async with self.session.post(self.token_url, data=self._token_request(), headers=headers) as response:
+                if response.status != 200:
+                    raise SpotifyAPIError(response.status, self.token_url, await response.text())
+                result = await response.json()
+
+            self._token = result['access_token']
+            self.token_cache.put(self._token_key(), self._token, result.get('expires_in', 3600))
+            self._on_token(result)
+            return self._token
+
+    def _on_token(self, result):
+        # Hook for grants that return more than an access token
+        pass
+
+    async def _wait_for_rate_limit(self):
+        loop = asyncio.get_running_loop()
+        while self._resume_at > loop.time():
+            await asyncio.sleep(self._resume_at - loop.time())
+
+    async def get(self, path, params=None):
+        """
+        GET an API path and return the decoded JSON body
+
+        Parameters:
+        path (str): Path below the base URL, e.g. '/tracks'
+        params (dict): Query parameters
+
+        Returns:
+        dict: Response body (None for 204 No Content)
+        """
+        import aiohttp
+        url = f"{self.base_url}{path}"
+        loop = asyncio.get_running_loop()
+        refreshed = False
+        error = None
+        attempt = 0
+        rate_limited = 0
+
+        while True:
+            async with self._slots:
+                # Checked once the slot is taken, so requests queued during a 429 pause wait it out too
+                await self._wait_for_rate_limit()
+                token = await self.token()
+                try:
+                    async with self.session.get(url, params=params, headers={'Authorization': f"Bearer {token}"}) as response:
+                        self.requests += 1
+                        if response.status == 429:
+                            # Everyone waits, not just this request, so the limit is not hit again right away
+                            retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+                            self._resume_at = max(self._resume_at, loop.time() + retry_after)
+                            self.throttled += 1
+                            rate_limited += 1
+                            if rate_limited > MAX_RATE_LIMITED:
+                                raise SpotifyAPIError(429, url, f"still rate limited after {MAX_RATE_LIMITED} waits")
+                            continue
+                        if response.status == 401 and not refreshed:
+                            refreshed = True
+                            await self.token(rejected=token)
+                            continue
+                        if response.status >= 500:
+                            error = SpotifyAPIError(response.status, url, await response.text())
+                        elif response.status >= 400:
+                            raise SpotifyAPIError(response.status, url, await response.text())
+                        elif response.status == 204:
+                            return None
+                        else:
+                            return await response.json()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as connection_error:
+                    error = connection_error
+            if attempt == MAX_RETRIES:
+                raise SpotifyAPIError(getattr(error, 'status', None), url, f"gave up after {MAX_RETRIES} retries ({error})")
+            await asyncio.sleep(min(MAX_BACKOFF, 0.5 * 2 ** attempt))
+            attempt += 1
+
+class UserClient(SpotifyClient):
+    """
+    SpotifyClient acting for a user, authorized with a refresh token
+
+    Needed for the /me endpoints. When Spotify rotates the refresh token the
+    new one is kept in the TokenCache and preferred over the configured one.
+    """
+
+    def __init__(self, refresh_token=None, **kwargs):
+        super().__init__(**kwargs)
+        self.refresh_token = (self.token_cache.get(self._refresh_key())
+                              or refresh_token or os.environ.get(REFRESH_TOKEN_ENV))
+
+    def _token_key(self):
+        return f"refresh_token:{self.client_id}"
+
+    def _refresh_key(self):
+        return f"rotated_refresh_token:{self.client_id}"
+
+    def _token_request(self):
+        if not self.refresh_token:
+            raise SpotifyAPIError(401, self.token_url, f"set {REFRESH_TOKEN_ENV}")
+        return {'grant_type': 'refresh_token', 'refresh_token': self.refresh_token}
+
+    def _on_token(self, result):
+        if result.get('refresh_token') and result['refresh_token'] != self.refresh_token:
+            self.refresh_token = result['refresh_token']
+            self.token_cache.put(self._refresh_key(), self.refresh_token, REFRESH_TOKEN_LIFETIME)
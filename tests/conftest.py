@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import contextlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recent_plays import EXPORT_FIELDS
+
+
+def play(ts, ms_played=180_000, track='Track', artist='Artist', album='Album', uri='spotify:track:track', **fields):
+    """
+    One export-format record; pass track=None and uri=None for a play without metadata
+    """
+    record = dict.fromkeys(EXPORT_FIELDS)
+    record.update({
+        'ts': ts,
+        'platform': 'ios',
+        'ms_played': ms_played,
+        'master_metadata_track_name': track,
+        'master_metadata_album_artist_name': artist,
+        'master_metadata_album_album_name': album,
+        'spotify_track_uri': uri,
+        'shuffle': False,
+        'skipped': False,
+    })
+    record.update(fields)
+    return record
+
+def write_export(directory, name, records):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(records, file, indent=2)
+    return path
+
+@pytest.fixture
+def ingest(tmp_path):
+    """
+    Ingest export files ({name: records}) into a dataset under tmp_path and return its directory
+    """
+    from load_clean_save_input import ingest_directory
+
+    exports = str(tmp_path / 'exports')
+    dataset = str(tmp_path / 'spotify_data')
+
+    def run(files):
+        for name, records in files.items():
+            write_export(exports, name, records)
+        ingest_directory(exports, dataset, chunk_size=1000)
+        return dataset
+
+    return run
+
+@pytest.fixture
+def legacy_csv(tmp_path):
+    """
+    Write records as the combined CSV load_clean_save_input.py used to save, without id columns, and return its path
+    """
+    import pandas as pd
+    from load_clean_save_input import preprocess_data
+
+    def write(records):
+        path = str(tmp_path / 'spotify_data_combined.csv')
+        preprocess_data(pd.DataFrame(records)).to_csv(path, index=False)
+        return path
+
+    return write
+
+@contextlib.asynccontextmanager
+async def serve(routes):
+    """
+    Run an aiohttp mock of the Spotify endpoints on a free local port, yielding its base URL
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        yield f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    finally:
+        await runner.cleanup()
+
+async def token_endpoint(request):
+    from aiohttp import web
+    return web.json_response({'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600})
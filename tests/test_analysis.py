@@ -0,0 +1,120 @@
+import os
+import json
+import shutil
+
+import pandas as pd
+
+from conftest import play
+from column_store import COLUMNS_DIR
+from charts import defer_rendering
+import dashboard
+import data_analysis
+
+
+def test_weekly_trends_from_the_cli_projection(ingest):
+    # 2024-01-01 is a Monday; the 8th starts the next week
+    records = [play('2024-01-01T10:00:00Z', artist='A'), play('2024-01-03T10:00:00Z', artist='A'),
+               play('2024-01-08T10:00:00Z', artist='B')]
+    dataset = ingest({'Streaming_History_Audio_2024.json': records})
+
+    with defer_rendering():
+        results, _ = data_analysis.run_analyses(dataset, ['trends'], period='week', top_n=1)
+
+    trends = results['trends']
+    assert list(trends) == ['2024-01-01', '2024-01-08']
+    assert list(trends['2024-01-01']['top_artists']) == ['A']
+    assert list(trends['2024-01-08']['top_artists']) == ['B']
+
+def test_sessions_built_a_year_at_a_time_match_the_in_memory_ones(ingest):
+    # The late-night session runs across New Year, the A run across the year boundary too
+    records = [play('2023-06-01T10:00:00Z', artist='B'), play('2023-12-31T23:50:00Z', artist='A'),
+               play('2023-12-31T23:58:00Z', artist='A'), play('2024-01-01T00:05:00Z', artist='A'),
+               play('2024-03-01T10:00:00Z', artist='B'), play('2024-03-01T10:04:00Z', artist='C')]
+    dataset = ingest({'Streaming_History_Audio_2023-2024.json': records})
+    shutil.rmtree(os.path.join(dataset, COLUMNS_DIR))
+
+    assert data_analysis.uses_chunked_sessions(dataset, ['sessions', 'binges'])
+    chunked = data_analysis.analysis_frame(dataset, ['sessions', 'binges'])
+    in_memory = data_analysis.load_analysis_data(dataset, data_analysis.SESSION_COLUMNS)
+    for expected, actual in zip(data_analysis.get_aggregate(in_memory, 'sessions'), data_analysis.get_aggregate(chunked, 'sessions')):
+        pd.testing.assert_frame_equal(actual, expected)
+
+    with defer_rendering():
+        results, _ = data_analysis.run_analyses(dataset, ['sessions', 'binges'])
+    assert results['sessions'][0]['total_sessions'] == 3
+    assert results['sessions'][0]['longest_session_tracks'] == 3
+    assert results['binges']['longest_binges']['consecutive_plays'].iloc[0] == 3
+
+def test_names_and_cube_are_reread_after_an_ingest(ingest):
+    dataset = ingest({'Streaming_History_Audio_2023.json': [play('2023-01-01T10:00:00Z', artist='A')]})
+    cube = data_analysis.load_rollup_data(dataset)
+    assert dict(data_analysis.get_aggregate(cube, 'artist_minutes')) == {'A': 3.0}
+    assert list(data_analysis.load_dimension_names('artist_id', dataset)) == ['A']
+
+    ingest({'Streaming_History_Audio_2024.json': [play('2024-01-01T10:00:00Z', ms_played=600_000, artist='B')]})
+    cube = data_analysis.load_rollup_data(dataset)
+    assert dict(data_analysis.get_aggregate(cube, 'artist_minutes')) == {'A': 3.0, 'B': 10.0}
+    assert list(data_analysis.load_dimension_names('artist_id', dataset)) == ['A', 'B']
+
+def test_dashboard_fingerprints_follow_the_command_parameters(ingest):
+    dataset = ingest({'Streaming_History_Audio_2024.json': [play('2024-01-01T10:00:00Z')]})
+    sessions = dashboard.section_fingerprint(dataset, 'sessions')
+    skips = dashboard.section_fingerprint(dataset, 'skips')
+    assert dashboard.section_fingerprint(dataset, 'sessions', session_gap=45) != sessions
+    assert dashboard.section_fingerprint(dataset, 'skips', min_plays=2) != skips
+    # Parameters a section does not read leave it alone
+    assert dashboard.section_fingerprint(dataset, 'sessions', min_plays=2) == sessions
+    assert dashboard.section_inputs(dataset, 'skips')['metadata'] is not None
+
+def test_skips_on_a_legacy_csv(legacy_csv):
+    records = [play(f'2024-01-01T10:{minute:02d}:00Z', skipped=minute % 2 == 0) for minute in range(6)]
+    data = legacy_csv(records)
+
+    df = data_analysis.analysis_frame(data, ['skips'])
+    assert 'track_name' in df.columns and 'track_id' not in df.columns
+    with defer_rendering():
+        result = data_analysis.run_command(df, 'skips', min_plays=1)
+    assert result['skip_rate'] == {'Track': 50.0}
+
+def test_sessions_and_binges_on_a_legacy_csv(legacy_csv):
+    records = [play('2024-01-01T10:00:00Z', artist='A'), play('2024-01-01T10:03:00Z', artist='A'),
+               play('2024-01-01T10:06:00Z', artist='A'), play('2024-01-01T12:00:00Z', artist='B')]
+    data = legacy_csv(records)
+
+    with defer_rendering():
+        results, _ = data_analysis.run_analyses(data, ['sessions', 'binges'])
+    assert results['sessions'][0]['total_sessions'] == 2
+    longest = results['binges']['longest_binges']
+    assert longest['artist'].iloc[0] == 'A'
+    assert longest['consecutive_plays'].iloc[0] == 3
+
+def history():
+    # Two days of alternating A and B plays, three tracks each
+    return [play(f'2024-01-0{day}T{hour:02d}:{minute:02d}:00Z', artist=artist, track=f'{artist}{hour % 3}',
+                 uri=f'spotify:track:{artist}{hour % 3}', skipped=hour % 2 == 0, ip_addr='10.0.0.1')
+            for day in (1, 2) for hour in range(8, 14) for minute, artist in ((0, 'A'), (30, 'B'))]
+
+def test_every_command_runs_on_its_projection(ingest, legacy_csv):
+    for data in (ingest({'Streaming_History_Audio_2024.json': history()}), legacy_csv(history())):
+        available = data_analysis.available_columns(data)
+        for command, function in data_analysis.COMMANDS.items():
+            df = data_analysis.analysis_frame(data, [command], rollups=False)
+            if 'session_range' not in df.attrs:
+                assert set(df.columns) == set(data_analysis.required_columns([function], available)), (data, command)
+            with defer_rendering():
+                data_analysis.run_command(df, command, min_plays=1)
+
+def test_cli_json_output(ingest, capsys, tmp_path):
+    dataset = ingest({'Streaming_History_Audio_2024.json': history()})
+    capsys.readouterr()
+
+    data_analysis.main(['stats', 'top-artists', 'skips', '--data', dataset, '--format', 'json', '--min-plays', '1',
+                        '--cache-dir', str(tmp_path / 'cache')])
+
+    # stdout carries only the JSON document
+    results = json.loads(capsys.readouterr().out)
+    assert list(results) == ['stats', 'top-artists', 'skips']
+    assert results['stats']['unique_artists'] == 2
+    assert results['stats']['platform_usage'] == {'ios': 24}
+    assert results['top-artists'] == {'A': 36.0, 'B': 36.0}
+    assert set(results['skips']['skip_rate']) == {'A0', 'A1', 'A2', 'B0', 'B1', 'B2'}
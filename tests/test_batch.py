@@ -0,0 +1,23 @@
+import os
+import time
+
+from batch import _run_pool
+
+
+def work(user, delay):
+    time.sleep(delay)
+    if user == 'crash':
+        # Dies like a worker killed at its memory cap, breaking the pool
+        os._exit(1)
+    if user == 'bad':
+        raise ValueError("no exports")
+    return user.upper()
+
+def test_a_dead_worker_fails_only_its_user():
+    # 'a' is still running when 'crash' breaks the pool, 'b' and 'bad' have not started
+    tasks = [('a', 0.5), ('crash', 0), ('b', 0), ('bad', 0)]
+
+    results, failed = _run_pool(work, tasks, workers=2, max_memory_mb=None)
+
+    assert results == {'a': 'A', 'b': 'B'}
+    assert failed == {'crash': "worker process died (memory limit?)", 'bad': "ValueError: no exports"}
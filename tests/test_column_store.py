@@ -0,0 +1,56 @@
+import os
+import shutil
+
+import pandas as pd
+
+from conftest import play
+from column_store import COLUMNS_DIR, build_mapped_columns, has_mapped_columns, load_column_meta, load_mapped
+
+
+def rebuilt(dataset, tmp_path):
+    # The same dataset with its arrays written from scratch
+    copy = str(tmp_path / 'rebuilt')
+    shutil.copytree(dataset, copy)
+    build_mapped_columns(copy)
+    return load_mapped(copy)
+
+def decoded(df):
+    return df.astype({column: object for column in df.columns if isinstance(df[column].dtype, pd.CategoricalDtype)})
+
+def test_later_plays_are_appended_in_place(ingest, tmp_path):
+    dataset = ingest({'Streaming_History_Audio_2023.json': [play(f'2023-0{month}-01T10:00:00Z', artist='A') for month in range(1, 6)]})
+    ts_file = os.path.join(dataset, COLUMNS_DIR, 'ts.npy')
+    inode = os.stat(ts_file).st_ino
+    before = load_mapped(dataset)
+
+    ingest({'Streaming_History_Audio_2024.json': [play('2024-01-01T10:00:00Z', artist='B', track='New', uri='spotify:track:new'),
+                                                 play('2024-02-01T10:00:00Z', artist='A')]})
+
+    assert has_mapped_columns(dataset)
+    assert os.stat(ts_file).st_ino == inode
+    assert load_column_meta(dataset)['rows'] == 7
+    after = load_mapped(dataset)
+    pd.testing.assert_frame_equal(decoded(after), decoded(rebuilt(dataset, tmp_path)))
+    # What an earlier reader mapped is unchanged
+    pd.testing.assert_frame_equal(decoded(after.iloc[:5]), decoded(before))
+
+def test_a_rewritten_part_rewrites_only_the_tail(ingest, tmp_path):
+    old = [play(f'2023-0{month}-01T10:00:00Z', artist='A') for month in range(1, 6)]
+    month = [play('2024-01-01T10:00:00Z', artist='B'), play('2024-01-02T10:00:00Z', artist='C')]
+    dataset = ingest({'Streaming_History_Audio_2023.json': old, 'Streaming_History_Polled_2024-01.json': month})
+    inode = os.stat(os.path.join(dataset, COLUMNS_DIR, 'ts.npy')).st_ino
+
+    # The poller rewrites its monthly file with the new plays appended, which replaces its part
+    ingest({'Streaming_History_Polled_2024-01.json': month + [play('2024-01-03T10:00:00Z', artist='D')]})
+
+    assert os.stat(os.path.join(dataset, COLUMNS_DIR, 'ts.npy')).st_ino == inode
+    assert load_column_meta(dataset)['rows'] == 8
+    pd.testing.assert_frame_equal(decoded(load_mapped(dataset)), decoded(rebuilt(dataset, tmp_path)))
+
+def test_plays_in_the_middle_of_the_history(ingest, tmp_path):
+    dataset = ingest({'Streaming_History_Audio_2024.json': [play('2024-01-01T10:00:00Z', artist='B')]})
+
+    ingest({'Streaming_History_Audio_2023.json': [play('2023-01-01T10:00:00Z', artist='A')]})
+
+    assert list(load_mapped(dataset)['artist_name']) == ['A', 'B']
+    pd.testing.assert_frame_equal(decoded(load_mapped(dataset)), decoded(rebuilt(dataset, tmp_path)))
@@ -0,0 +1,64 @@
+import os
+
+import load_clean_save_input
+from conftest import play
+from data_store import load_dataset, load_manifest, part_paths, read_record_keys
+from load_clean_save_input import ingest_directory
+
+
+def chapter(number):
+    return play('2024-01-01T10:00:00Z', ms_played=60_000, track=None, artist=None, album=None, uri=None,
+                audiobook_title='Book', audiobook_uri='spotify:show:book',
+                audiobook_chapter_title=f'Chapter {number}', audiobook_chapter_uri=f'spotify:episode:chapter{number}')
+
+def test_audiobook_chapters_are_told_apart_by_their_uri(ingest):
+    dataset = ingest({'Streaming_History_Audio_2024.json': [chapter(1), chapter(2)]})
+    assert sorted(load_dataset(dataset, ['audiobook_chapter_uri'])['audiobook_chapter_uri']) == [
+        'spotify:episode:chapter1', 'spotify:episode:chapter2']
+
+    # The same plays exported again are still duplicates
+    ingest({'Streaming_History_Audio_2024_copy.json': [chapter(1), chapter(2)]})
+    assert len(load_dataset(dataset, ['ts'])) == 2
+
+def plays(hour, count, track='Track'):
+    return [play(f'2024-01-01T{hour:02d}:{minute:02d}:00Z', track=track, uri=f'spotify:track:{track.lower()}')
+            for minute in range(count)]
+
+def test_unchanged_files_are_skipped_without_being_read(ingest, tmp_path, monkeypatch):
+    dataset = ingest({'Streaming_History_Audio_2024.json': plays(10, 3)})
+
+    def fail(path):
+        raise AssertionError(f"{path} was hashed")
+
+    # Matching size and mtime skip the file before its content is hashed
+    monkeypatch.setattr(load_clean_save_input, 'file_hash', fail)
+    assert ingest_directory(str(tmp_path / 'exports'), dataset) == 0
+
+def test_a_touched_file_is_recognised_by_its_hash(ingest, tmp_path):
+    dataset = ingest({'Streaming_History_Audio_2024.json': plays(10, 3)})
+    path = os.path.abspath(tmp_path / 'exports' / 'Streaming_History_Audio_2024.json')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert ingest_directory(str(tmp_path / 'exports'), dataset) == 0
+    assert load_manifest(dataset)['files'][path]['mtime'] == stat.st_mtime_ns + 10**9
+    assert len(load_dataset(dataset, ['ts'])) == 3
+
+def test_a_modified_file_replaces_its_part(ingest):
+    dataset = ingest({'Streaming_History_Audio_2024.json': plays(10, 3), 'Streaming_History_Audio_2023.json': plays(9, 2, 'Old')})
+    parts = part_paths(dataset)
+
+    ingest({'Streaming_History_Audio_2024.json': plays(10, 2) + plays(11, 2, 'New')})
+
+    assert len(part_paths(dataset)) == len(parts)
+    df = load_dataset(dataset, ['track_name'])
+    assert sorted(df['track_name'].value_counts().items()) == [('New', 2), ('Old', 2), ('Track', 2)]
+
+def test_plays_already_stored_are_dropped(ingest):
+    dataset = ingest({'Streaming_History_Audio_2024.json': plays(10, 4)})
+
+    # A later export that overlaps the first one
+    ingest({'Streaming_History_Audio_2024_2.json': plays(10, 4)[2:] + plays(11, 2, 'New')})
+
+    assert len(read_record_keys(dataset)) == 6
+    assert sorted(load_dataset(dataset, ['track_name'])['track_name'].value_counts().items()) == [('New', 2), ('Track', 4)]
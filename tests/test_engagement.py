@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+
+from conftest import play
+from charts import defer_rendering
+from engagement import engagement_stats
+import data_analysis
+
+
+def test_plays_without_a_track_are_left_out_of_the_track_table():
+    keys = np.array([0, 0, -1, 1, -1])
+    skipped = pd.Series([True, False, True, None, False], dtype='boolean')
+    hours = np.array([1, 1, 1, 2, 3])
+
+    tracks, by_hour = engagement_stats(keys, skipped, hours, min_plays=1)
+
+    assert list(tracks.index) == [0, 1]
+    assert list(tracks['plays']) == [2, 1]
+    assert tracks.loc[0, 'skip_rate'] == 50
+    # Every play still counts per hour
+    assert by_hour['plays'].sum() == 5
+    assert by_hour.loc[1, 'skips'] == 2
+
+def test_skip_analysis_with_a_play_missing_its_uri(ingest):
+    records = [play(f'2024-01-01T10:{minute:02d}:00Z', skipped=minute % 2 == 0) for minute in range(6)]
+    records.append(play('2024-01-01T11:00:00Z', track=None, artist=None, album=None, uri=None, skipped=True))
+    dataset = ingest({'Streaming_History_Audio_2024.json': records})
+
+    df = data_analysis.load_analysis_data(dataset, columns=data_analysis.required_columns([data_analysis.analyze_skip_behavior]))
+    assert (df['track_id'] < 0).sum() == 1
+    with defer_rendering():
+        result = data_analysis.analyze_skip_behavior(df, min_plays=1)
+
+    assert result['play_count'] == {'Track': 6}
+    assert result['skip_rate'] == {'Track': 50.0}
+
+def test_plays_without_a_name_are_not_ranked_on_a_legacy_csv(legacy_csv):
+    records = [play(f'2024-01-01T10:{minute:02d}:00Z', skipped=minute % 2 == 0) for minute in range(6)]
+    records += [play(f'2024-01-01T11:{minute:02d}:00Z', track=None, artist=None, album=None, uri=None, skipped=True)
+                for minute in range(6)]
+    df = data_analysis.analysis_frame(legacy_csv(records), ['skips'])
+    with defer_rendering():
+        result = data_analysis.analyze_skip_behavior(df, min_plays=1)
+
+    # Same as plays without a track id: counted per hour, not ranked as a track
+    assert result['skip_rate'] == {'Track': 50.0}
@@ -0,0 +1,115 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import instrumentation
+import load_clean_save_input
+from instrumentation import configure
+from conftest import play, write_export
+from data_store import load_dataset, read_record_keys
+from load_clean_save_input import (
+    QUARANTINE_DIR, QUARANTINE_REPORT_NAME, ingest_directory, load_checkpoint, load_spotify_data, preprocess_data,
+)
+
+
+def exports(directory):
+    # Three files with different plays, written out of name order
+    for year in (2024, 2022, 2023):
+        write_export(directory, f'Streaming_History_Audio_{year}.json',
+                     [play(f'{year}-01-01T10:{minute:02d}:00Z', track=f'T{year}-{minute}') for minute in range(5)])
+    return directory
+
+def test_parallel_load_matches_a_serial_one(tmp_path):
+    directory = exports(str(tmp_path))
+
+    serial = load_spotify_data(directory, workers=1)
+    parallel = load_spotify_data(directory, workers=3)
+
+    pd.testing.assert_frame_equal(parallel, serial)
+    pd.testing.assert_frame_equal(load_spotify_data(directory, workers=3), parallel)
+    # Files come out in name order, each in its own record order
+    assert list(serial['master_metadata_track_name'][::5]) == ['T2022-0', 'T2023-0', 'T2024-0']
+
+def test_skipped_records_are_reported_by_the_parent(tmp_path, capfd):
+    directory = exports(str(tmp_path))
+    write_export(directory, 'Streaming_History_Audio_2025.json', [play('2025-01-01T10:00:00Z'), 5])
+    verbose = instrumentation.get_tracer().verbose
+    try:
+        configure(verbose=False)
+        assert len(load_spotify_data(directory, workers=2)) == 16
+        assert "Skipped" not in capfd.readouterr().out
+
+        configure(verbose=True)
+        load_spotify_data(directory, workers=2)
+        assert "Skipped 1 bad records in Streaming_History_Audio_2025.json" in capfd.readouterr().out
+    finally:
+        configure(verbose=verbose)
+
+def report(dataset):
+    with open(os.path.join(dataset, QUARANTINE_DIR, QUARANTINE_REPORT_NAME), 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def test_a_file_cut_off_mid_record_keeps_the_records_before_the_cut(tmp_path):
+    exports, dataset = str(tmp_path / 'exports'), str(tmp_path / 'spotify_data')
+    path = write_export(exports, 'Streaming_History_Audio_2024.json',
+                        [play(f'2024-01-01T10:{minute:02d}:00Z', track=f'T{minute}') for minute in range(5)])
+    with open(path, 'r', encoding='utf-8') as file:
+        text = file.read()
+    # Cut inside the fourth record
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text[:text.index('T3')])
+
+    assert ingest_directory(exports, dataset, chunk_size=2) == 3
+    assert list(load_dataset(dataset, ['track_name'])['track_name']) == ['T0', 'T1', 'T2']
+    assert report(dataset)[os.path.abspath(path)]['reasons'] == {'truncated file': 1}
+
+def test_invalid_records_are_quarantined_with_their_reasons(tmp_path):
+    exports, dataset = str(tmp_path / 'exports'), str(tmp_path / 'spotify_data')
+    records = [play('2024-01-01T10:00:00Z', track='Good'), play('yesterday', track='BadTs'),
+               play('2024-01-01T10:05:00Z', ms_played=-1, track='Negative'), play('2024-01-01T10:10:00Z', track='Good2')]
+    path = os.path.abspath(write_export(exports, 'Streaming_History_Audio_2024.json', records))
+
+    assert ingest_directory(exports, dataset) == 2
+    entry = report(dataset)[path]
+    assert entry['quarantined'] == 2
+    assert entry['reasons'] == {'invalid ts': 1, 'invalid ms_played': 1}
+    with open(os.path.join(dataset, entry['records']), 'r', encoding='utf-8') as file:
+        quarantined = [json.loads(line) for line in file]
+    assert [(item['reason'], item['record']['master_metadata_track_name']) for item in quarantined] == [
+        ('invalid ts', 'BadTs'), ('invalid ms_played', 'Negative')]
+
+def test_an_interrupted_ingest_resumes_from_its_checkpoint(tmp_path, monkeypatch):
+    records = [play(f'2024-01-01T{hour:02d}:{minute:02d}:00Z', track=f'T{minute % 7}', uri=f'spotify:track:{minute % 7}')
+               for hour in range(10, 13) for minute in range(0, 60, 3)]
+    exports = str(tmp_path / 'exports')
+    write_export(exports, 'Streaming_History_Audio_2024.json', records)
+    expected = str(tmp_path / 'uninterrupted')
+    ingest_directory(exports, expected, chunk_size=20)
+
+    dataset = str(tmp_path / 'spotify_data')
+    chunks = []
+
+    def counted(stop_at=None):
+        def preprocess(chunk, lean=False):
+            chunks.append(len(chunk))
+            if len(chunks) == stop_at:
+                raise KeyboardInterrupt
+            return preprocess_data(chunk, lean)
+        return preprocess
+
+    monkeypatch.setattr(load_clean_save_input, 'preprocess_data', counted(stop_at=2))
+    with pytest.raises(KeyboardInterrupt):
+        ingest_directory(exports, dataset, chunk_size=20)
+    assert load_checkpoint(dataset)['chunks'] == 1
+
+    chunks.clear()
+    monkeypatch.setattr(load_clean_save_input, 'preprocess_data', counted())
+    assert ingest_directory(exports, dataset, chunk_size=20) == len(records)
+    # Only the records after the checkpoint were read again
+    assert chunks == [20, 20]
+    assert load_checkpoint(dataset) is None
+    np.testing.assert_array_equal(read_record_keys(dataset), read_record_keys(expected))
+    pd.testing.assert_frame_equal(load_dataset(dataset), load_dataset(expected))
@@ -0,0 +1,48 @@
+import pandas as pd
+
+import instrumentation
+from instrumentation import Tracer, configure
+from conftest import play
+from load_clean_save_input import preprocess_data
+from charts import defer_rendering
+import data_analysis
+
+
+def test_events_are_capped_but_the_summary_counts_them_all():
+    tracer = Tracer(verbose=False, max_events=3)
+    for rows in range(5):
+        with tracer.stage('chunk', rows=rows):
+            pass
+
+    assert [event['rows'] for event in tracer.events] == [2, 3, 4]
+    assert tracer.dropped == 2
+    assert tracer.summary()['chunk']['calls'] == 5
+    assert tracer.summary()['chunk']['rows'] == 10
+    assert tracer.to_json()['dropped_events'] == 2
+
+def test_quiet_silences_preprocessing(capsys):
+    verbose = instrumentation.get_tracer().verbose
+    df = pd.DataFrame([play('2024-01-01T10:00:00Z')])
+    try:
+        configure(verbose=False)
+        preprocess_data(df.copy(), lean=True)
+        preprocess_data(df.copy())
+        assert capsys.readouterr().out == ''
+
+        configure(verbose=True)
+        preprocess_data(df.copy(), lean=True)
+        assert "Starting data preprocessing" in capsys.readouterr().out
+    finally:
+        configure(verbose=verbose)
+
+def test_quiet_silences_the_analyses(ingest, capsys):
+    dataset = ingest({'Streaming_History_Audio_2024.json': [play(f'2024-01-01T10:{minute:02d}:00Z') for minute in range(6)]})
+    verbose = instrumentation.get_tracer().verbose
+    capsys.readouterr()
+    try:
+        configure(verbose=False)
+        with defer_rendering():
+            data_analysis.run_analyses(dataset, list(data_analysis.COMMANDS), rollups=False)
+        assert capsys.readouterr().out == ''
+    finally:
+        configure(verbose=verbose)
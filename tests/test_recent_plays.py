@@ -0,0 +1,97 @@
+import os
+import json
+import asyncio
+
+import pandas as pd
+from aiohttp import web
+
+from conftest import serve
+from spotify_api import TokenCache, UserClient
+from column_store import COLUMNS_DIR, has_mapped_columns, load_mapped
+from recent_plays import load_state, poll_async, poll_once
+
+
+def item(played_at, name):
+    return {
+        'played_at': played_at,
+        'track': {
+            'name': name,
+            'uri': f"spotify:track:{name.lower()}",
+            'duration_ms': 200_000,
+            'artists': [{'name': 'Artist'}],
+            'album': {'name': 'Album', 'images': [{'url': f"https://img/{name}"}]},
+            'external_urls': {'spotify': f"https://open.spotify.com/track/{name.lower()}"},
+        },
+    }
+
+def recently_played(pages, calls):
+    # Serves pages[n] to the n-th request, or a status code in its place
+    async def handler(request):
+        calls.append(dict(request.query))
+        page = pages[min(len(calls), len(pages)) - 1]
+        if isinstance(page, int):
+            return web.json_response({'error': {'status': page}}, status=page)
+        return web.json_response({'items': page, 'next': None, 'cursors': None})
+    return handler
+
+async def refresh_token_endpoint(request):
+    assert (await request.post())['grant_type'] == 'refresh_token'
+    return web.json_response({'access_token': 'token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+def client(base_url):
+    return UserClient('refresh', client_id='id', client_secret='secret', base_url=base_url,
+                      token_url=f"{base_url}/token", concurrency=1, token_cache=TokenCache(None))
+
+def test_polls_add_new_plays_to_the_dataset(tmp_path):
+    poll_dir, dataset = str(tmp_path / 'recent_plays'), str(tmp_path / 'spotify_data')
+    recent_tracks = str(tmp_path / 'recent_tracks.json')
+    calls = []
+    pages = [[item('2024-01-01T10:00:00.000Z', 'One'), item('2024-01-01T10:05:00.000Z', 'Two')],
+             [item('2024-01-01T10:05:00.000Z', 'Two'), item('2024-01-01T10:10:00.000Z', 'Three')]]
+
+    async def run():
+        routes = [web.post('/token', refresh_token_endpoint), web.get('/me/player/recently-played', recently_played(pages, calls))]
+        async with serve(routes) as base_url:
+            async with client(base_url) as api:
+                first = await poll_once(api, poll_dir, dataset, recent_tracks)
+                inode = os.stat(os.path.join(dataset, COLUMNS_DIR, 'ts.npy')).st_ino
+                second = await poll_once(api, poll_dir, dataset, recent_tracks)
+                return first, second, inode
+
+    first, second, inode = asyncio.run(run())
+
+    assert (first, second) == (2, 1)
+    # The second poll asks for plays after the cursor the first one saved
+    assert 'after' not in calls[0]
+    assert int(calls[1]['after']) == pd.Timestamp('2024-01-01T10:05:00Z').value // 1_000_000
+    assert load_state(poll_dir)['plays'] == 3
+    assert has_mapped_columns(dataset)
+    assert os.stat(os.path.join(dataset, COLUMNS_DIR, 'ts.npy')).st_ino == inode
+    assert list(load_mapped(dataset)['track_name']) == ['One', 'Two', 'Three']
+    with open(recent_tracks, 'r', encoding='utf-8') as file:
+        tracks = json.load(file)
+    assert [track['name'] for track in tracks] == ['Three', 'Two']
+    assert tracks[0] == {'name': 'Three', 'artists': 'Artist', 'album': 'Album',
+                         'link': 'https://open.spotify.com/track/three', 'album_image': 'https://img/Three'}
+
+def test_a_failed_poll_does_not_stop_the_poller(tmp_path):
+    poll_dir, dataset = str(tmp_path / 'recent_plays'), str(tmp_path / 'spotify_data')
+    calls = []
+    pages = [403, [item('2024-01-01T10:00:00.000Z', 'One')], []]
+
+    async def run():
+        routes = [web.post('/token', refresh_token_endpoint), web.get('/me/player/recently-played', recently_played(pages, calls))]
+        async with serve(routes) as base_url:
+            async with client(base_url) as api:
+                poller = asyncio.ensure_future(poll_async(api, poll_dir, dataset, interval=0.01))
+                while len(calls) < 3 and not poller.done():
+                    await asyncio.sleep(0.01)
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+                return poller
+
+    poller = asyncio.run(run())
+
+    assert poller.cancelled()
+    assert load_state(poll_dir)['plays'] == 1
+    assert list(load_mapped(dataset)['track_name']) == ['One']
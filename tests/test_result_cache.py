@@ -0,0 +1,73 @@
+import time
+import pickle
+
+from conftest import play
+from charts import defer_rendering
+from result_cache import ResultCache
+import data_analysis
+
+
+COMMANDS = ['skips', 'sessions', 'trends']
+
+def history(day, tracks=3):
+    return [play(f'2024-01-{day:02d}T10:{minute:02d}:00Z', track=f'T{minute % tracks}', uri=f'spotify:track:t{minute % tracks}',
+                 skipped=minute % 2 == 0) for minute in range(0, 60, 5)]
+
+def test_results_are_recomputed_only_when_their_inputs_change(ingest, tmp_path):
+    dataset = ingest({'Streaming_History_Audio_2024.json': history(1)})
+    cache = ResultCache(str(tmp_path / 'cache'))
+
+    def misses(**options):
+        cache.hits = cache.misses = 0
+        with defer_rendering():
+            results, _ = data_analysis.run_analyses(dataset, COMMANDS, cache=cache, **options)
+        return cache.misses, results
+
+    assert misses()[0] == 3
+    assert misses()[0] == 0
+    # Each parameter only invalidates the commands that read it
+    assert misses(min_plays=2)[0] == 1
+    assert misses(session_gap=45)[0] == 1
+    assert misses(period='month')[0] == 1
+    assert misses(session_gap=45)[0] == 0
+
+    # A new part changes every command's inputs
+    ingest({'Streaming_History_Audio_2024_2.json': history(2)})
+    missed, results = misses()
+    assert missed == 3
+    assert results['sessions'][0]['total_sessions'] == 2
+
+    # So does a rewritten one
+    ingest({'Streaming_History_Audio_2024_2.json': history(2, tracks=2)})
+    missed, results = misses()
+    assert missed == 3
+    assert results['sessions'][0]['total_sessions'] == 2
+
+def test_least_recently_used_results_are_evicted(tmp_path):
+    value = b'x' * 1000
+    size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    cache = ResultCache(str(tmp_path), max_bytes=3 * size)
+
+    # Entries are ordered by modification time, which has a coarse clock
+    for key in 'abc':
+        cache.put(key, value)
+        time.sleep(0.02)
+    assert cache.get('a') == value
+    time.sleep(0.02)
+    cache.put('d', value)
+
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == [value] * 3
+    # An entry over the whole budget is not stored
+    cache.put('e', b'x' * 4 * size)
+    assert cache.get('e') is None
+    assert len(cache.entries()) == 3
+
+def test_cache_size_option(ingest, tmp_path):
+    dataset = ingest({'Streaming_History_Audio_2024.json': history(1)})
+    cache_dir = tmp_path / 'cache'
+
+    data_analysis.main(['skips', '--data', dataset, '--cache-dir', str(cache_dir), '--cache-size', '0'])
+    assert not list(cache_dir.glob('*.pkl'))
+    data_analysis.main(['skips', '--data', dataset, '--cache-dir', str(cache_dir)])
+    assert len(list(cache_dir.glob('*.pkl'))) == 1
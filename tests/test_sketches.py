@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+
+from sketches import CountMinSketch, HyperLogLog, SpaceSaving
+
+
+def zipf_stream(size=200_000, keys=2_000, exponent=1.2, seed=7):
+    # Keys drawn with probability proportional to 1 / rank ** exponent
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, keys + 1) ** exponent
+    ranks = rng.choice(keys, size=size, p=weights / weights.sum())
+    return pd.Series(np.char.add('key', ranks.astype(str)))
+
+def thirds(values):
+    return np.array_split(values, 3)
+
+def test_hyperloglog_is_within_its_error_on_a_known_cardinality():
+    values = pd.Series(np.arange(250_000)).astype(str)
+    sketch = HyperLogLog.from_error(0.01)
+    standard_error = 1.04 / np.sqrt(len(sketch.registers))
+    assert standard_error <= 0.01
+
+    for chunk in np.array_split(values, 10):
+        sketch.add(chunk)
+    assert abs(sketch.count() - len(values)) <= 3 * standard_error * len(values)
+    # Repeats do not count again
+    sketch.add(values[:1000])
+    assert abs(sketch.count() - len(values)) <= 3 * standard_error * len(values)
+
+def test_merges_are_associative_and_match_one_sketch():
+    values = zipf_stream(30_000)
+    first, second, third = thirds(values)
+
+    def hll(chunk):
+        return HyperLogLog(12).add(chunk)
+
+    left = hll(first).merge(hll(second)).merge(hll(third))
+    right = hll(first).merge(hll(second).merge(hll(third)))
+    np.testing.assert_array_equal(left.registers, right.registers)
+    np.testing.assert_array_equal(left.registers, hll(values).registers)
+
+    def cms(chunk):
+        return CountMinSketch(epsilon=0.01).add(chunk)
+
+    left = cms(first).merge(cms(second)).merge(cms(third))
+    right = cms(first).merge(cms(second).merge(cms(third)))
+    np.testing.assert_array_equal(left.table, right.table)
+    np.testing.assert_array_equal(left.table, cms(values).table)
+
+    # With room for every key the summaries are exact, so any grouping gives the same counts
+    def summary(chunk):
+        return SpaceSaving(k=5_000).add(chunk)
+
+    left = summary(first).merge(summary(second)).merge(summary(third)).top(50)
+    right = summary(first).merge(summary(second).merge(summary(third))).top(50)
+    pd.testing.assert_series_equal(left, right)
+    pd.testing.assert_series_equal(left, values.value_counts().head(50).astype('float64').rename('count').rename_axis(None),
+                                   check_index=False)
+
+def test_count_min_never_undercounts_and_stays_within_its_bound():
+    values = zipf_stream()
+    sketch = CountMinSketch(epsilon=0.001, delta=0.01).add(values)
+    exact = values.value_counts()
+
+    estimates = sketch.estimate(exact.index.to_series())
+    assert (estimates >= exact.to_numpy()).all()
+    # The bound holds for each key with probability 1 - delta
+    assert ((estimates - exact.to_numpy()) <= 0.001 * len(values)).mean() >= 0.99
+
+def test_space_saving_finds_the_top_keys_of_a_zipfian_stream():
+    values = zipf_stream()
+    exact = values.value_counts()
+    k = 100
+
+    summary = SpaceSaving(k)
+    for chunk in np.array_split(values, 20):
+        summary.add(chunk)
+    merged = SpaceSaving(k).add(values[:100_000]).merge(SpaceSaving(k).add(values[100_000:]))
+
+    for sketch in (summary, merged):
+        top = sketch.top(10)
+        assert list(top.index) == list(exact.index[:10])
+        # Counts are overestimated by at most total / k
+        overestimate = top.to_numpy() - exact[top.index].to_numpy()
+        assert ((overestimate >= 0) & (overestimate <= len(values) / k)).all()
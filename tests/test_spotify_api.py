@@ -0,0 +1,102 @@
+import time
+import asyncio
+import email.utils
+
+from aiohttp import web
+
+from conftest import play, serve, token_endpoint
+import spotify_api
+from spotify_api import SpotifyClient, TokenCache, retry_after_seconds
+from enrichment import enrich_async, load_track_metadata
+
+
+def client(base_url, concurrency=2):
+    return SpotifyClient('id', 'secret', base_url=base_url, token_url=f"{base_url}/token",
+                         concurrency=concurrency, token_cache=TokenCache(None))
+
+def test_retry_after_as_seconds_or_http_date():
+    assert retry_after_seconds('3') == 3
+    assert retry_after_seconds(None) == spotify_api.DEFAULT_RETRY_AFTER
+    assert 8 < retry_after_seconds(email.utils.formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert retry_after_seconds(email.utils.formatdate(time.time() - 10, usegmt=True)) == 0
+    assert retry_after_seconds('soon') == spotify_api.DEFAULT_RETRY_AFTER
+
+def test_rate_limits_do_not_use_up_the_retries():
+    calls = []
+
+    async def tracks(request):
+        calls.append(request)
+        if len(calls) <= spotify_api.MAX_RETRIES + 2:
+            return web.json_response({}, status=429, headers={'Retry-After': '0'})
+        return web.json_response({'tracks': []})
+
+    async def run():
+        async with serve([web.post('/token', token_endpoint), web.get('/tracks', tracks)]) as base_url:
+            async with client(base_url) as api:
+                return await api.get('/tracks'), api.throttled
+
+    body, throttled = asyncio.run(run())
+    assert body == {'tracks': []}
+    assert throttled == spotify_api.MAX_RETRIES + 2
+
+def test_queued_requests_wait_out_a_rate_limit_pause():
+    arrivals = []
+    pause = 0.3
+
+    async def tracks(request):
+        arrivals.append(time.monotonic())
+        if len(arrivals) == 1:
+            return web.json_response({}, status=429, headers={'Retry-After': str(pause)})
+        await asyncio.sleep(0.02)
+        return web.json_response({'tracks': []})
+
+    async def run():
+        async with serve([web.post('/token', token_endpoint), web.get('/tracks', tracks)]) as base_url:
+            async with client(base_url, concurrency=2) as api:
+                await asyncio.gather(*(api.get('/tracks') for _ in range(10)))
+
+    asyncio.run(run())
+    limited_at = arrivals[0]
+    # The request in flight with the throttled one may land right away; nothing else may until the pause is over
+    during_pause = [arrival for arrival in arrivals[1:] if limited_at + 0.05 < arrival < limited_at + pause - 0.02]
+    assert during_pause == []
+    assert len(arrivals) == 11
+
+def test_enrichment_against_a_mock_api(ingest):
+    dataset = ingest({'Streaming_History_Audio_2024.json': [
+        play('2024-01-01T10:00:00Z', uri=f'spotify:track:t{number}') for number in range(120)
+    ] + [play('2024-01-02T10:00:00Z', uri='spotify:track:gone')]})
+    requests = {'tracks': 0}
+
+    async def tracks(request):
+        requests['tracks'] += 1
+        ids = request.query['ids'].split(',')
+        assert len(ids) <= 50
+        if requests['tracks'] == 1:
+            return web.json_response({}, status=429, headers={'Retry-After': '0.05'})
+        return web.json_response({'tracks': [None if id == 'gone' else {
+            'id': id, 'name': id, 'duration_ms': 200_000, 'album': {'id': 'al', 'images': []},
+            'artists': [{'id': 'ar'}]} for id in ids]})
+
+    async def artists(request):
+        return web.json_response({'artists': [{'id': id, 'name': id, 'genres': ['pop']} for id in request.query['ids'].split(',')]})
+
+    async def features(request):
+        return web.json_response({}, status=403)
+
+    async def run():
+        routes = [web.post('/token', token_endpoint), web.get('/tracks', tracks), web.get('/artists', artists),
+                  web.get('/audio-features', features)]
+        async with serve(routes) as base_url:
+            async with client(base_url, concurrency=4) as api:
+                first = await enrich_async(api, dataset)
+                second = await enrich_async(api, dataset)
+                return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {'tracks': 121, 'artists': 1, 'features': 0}
+    # Everything is cached, including the id the API did not know
+    assert second == {'tracks': 0, 'artists': 0, 'features': 0}
+    metadata = load_track_metadata(dataset)
+    assert len(metadata) == 120
+    assert metadata['genres'].iloc[0] == ['pop']